@@ -0,0 +1,218 @@
+import heapq
+import logging
+
+from graph import PumpGraph
+
+logger = logging.getLogger(__name__)
+
+def solve_tree(powers, values, parents, budget):
+    # Exact 0/1 knapsack when every item has at most one parent. Items are laid out in
+    # depth first order so that skipping an item skips its whole subtree, and only the
+    # Pareto optimal (power, value) combinations are kept at each position, which is far
+    # fewer than one entry per watt of budget.
+    n = len(powers)
+    if budget < 0:
+        return []
+    children = [[] for i in range(n)]
+    roots = []
+    for i in range(n):
+        if parents[i]:
+            children[parents[i][0]].append(i)
+        else:
+            roots.append(i)
+    order = []
+    end = []
+    position = {}
+    stack = [(i, False) for i in reversed(roots)]
+    while stack:
+        i, done = stack.pop()
+        if done:
+            end[position[i]] = len(order)
+            continue
+        position[i] = len(order)
+        order.append(i)
+        end.append(None)
+        stack.append((i, True))
+        stack.extend((c, False) for c in reversed(children[i]))
+    if len(order) != n:
+        raise ValueError('dependency cycle between loads')
+
+    # fronts[k] lists (power, value, taken, source) for the items from position k on, by
+    # increasing power and value. source is the index of the state it extends in
+    # fronts[k + 1] when the item was taken, in fronts[end[k]] otherwise.
+    fronts = [None] * (n + 1)
+    fronts[n] = [(0, 0, False, None)]
+    for k in range(n - 1, -1, -1):
+        w, v = powers[order[k]], values[order[k]]
+        skip = fronts[end[k]]
+        take = fronts[k + 1]
+        front = []
+        best = float('-inf')
+        a, b = 0, 0
+        while a < len(skip) or b < len(take):
+            if b < len(take) and take[b][0] + w > budget:
+                b = len(take)
+                continue
+            if b == len(take) or (a < len(skip) and skip[a][0] <= take[b][0] + w):
+                state = (skip[a][0], skip[a][1], False, a)
+                a += 1
+            else:
+                state = (take[b][0] + w, take[b][1] + v, True, b)
+                b += 1
+            if state[1] > best:
+                best = state[1]
+                front.append(state)
+        fronts[k] = front
+
+    selected = []
+    k, s = 0, len(fronts[0]) - 1
+    while k < n:
+        state = fronts[k][s]
+        s = state[3]
+        if state[2]:
+            selected.append(order[k])
+            k += 1
+        else:
+            k = end[k]
+    return sorted(selected)
+
+# Nodes explored by solve_dag before it settles for the best selection found so far
+MAX_NODES = 5000
+
+def solve_dag(powers, values, parents, budget, max_nodes=MAX_NODES):
+    # Exact 0/1 knapsack with general precedence constraints by branch and bound: an item
+    # can only be selected together with all of its parents. Past max_nodes the search
+    # stops with the best selection found so far, at least as good as the greedy one and
+    # the one of solve_tree on the first parents that it starts from.
+    n = len(powers)
+    if budget < 0:
+        return []
+    density = [values[i] / powers[i] if powers[i] > 0 else float('inf') for i in range(n)]
+
+    # Decide parents before their children, densest items first otherwise
+    children = [[] for i in range(n)]
+    indegree = [len(parents[i]) for i in range(n)]
+    for i in range(n):
+        for p in parents[i]:
+            children[p].append(i)
+    heap = [(-density[i], i) for i in range(n) if not indegree[i]]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        d, i = heapq.heappop(heap)
+        order.append(i)
+        for c in children[i]:
+            indegree[c] -= 1
+            if not indegree[c]:
+                heapq.heappush(heap, (-density[c], c))
+    if len(order) != n:
+        raise ValueError('dependency cycle between loads')
+
+    def feasible(selection):
+        # Drops the items missing one of their parents, in decision order
+        chosen = [False] * n
+        used = 0
+        for i in order:
+            if i in selection and used + powers[i] <= budget and all(chosen[p] for p in parents[i]):
+                chosen[i] = True
+                used += powers[i]
+        return chosen
+
+    # Starting points: every item taken when it fits in decision order, and the exact
+    # solution when only the first parent of each item counts, repaired
+    best = {'value': -1, 'chosen': None, 'nodes': 0}
+    tree = solve_tree(powers, values, [p[:1] for p in parents], budget)
+    for chosen in (feasible(set(range(n))), feasible(set(tree))):
+        value = sum(values[i] for i in range(n) if chosen[i])
+        if value > best['value']:
+            best['value'] = value
+            best['chosen'] = chosen
+
+    # Items still to be decided at each depth, by decreasing density for the bound
+    remaining = [sorted(order[depth:], key=lambda i: -density[i]) for depth in range(n + 1)]
+    chosen = [False] * n
+
+    # Number of parents of each item left out or unreachable, such items can not be taken
+    dead = [0] * n
+
+    def leave_out(i, delta):
+        # delta 1 when i is left out, -1 when the decision is undone
+        for c in children[i]:
+            dead[c] += delta
+            if dead[c] == (1 if delta > 0 else 0):
+                leave_out(c, delta)
+
+    def bound(depth, capacity):
+        # Fractional relaxation of the items still reachable, ignoring their precedence
+        total = 0
+        for i in remaining[depth]:
+            if dead[i]:
+                continue
+            if powers[i] <= capacity:
+                capacity -= powers[i]
+                total += values[i]
+            else:
+                total += values[i] * capacity / powers[i]
+                break
+        return total
+
+    def branch(depth, capacity, value):
+        best['nodes'] += 1
+        if value > best['value']:
+            best['value'] = value
+            best['chosen'] = list(chosen)
+        if depth == n or best['nodes'] > max_nodes or value + bound(depth, capacity) <= best['value']:
+            return
+        i = order[depth]
+        if dead[i]:
+            branch(depth + 1, capacity, value)
+            return
+        if powers[i] <= capacity:
+            chosen[i] = True
+            branch(depth + 1, capacity - powers[i], value + values[i])
+            chosen[i] = False
+        leave_out(i, 1)
+        branch(depth + 1, capacity, value)
+        leave_out(i, -1)
+
+    branch(0, budget, 0)
+    if best['nodes'] > max_nodes:
+        logger.debug('allocation search stopped after %s nodes', max_nodes)
+    return [i for i in range(n) if best['chosen'][i]]
+
+def solve(powers, values, parents, budget):
+    # Returns the indices of the items maximizing the total value within budget
+    if all(len(p) <= 1 for p in parents):
+        return solve_tree(powers, values, parents, budget)
+    return solve_dag(powers, values, parents, budget)
+
+class Allocator():
+    # Picks the set of pumps to run for the current surplus. Each eligible pump is worth
+    # its power weighted by its priority and by how much of its daily goal is left, the
+    # selection maximizes the total worth within the power budget.
+    def value(self, pump):
+        urgency = max(pump.desired_runtime - pump.runtime, 0) / pump.desired_runtime if pump.desired_runtime else 0
+        return pump.power * pump.priority * (1 + urgency)
+
+    def allocate(self, pumps, availability, forced=()):
+        graph = PumpGraph.of(pumps)
+        pumps = graph.pumps
+        # Running pumps are already part of the consumption, their power is available to us
+        budget = availability + sum(p.power for p in pumps if p.is_running())
+        # A pump is not eligible anymore when it or one of its upstream pumps is done
+        eligible = graph.eligible()
+        # Pumps which have to run whatever the surplus, along with the pumps they are chained to
+        required = set(graph.closure([p for p in forced if p in eligible]))
+        budget -= sum(p.power for p in required)
+        candidates = [p for p in pumps if p in eligible and p not in required]
+        index = {p: i for i, p in enumerate(candidates)}
+        selected = solve([p.power for p in candidates],
+                         [self.value(p) for p in candidates],
+                         [[index[u] for u in p.upstreams if u in index] for p in candidates],
+                         budget)
+        selected = required.union(candidates[i] for i in selected)
+        remaining = budget - sum(p.power for p in selected if p not in required)
+        selected = [p for p in pumps if p in selected]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('allocated %sW to %s, %sW left', budget, ', '.join(p.name for p in selected) or 'no pump', remaining)
+        return selected, remaining
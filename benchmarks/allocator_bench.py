@@ -0,0 +1,37 @@
+# Times the allocation solver on random sets of loads with chaining constraints.
+# Run from the repository root with: python3 benchmarks/allocator_bench.py
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from allocator import solve_tree, solve_dag
+
+RUNS = 20
+
+def random_loads(rng, n, max_parents):
+    # Values follow the Allocator: power weighted by priority and remaining runtime
+    powers = [rng.randint(100, 3000) for i in range(n)]
+    values = [p * rng.uniform(1, 2) * rng.choice([1, 1, 2]) for p in powers]
+    parents = [rng.sample(range(i), min(i, rng.randint(1, max_parents))) if i and rng.random() < 0.3 else [] for i in range(n)]
+    return powers, values, parents
+
+def bench(name, solver, sizes, max_parents):
+    rng = random.Random(1)
+    print(name)
+    print(f'{"loads":>6} {"mean ms":>10} {"max ms":>10}')
+    for n in sizes:
+        timings = []
+        for run in range(RUNS):
+            powers, values, parents = random_loads(rng, n, max_parents)
+            budget = rng.uniform(0.2, 0.6) * sum(powers)
+            start = time.perf_counter()
+            solver(powers, values, parents, budget)
+            timings.append(time.perf_counter() - start)
+        print(f'{n:>6} {sum(timings) * 1000 / RUNS:>10.2f} {max(timings) * 1000:>10.2f}')
+
+if __name__ == '__main__':
+    bench('single upstream per load (Pareto front dynamic programming)', solve_tree, [2, 4, 8, 16, 24, 32, 48, 64], 1)
+    bench('several upstreams per load (branch and bound)', solve_dag, [2, 4, 8, 12, 16, 20, 24, 32, 48, 64], 3)
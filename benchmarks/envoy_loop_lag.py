@@ -0,0 +1,45 @@
+# Measures event loop lag while the Envoy gateway is slow to answer.
+#
+# A local HTTP server stands in for the gateway and delays each answer, meanwhile
+# a probe task records how late its periodic wake ups are. Run from the repository
+# root with: python3 benchmarks/envoy_loop_lag.py
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from envoy import Envoy
+from stubs import EnvoyStub
+
+DELAY = 3
+POLLS = 3
+PROBE_INTERVAL = 0.01
+MAX_LAG = 0.05
+
+async def probe(lags):
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.monotonic() - start - PROBE_INTERVAL)
+
+async def run(envoy):
+    lags = []
+    task = asyncio.get_running_loop().create_task(probe(lags))
+    for i in range(POLLS):
+        start = time.monotonic()
+        availability = await envoy.update()
+        print(f'poll {i}: availability {availability}W in {time.monotonic() - start:.2f}s')
+    task.cancel()
+    return lags
+
+if __name__ == '__main__':
+    stub = EnvoyStub(delay=DELAY)
+    envoy = Envoy(stub.address)
+    lags = asyncio.run(run(envoy))
+    stub.close()
+    worst = max(lags)
+    print(f'{len(lags)} probes, max loop lag {worst * 1000:.1f}ms, mean {sum(lags) * 1000 / len(lags):.1f}ms')
+    print('PASS' if worst < MAX_LAG else 'FAIL')
+    sys.exit(0 if worst < MAX_LAG else 1)
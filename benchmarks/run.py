@@ -0,0 +1,290 @@
+# Benchmark suite for the control and messaging hot paths.
+#
+# Each case is timed at several scales and the results are written as JSON along with
+# the commit they were measured on, so that runs can be compared across commits:
+#
+#   python3 benchmarks/run.py                          run everything, print a table
+#   python3 benchmarks/run.py -k mqtt -o after.json    run matching cases, save results
+#   python3 benchmarks/run.py --compare before.json    flag cases slower than a saved run
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from pump import Pump
+from graph import PumpGraph
+from clock import VirtualClock
+from envoy import Envoy, eim_watts, parse_production, parse_readings
+from pvsystem import PVSystem
+from mqttclient import MQTTClient
+from brokerstub import BrokerStub
+from stubs import EnvoyStub, PRODUCTION_JSON, METERS_JSON, READINGS_JSON
+import startup
+
+SCALES = [1, 10, 100, 500]
+# Minimum wall time of a timed batch and number of batches per case
+MIN_TIME = 0.05
+REPEAT = 5
+
+def measure(fn, min_time=MIN_TIME, repeat=REPEAT):
+    # Calibrates the number of calls per batch then returns the per call times of each batch
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+def measure_async(make_coroutine, number, repeat=REPEAT):
+    # Runs number awaits per batch on a fresh event loop
+    async def run():
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            for j in range(number):
+                await make_coroutine()
+            timings.append((time.perf_counter() - start) / number)
+        return timings
+    return asyncio.run(run())
+
+def result(name, params, timings, unit='call'):
+    return {
+        'name': name,
+        'params': params,
+        'unit': unit,
+        'mean_us': statistics.mean(timings) * 1e6,
+        'median_us': statistics.median(timings) * 1e6,
+        'min_us': min(timings) * 1e6,
+        'stdev_us': statistics.stdev(timings) * 1e6 if len(timings) > 1 else 0,
+    }
+
+def make_pumps(count, clock, chained=False, running=False):
+    pumps = []
+    for i in range(count):
+        p = Pump(f'pump{i}', 500 + i, 3600 * 24, clock=clock)
+        if chained and pumps:
+            p.chain(pumps[-1])
+        if running:
+            p.on_since = clock.time()
+        pumps.append(p)
+    return pumps
+
+def bench_pump_update():
+    # Every pump updated once per tick, half of them running
+    clock = VirtualClock(1672574400)
+    for count in SCALES:
+        pumps = make_pumps(count, clock)
+        for p in pumps[::2]:
+            p.on_since = clock.time()
+            p.add_update_callback(lambda pump, progress: None)
+        def tick():
+            for p in pumps:
+                p.update()
+        yield result('pump.update', {'pumps': count}, measure(tick), 'tick')
+
+def bench_can_run_chain():
+    # Evaluating the last pump of a chain walks back to the first one
+    clock = VirtualClock(1672574400)
+    for depth in SCALES:
+        pumps = make_pumps(depth, clock, chained=True, running=True)
+        pumps[-1].on_since = None
+        last = pumps[-1]
+        yield result('pump.can_run_chain', {'depth': depth}, measure(lambda: last.can_run(10000)))
+        yield result('pump.should_run_chain', {'depth': depth}, measure(last.should_run))
+        # What a control tick evaluates, every pump of the chain at once
+        graph = PumpGraph(pumps)
+        yield result('graph.eligible_chain', {'depth': depth}, measure(graph.eligible))
+
+def bench_pvsystem_averages():
+    clock = VirtualClock(1672574400)
+    for averaging in ('sma', 'ewma', 'time'):
+        for window in (5, 60, 300):
+            device = PVSystem(averaging, window, clock)
+            for i in range(window * 2):
+                clock.advance(1)
+                device.production = 2000 + i % 7
+                device.consumption = 500 + i % 5
+            def read_write():
+                clock.advance(1)
+                device.production = 2000
+                device.consumption = 500
+                return device.production - device.consumption
+            params = {'averaging': averaging, 'window': window}
+            yield result('pvsystem.read', params, measure(lambda: device.production - device.consumption))
+            yield result('pvsystem.append_read', params, measure(read_write))
+
+def bench_envoy_update():
+    # Full poll through the executor and a keep-alive connection to a local gateway, with
+    # production.json and with the meter readings found by probing the meters API
+    stub = EnvoyStub()
+    try:
+        for endpoint in ('production', 'auto'):
+            envoy = Envoy(stub.address, endpoint=endpoint)
+            asyncio.run(envoy.update())
+            stub.requests = stub.bytes_sent = 0
+            timings = measure_async(envoy.update, 50)
+            yield result('envoy.update', {'endpoint': endpoint, 'bytes': stub.bytes_sent // stub.requests}, timings, 'poll')
+    finally:
+        stub.close()
+    # Decoding of the polled document alone, whole JSON decoding against the field scanners
+    production = json.dumps(PRODUCTION_JSON).encode()
+    readings = json.dumps(READINGS_JSON).encode()
+    meters = {m['eid']: m['measurementType'] for m in METERS_JSON}
+    def decode_production():
+        data = json.loads(production)
+        return eim_watts(data['production']), eim_watts(data['consumption'])
+    def decode_readings():
+        return {m['eid']: m['activePower'] for m in json.loads(readings) if m['eid'] in meters}
+    yield result('envoy.parse', {'endpoint': 'production', 'parser': 'json'}, measure(decode_production))
+    yield result('envoy.parse', {'endpoint': 'production', 'parser': 'scan'}, measure(lambda: parse_production(production)))
+    yield result('envoy.parse', {'endpoint': 'readings', 'parser': 'json'}, measure(decode_readings))
+    yield result('envoy.parse', {'endpoint': 'readings', 'parser': 'scan'}, measure(lambda: parse_readings(readings, meters)))
+
+def bench_mqtt_dispatch():
+    msg = SimpleNamespace(topic='', payload=b'ON')
+    for count in SCALES:
+        # Routing a command topic to its pump, without the network
+        client = MQTTClient({})
+        pumps = make_pumps(count, VirtualClock(1672574400))
+        client.attach(pumps, Mock(), lambda pump, payload: None)
+        topics = [f'homeassistant/switch/pipump_12345/{p.name}/set' for p in pumps]
+        state = {'i': 0}
+        def dispatch():
+            msg.topic = topics[state['i'] % count]
+            state['i'] += 1
+            client.on_switch_message(None, None, msg)
+        yield result('mqtt.on_switch_message', {'pumps': count}, measure(dispatch), 'message')
+    for count in SCALES:
+        timings, subscriptions = asyncio.run(mqtt_round_trip(count))
+        r = result('mqtt.broker_dispatch', {'pumps': count}, timings, 'message')
+        r['subscriptions'] = subscriptions
+        yield r
+
+async def mqtt_round_trip(count, messages=2000):
+    # Commands pushed by an in-process broker until the client dispatched all of them
+    broker = BrokerStub()
+    port = await broker.start()
+    received = asyncio.Event()
+    dispatched = {'count': 0, 'target': 0}
+    def on_switch(pump, payload):
+        dispatched['count'] += 1
+        if dispatched['count'] >= dispatched['target']:
+            received.set()
+    pumps = make_pumps(count, VirtualClock(1672574400))
+    client = MQTTClient({'host': '127.0.0.1', 'port': port, 'discovery': False, 'coalesce_window': 0})
+    client.attach(pumps, Mock(), on_switch)
+    task = asyncio.get_running_loop().create_task(client.task())
+    # Announcements publish the state of every pump once subscriptions are sent
+    while len(broker.published) < 2 * count + 1:
+        await asyncio.sleep(0.01)
+    subscriptions = len(broker.subscribed)
+    timings = []
+    for i in range(REPEAT):
+        received.clear()
+        dispatched['target'] = dispatched['count'] + messages
+        start = time.perf_counter()
+        for j in range(messages):
+            broker.publish(f'homeassistant/switch/pipump_12345/pump{j % count}/set', 'ON')
+        await asyncio.wait_for(received.wait(), 30)
+        timings.append((time.perf_counter() - start) / messages)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await broker.stop()
+    return timings, subscriptions
+
+def bench_startup():
+    # Process start to the first control tick, see startup.py
+    for snapshot, timings in startup.measure(REPEAT).items():
+        yield result('startup.first_tick', {'snapshot': snapshot}, timings, 'start')
+
+BENCHMARKS = {
+    'pump_update': bench_pump_update,
+    'can_run_chain': bench_can_run_chain,
+    'pvsystem_averages': bench_pvsystem_averages,
+    'envoy_update': bench_envoy_update,
+    'mqtt_dispatch': bench_mqtt_dispatch,
+    'startup': bench_startup,
+}
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def key(r):
+    return r['name'] + ' ' + ' '.join(f'{k}={v}' for k, v in sorted(r['params'].items()))
+
+def compare(results, baseline, threshold):
+    # Returns the cases whose median got slower than threshold times the baseline
+    before = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = before.get(key(r))
+        if not old:
+            continue
+        ratio = r['median_us'] / old['median_us'] if old['median_us'] else 1
+        print(f'{key(r):50} {old["median_us"]:12.2f} -> {r["median_us"]:12.2f} us  x{ratio:.2f}')
+        if ratio > threshold:
+            regressions.append(key(r))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the pipump hot paths')
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('-o', dest='output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = []
+    for name, bench in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        for r in bench():
+            extra = f'  {r["subscriptions"]} subscriptions' if 'subscriptions' in r else ''
+            print(f'{key(r):50} {r["median_us"]:12.2f} us/{r["unit"]}{extra}')
+            results.append(r)
+
+    report = {
+        'commit': commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
@@ -0,0 +1,83 @@
+# Measures the time from process start to the first pump decision.
+#
+# Each run starts a fresh interpreter that goes through the same steps as main.py: load
+# the configuration, build the groups and run one control tick against a local Envoy
+# stand-in. Runs are made with and without the configuration snapshot of a previous run.
+# Run from the repository root with: python3 benchmarks/startup.py
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RUNS = 10
+
+CONFIG = '''mqtt:
+  uid: startup
+  host: 127.0.0.1
+  port: 1
+pvsystem:
+  type: envoy
+  ip: {address}
+  user: ''
+  password: ''
+  serial: 0
+  token_file: {directory}/envoy_token
+state:
+  directory: {directory}
+pumps:
+  - name: Main
+    power: 1650
+    runtime: 3
+    gpio: 8
+  - name: Polaris
+    power: 1100
+    runtime: 0.5
+    gpio: 10
+    chained: Main
+'''
+
+def child(path):
+    sys.path.insert(0, ROOT)
+    from config import Config
+    config = Config(path)
+    groups = config.load_groups()
+    asyncio.run(groups[0].controller.tick())
+    # Wall clock so that the parent can compare it with the time it spawned us
+    print(time.time())
+    for group in groups:
+        group.close()
+
+def run(path, snapshot):
+    cache = os.path.join(os.path.dirname(path), '.config.yaml.cache')
+    if not snapshot and os.path.exists(cache):
+        os.remove(cache)
+    start = time.time()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', path], capture_output=True, text=True, check=True).stdout
+    return float(out.split()[-1]) - start
+
+def measure(runs=RUNS):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stubs import EnvoyStub
+    stub = EnvoyStub()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.yaml')
+            with open(path, 'w') as f:
+                f.write(CONFIG.format(address=stub.address, directory=directory))
+            # Warm up the OS caches before timing anything
+            run(path, False)
+            return {snapshot: [run(path, snapshot) for i in range(runs)] for snapshot in (False, True)}
+    finally:
+        stub.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        for snapshot, timings in measure().items():
+            print(f'{"with" if snapshot else "without"} config snapshot: median {statistics.median(timings) * 1000:.0f} ms, '
+                  f'min {min(timings) * 1000:.0f} ms over {len(timings)} runs')
@@ -0,0 +1,82 @@
+# In-process stand-in for the Envoy gateway used by the benchmarks, the MQTT broker is tests/brokerstub.py
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PRODUCTION_JSON = {
+    'production': [
+        {'type': 'inverters', 'activeCount': 20, 'readingTime': 1672574917, 'wNow': 2480, 'whLifetime': 12345678},
+        {'type': 'eim', 'activeCount': 1, 'measurementType': 'production', 'readingTime': 1672574917, 'wNow': 2500.5,
+         'whLifetime': 12345678.9, 'varhLeadLifetime': 0.1, 'varhLagLifetime': 123456.7, 'vahLifetime': 14567890.1,
+         'rmsCurrent': 10.9, 'rmsVoltage': 241.2, 'reactPwr': 120.3, 'apprntPwr': 2620.1, 'pwrFactor': 0.95,
+         'whToday': 8000.1, 'whLastSevenDays': 90000.2, 'vahToday': 9000.3, 'varhLeadToday': 0.0, 'varhLagToday': 1000.4,
+         'lines': [{'wNow': 1250.2, 'whLifetime': 6000000.1, 'rmsCurrent': 5.4, 'rmsVoltage': 241.1} for i in range(3)]},
+    ],
+    'consumption': [
+        {'type': 'eim', 'activeCount': 1, 'measurementType': 'total-consumption', 'readingTime': 1672574917, 'wNow': 800.2,
+         'whLifetime': 22345678.9, 'rmsCurrent': 3.9, 'rmsVoltage': 241.2, 'reactPwr': 20.3, 'apprntPwr': 820.1, 'pwrFactor': 0.97,
+         'lines': [{'wNow': 266.7, 'whLifetime': 7000000.1, 'rmsCurrent': 1.3, 'rmsVoltage': 241.1} for i in range(3)]},
+        {'type': 'eim', 'activeCount': 1, 'measurementType': 'net-consumption', 'readingTime': 1672574917, 'wNow': -1700.3,
+         'whLifetime': 9345678.9, 'rmsCurrent': 7.1, 'rmsVoltage': 241.2, 'reactPwr': 100.3, 'apprntPwr': 1800.1, 'pwrFactor': -0.94,
+         'lines': [{'wNow': -566.8, 'whLifetime': 3000000.1, 'rmsCurrent': 2.4, 'rmsVoltage': 241.1} for i in range(3)]},
+    ],
+    'storage': [{'type': 'acb', 'activeCount': 0, 'readingTime': 0, 'wNow': 0, 'whNow': 0, 'state': 'idle'}],
+}
+
+# Meters of a three phase gateway and their readings as served by firmware 7 and later
+METERS_JSON = [
+    {'eid': 704643328, 'state': 'enabled', 'measurementType': 'production', 'phaseMode': 'three', 'phaseCount': 3, 'meteringStatus': 'normal', 'statusFlags': []},
+    {'eid': 704643584, 'state': 'enabled', 'measurementType': 'net-consumption', 'phaseMode': 'three', 'phaseCount': 3, 'meteringStatus': 'normal', 'statusFlags': []},
+]
+
+def meter_reading(eid, power):
+    reading = {'eid': eid, 'timestamp': 1672574917, 'actEnergyDlvd': 12345678.901, 'actEnergyRcvd': 1234.567, 'apparentEnergy': 14567890.123,
+               'reactEnergyLagg': 123456.789, 'reactEnergyLead': 0.123, 'instantaneousDemand': power, 'activePower': power,
+               'apparentPower': abs(power) * 1.05, 'reactivePower': 120.345, 'pwrFactor': 0.95, 'voltage': 241.234, 'current': 10.912, 'freq': 50.0}
+    channels = [dict(reading, eid=eid + 1073741825 + i, activePower=power / 3, instantaneousDemand=power / 3) for i in range(3)]
+    return dict(reading, channels=channels)
+
+READINGS_JSON = [meter_reading(704643328, 2500.5), meter_reading(704643584, -1700.3)]
+
+class EnvoyStub():
+    # Serves production.json and the meter endpoints over keep-alive HTTP/1.1, optionally slowly
+    def __init__(self, delay=0, documents=None):
+        documents = documents or {'/production.json': PRODUCTION_JSON, '/ivp/meters': METERS_JSON, '/ivp/meters/readings': READINGS_JSON}
+        bodies = {path: json.dumps(doc).encode() for path, doc in documents.items()}
+        stub = self
+        self.requests = 0
+        self.bytes_sent = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, don't let delayed ACKs stall them
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if delay:
+                    time.sleep(delay)
+                body = bodies.get(self.path.split('?')[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                stub.requests += 1
+                stub.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.address = f'127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
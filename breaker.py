@@ -0,0 +1,62 @@
+import logging
+
+import metrics
+from clock import system_clock
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker():
+    # Stops calling a source after threshold consecutive failures. Once open, one probe
+    # is let through after a delay doubling with every failed probe up to max_delay, the
+    # breaker closes again as soon as a call succeeds.
+    def __init__(self, name, threshold=3, min_delay=10, max_delay=600, clock=None):
+        self.name = name
+        self.threshold = threshold
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._clock = clock or system_clock
+        self.state = CLOSED
+        self._failures = 0
+        self._opened = 0
+        self._retry_at = 0
+        self._state_callbacks = []
+        self._gauge = metrics.pv_breaker_state.labels(source=name)
+
+    def add_state_callback(self, callback):
+        self._state_callbacks.append(callback)
+
+    def __set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        self._gauge.set((CLOSED, HALF_OPEN, OPEN).index(state))
+        for cb in self._state_callbacks:
+            cb(self, state)
+
+    def allow(self):
+        if self.state == OPEN and self._clock.time() >= self._retry_at:
+            self.__set_state(HALF_OPEN)
+        return self.state != OPEN
+
+    def success(self):
+        if self.state != CLOSED:
+            logger.info('%s answers again, closing circuit breaker', self.name)
+        self._failures = 0
+        self._opened = 0
+        self.__set_state(CLOSED)
+
+    def failure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.threshold:
+            delay = min(self.min_delay * 2 ** self._opened, self.max_delay)
+            self._opened += 1
+            self._retry_at = self._clock.time() + delay
+            if self.state == CLOSED:
+                logger.warning('%s failed %s times in a row, next attempt in %s seconds', self.name, self._failures, delay)
+            else:
+                logger.debug('probe of %s failed, next attempt in %s seconds', self.name, delay)
+            self.__set_state(OPEN)
@@ -0,0 +1,25 @@
+import time
+from datetime import datetime
+
+class SystemClock():
+    def time(self):
+        return time.time()
+
+    def today(self):
+        return datetime.fromtimestamp(self.time()).date()
+
+class VirtualClock(SystemClock):
+    # Time only moves when told to, used to replay whole days faster than real time
+    def __init__(self, start=0):
+        self._now = start
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def set(self, timestamp):
+        self._now = timestamp
+
+system_clock = SystemClock()
@@ -1,47 +1,316 @@
 import os
-import yaml
+import marshal
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
+import schema
 from pump import Pump
-from envoy import Envoy
-from mqttclient import MQTTClient
+from graph import PumpGraph
+from scheduler import Scheduler
+from statestore import StateStore
+from allocator import Allocator
+from controller import Controller
+from group import Group
+from logsetup import setup_logging
+from schema import validate, merge, ConfigError
+
+# Subsystems pulling heavy dependencies (requests, paho, numpy, yaml) are imported by the
+# loaders that need them so that unused ones do not delay the first control tick
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+def snapshot_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.cache')
+
+def snapshot_key(path):
+    # A snapshot is only valid for the file and schema it was made from
+    config = os.stat(path)
+    return [SNAPSHOT_VERSION, path, config.st_mtime_ns, config.st_size, config.st_ino, os.stat(schema.__file__).st_mtime_ns]
+
+def parse(path):
+    import yaml
+    # libyaml parses several times faster than the pure Python loader
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+    try:
+        with open(path, 'r') as cfgfile:
+            config = yaml.load(cfgfile, Loader=loader)
+    except yaml.YAMLError as e:
+        raise ConfigError(f'failed parsing {path}: {e}')
+    # Raises ConfigError pointing at the offending options
+    validate(config)
+    return config
+
+def load(path):
+    # Parsed and validated configuration, from the marshal snapshot written by a previous
+    # run when the file has not changed since
+    key = snapshot_key(path)
+    cache = snapshot_path(path)
+    try:
+        with open(cache, 'rb') as f:
+            cached_key, config = marshal.load(f)
+        if cached_key == key:
+            return config
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    config = parse(path)
+    try:
+        data = marshal.dumps([key, config])
+        with open(cache + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(cache + '.tmp', cache)
+    except (OSError, ValueError) as e:
+        # Values marshal does not support, like dates, or a read only directory
+        logger.debug('not caching configuration snapshot: %s', e)
+    return config
 
 class Config():
-    def __init__(self, filename):
+    def __init__(self, filename, name=None, config=None):
         self._filename = filename
-        with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), self._filename), 'r') as cfgfile:
-            self._config = yaml.load(cfgfile, Loader=yaml.FullLoader)
+        # Name of the group this configuration describes, None for a single site
+        self.name = name
+        if config is None:
+            config = load(self.__path(self._filename))
+        self._config = config
 
-    def load_pumps(self):
-        pumps = []
-        to_be_chained = []
+    @property
+    def path(self):
+        return self.__path(self._filename)
+
+    def get(self, key, default=None):
+        return self._config.get(key, default)
+
+    def section(self, name):
+        return self._config.get(name) or {}
+
+    @staticmethod
+    def __path(filename):
+        return os.path.join(os.path.abspath(os.path.dirname(__file__)), filename)
+
+    def __group_path(self, directory):
+        # Files of each group live in their own subdirectory
+        return self.__path(os.path.join(directory, self.name) if self.name else directory)
+
+    def groups(self):
+        # Each entry of groups is an independent site inheriting the top level sections
+        groups = self._config.get('groups')
+        if not groups:
+            return [self]
+        configs = []
+        uids = set()
+        pumps = {}
+        gpios = {}
+        for group in groups:
+            name = group.get('name')
+            if not name or any(c.name == name for c in configs):
+                raise ValueError(f'groups need a unique name, got {name}')
+            merged = merge(self._config, group)
+            uid = (merged.get('mqtt') or {}).get('uid')
+            if uid is not None:
+                if uid in uids:
+                    raise ValueError(f'group {name} reuses MQTT uid {uid}')
+                uids.add(uid)
+            # Groups leaving out pumps inherit the top level ones, two groups must not drive the same relay
+            for pump in merged.get('pumps') or []:
+                if pump.get('name') in pumps:
+                    raise ValueError(f'group {name} reuses pump {pump["name"]} of group {pumps[pump["name"]]}')
+                if pump.get('gpio') in gpios:
+                    raise ValueError(f'group {name} reuses GPIO {pump["gpio"]} of group {gpios[pump["gpio"]]}')
+                pumps[pump.get('name')] = name
+                gpios[pump.get('gpio')] = name
+            configs.append(Config(self._filename, name, merged))
+        return configs
+
+    def load_groups(self, profile=False):
+        configs = self.groups()
+        executor = None
+        if len(configs) > 1:
+            # Envoy polls of all the groups share a few worker threads
+            workers = min(len(configs), self._config.get('http_workers', 4))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='envoy')
+        return [c.load_group(executor, profile) for c in configs]
+
+    def load_group(self, executor=None, profile=False):
+        pumps = self.load_pumps()
+        store = self.load_statestore()
+        if store:
+            store.attach(pumps)
+        device = self.load_pvsystem(executor)
+        scheduler = self.load_scheduler()
+        recorder = self.load_recorder()
+        if device:
+            device.add_reading_callback(scheduler.on_readings)
+            if recorder:
+                recorder.attach(device, pumps)
+        planner = self.load_planner(recorder, pumps)
+        tracer = self.load_tracer(profile)
+        fallback = self.section('pvsystem').get('fallback', 'shed_chained')
+        controller = Controller(pumps, device, Allocator(), scheduler, planner, tracer=tracer, fallback=fallback, guard=self.load_guard())
+        mqtt_client = self.load_mqttclient()
+        return Group(self.name or 'pipump', pumps, device, controller, mqtt_client, store, recorder, planner, tracer, self)
+
+    def check(self):
+        # Builds what a reload applies without touching GPIOs or the network, so that a
+        # configuration which cannot be applied is rejected before anything changes
+        self.load_pumps(gpio=False)
+        self.load_scheduler()
+        self.load_guard()
+        pvsystem = self.section('pvsystem')
+        if pvsystem:
+            from filters import make_filter
+            make_filter(pvsystem.get('averaging', 'sma'), pvsystem.get('window', 5))
+            if pvsystem.get('type') == 'mqtt':
+                from selector import Selector
+                if 'consumption' not in pvsystem and 'grid' not in pvsystem:
+                    raise ValueError('the MQTT meter needs a consumption or grid topic')
+                for key in ('production', 'consumption', 'grid'):
+                    if key in pvsystem:
+                        Selector(pvsystem[key])
+
+    def pump_specs(self):
+        # Pump options with their defaults, runtime in seconds and chained as a list
+        specs = []
         for cp in self._config['pumps']:
-            p = Pump(cp['name'], cp['power'], cp['runtime'] * 3600, cp['gpio'])
-            try:
-                if cp['chained']:
-                    to_be_chained.append((p, cp['chained']))
-            except KeyError:
-                pass
+            # chained is the name of one upstream pump or a list of them
+            targets = cp.get('chained') or []
+            if isinstance(targets, str):
+                targets = [targets]
+            specs.append({'name': cp['name'], 'power': cp['power'], 'runtime': cp['runtime'] * 3600,
+                          'gpio': cp['gpio'], 'priority': cp.get('priority', 1), 'chained': targets})
+        return specs
+
+    def load_pumps(self, clock=None, gpio=True):
+        pumps = []
+        by_name = {}
+        specs = self.pump_specs()
+        for spec in specs:
+            p = Pump(spec['name'], spec['power'], spec['runtime'], spec['gpio'] if gpio else None, spec['priority'], clock)
             pumps.append(p)
-        for pump, target in to_be_chained:
-            for p in pumps:
-                if p.name == target:
-                    pump.chain(p)
-                    break
+            by_name[p.name] = p
+        for spec, pump in zip(specs, pumps):
+            for target in spec['chained']:
+                if target in by_name:
+                    pump.chain(by_name[target])
+                else:
+                    logger.warning('pump %s is chained to unknown pump %s', pump.name, target)
+        # Raises ValueError on dependency cycles
+        PumpGraph(pumps)
         return pumps
     
     def load_mqttclient(self):
         try:
             mqtt = self._config['mqtt']
             if mqtt:
-                return MQTTClient(mqtt)
+                from mqttclient import MQTTClient
+                return MQTTClient(mqtt, self.name or 'pipump')
         except KeyError as err:
-            logging.warning('missing attributes for mqttclient')
+            logger.warning('missing attributes for mqttclient')
     
-    def load_pvsystem(self):
+    def pvsystem_options(self):
+        # The pvsystem section, an MQTT meter uses the broker of the mqtt section unless it
+        # has its own
+        pvsystem = self.section('pvsystem')
+        if pvsystem.get('type') != 'mqtt':
+            return pvsystem
+        mqtt = self.section('mqtt')
+        options = {k: mqtt[k] for k in ('host', 'port', 'username', 'password') if k in mqtt}
+        options.update(pvsystem)
+        return options
+
+    def load_pvsystem(self, executor=None):
         try:
             pvsystem = self._config['pvsystem']
             if pvsystem['type'] == 'envoy':
-                return Envoy(ip=pvsystem['ip'], user=pvsystem['user'], password=pvsystem['password'], serial=pvsystem['serial'])
+                from envoy import Envoy
+                from breaker import CircuitBreaker
+                options = pvsystem.get('breaker') or {}
+                breaker = CircuitBreaker(f'Envoy {pvsystem["ip"]}', threshold=options.get('threshold', 3),
+                                         min_delay=options.get('min_delay', 10), max_delay=options.get('max_delay', 600))
+                token_file = self.__path(pvsystem.get('token_file', f'envoy_token_{self.name}' if self.name else 'envoy_token'))
+                return Envoy(ip=pvsystem['ip'], user=pvsystem['user'], password=pvsystem['password'], serial=pvsystem['serial'], token_file=token_file, stream=pvsystem.get('stream', False), averaging=pvsystem.get('averaging', 'sma'), window=pvsystem.get('window', 5), executor=executor,
+                             stale=pvsystem.get('stale', 300), breaker=breaker, endpoint=pvsystem.get('endpoint', 'production'))
+            if pvsystem['type'] == 'mqtt':
+                from mqttmeter import MQTTMeter
+                return MQTTMeter(self.pvsystem_options(), averaging=pvsystem.get('averaging', 'sma'), window=pvsystem.get('window', 5))
         except KeyError as err:
-            logging.warning('missing attributes for pvsystem')
+            logger.warning('missing attributes for pvsystem')
+        except ValueError as err:
+            logger.warning('invalid pvsystem: %s', err)
+
+    def load_scheduler(self):
+        scheduler = self._config.get('scheduler') or {}
+        return Scheduler(min_interval=scheduler.get('min_interval', 10), max_interval=scheduler.get('max_interval', 120), margin=scheduler.get('margin', 1000))
+
+    def load_guard(self, clock=None):
+        cycling = self._config.get('cycling')
+        if not cycling:
+            return None
+        from cycling import CycleGuard
+        return CycleGuard(deadband=cycling.get('deadband', 0), min_run=cycling.get('min_run', 0), min_rest=cycling.get('min_rest', 0),
+                          energy_debt=cycling.get('energy_debt'), clock=clock)
+
+    def load_statestore(self):
+        state = self._config.get('state') or {}
+        if not state.get('enabled', True):
+            return None
+        directory = self.__group_path(state.get('directory', '.'))
+        return StateStore(directory, sync_interval=state.get('sync_interval', 60), compact_every=state.get('compact_every', 1000))
+
+    def load_recorder(self):
+        history = self._config.get('history')
+        if not history:
+            return None
+        from recorder import Recorder
+        directory = self.__group_path(history.get('directory', 'history'))
+        return Recorder(directory, capacity=history.get('capacity', 86400), keep_days=history.get('keep_days', 30))
+
+    def load_planner(self, recorder, pumps):
+        planner = self._config.get('planner')
+        if not planner:
+            return None
+        if not recorder:
+            logger.warning('the planner needs the history section to be configured')
+            return None
+        try:
+            from planner import Planner
+            return Planner(recorder, pumps, days=planner.get('days', 14), deadline=planner.get('deadline'), margin=planner.get('margin', 5))
+        except ImportError:
+            logger.warning('numpy is not installed, running without planner')
+
+    def load_tracer(self, profile=False):
+        # --profile traces every tick and profiles the first ones with the defaults below
+        trace = self._config.get('trace')
+        if not trace and not profile:
+            return None
+        from tracer import Tracer
+        trace = trace or {}
+        directory = self.__group_path(trace.get('directory', '.'))
+        report = trace.get('report')
+        return Tracer(os.path.join(directory, trace.get('file', 'trace.jsonl')), sample=trace.get('sample', 1.0), name=self.name,
+                      profile=trace.get('profile', 'cprofile' if profile else None), profile_ticks=trace.get('profile_ticks', 100),
+                      report=os.path.join(directory, report) if report else None)
+
+    def load_reloader(self, groups):
+        if not self._config.get('reload', True):
+            return None
+        from reload import Reloader
+        return Reloader(self, groups)
+
+    def load_metrics(self, groups):
+        options = self._config.get('metrics')
+        if not options:
+            return None
+        from metrics import MetricsServer, LoopMonitor, registry
+        for group in groups:
+            registry.add_collector(group.collect_metrics)
+        return MetricsServer(options.get('host', '0.0.0.0'), options.get('port', 9108)), LoopMonitor(options.get('loop_interval', 1.0))
+
+    def load_logging(self):
+        options = self._config.get('logging') or {}
+        return setup_logging(self.__path(options.get('file', 'debug.log')), level=options.get('level', 'DEBUG'), levels=options.get('levels'),
+                             max_bytes=options.get('max_bytes', 1048576), when=options.get('when'),
+                             backup_count=options.get('backup_count', 5), compress=options.get('compress', True))
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+from clock import system_clock
+from graph import PumpGraph
+from tracer import null_tracer
+
+logger = logging.getLogger(__name__)
+
+class Controller():
+    # One control tick: update pump counters, read the PV source, allocate the surplus
+    # and switch pumps accordingly. run() repeats it as decided by the scheduler.
+    # What to do while the PV readings are stale: keep pumps as they are, stop the pumps
+    # chained to others or stop everything. Pumps forced by the planner run regardless.
+    # An optional CycleGuard holds back the decisions that would toggle relays too often.
+    FALLBACKS = ('hold', 'shed_chained', 'stop_all')
+
+    def __init__(self, pumps, device, allocator, scheduler, planner=None, clock=None, tracer=None, fallback='shed_chained', guard=None):
+        if fallback not in self.FALLBACKS:
+            raise ValueError(f'unknown fallback {fallback}, expected one of {", ".join(self.FALLBACKS)}')
+        self.pumps = pumps
+        self.graph = PumpGraph.of(pumps)
+        self.device = device
+        self.allocator = allocator
+        self.scheduler = scheduler
+        self.planner = planner
+        self.clock = clock or system_clock
+        self.tracer = tracer or null_tracer
+        self.fallback = fallback
+        self.guard = guard
+        self._falling_back = False
+
+    async def tick(self):
+        with self.tracer.tick():
+            return await self.__tick()
+
+    async def __tick(self):
+        tracer = self.tracer
+        with tracer.span('pump.update'):
+            for p in self.pumps:
+                p.update() # Potentially stops a pump that reached desired runtime, update counters
+        with tracer.span('device.update'):
+            availability = await self.device.update()
+        forced = []
+        if self.planner:
+            with tracer.span('planner.plan'):
+                forced = self.planner.plan(self.clock.time())[0]
+        if self.device.is_stale():
+            with tracer.span('actuate'):
+                self.__fall_back(forced)
+            return self.scheduler.min_interval
+        if self._falling_back:
+            logger.info('PV readings are fresh again, resuming surplus allocation')
+            self._falling_back = False
+        with tracer.span('allocate'):
+            selected, remaining = self.allocator.allocate(self.graph, availability, forced)
+            if self.guard:
+                selected, remaining = self.guard.filter(self.graph, selected, availability, forced)
+            selected = set(selected)
+            availability = remaining
+        shed = [p for p in self.graph.stop_order if p.is_running() and p not in selected]
+        if shed:
+            # Shed one pump per tick, dependent pumps before the pumps they are chained to,
+            # and check the readings again before stopping more or starting others
+            with tracer.span('actuate'):
+                shed[0].turn_off()
+                del self.device.consumption
+            if len(shed) > 1 or any(not p.is_running() for p in selected):
+                return self.scheduler.min_interval
+            with tracer.span('schedule'):
+                return self.scheduler.next_delay(self.graph, availability, self.clock.time())
+        changed = False
+        with tracer.span('actuate'):
+            for p in self.graph.start_order:
+                if p in selected and not p.is_running():
+                    p.turn_on()
+                    changed = True
+            if changed:
+                del self.device.consumption
+        with tracer.span('schedule'):
+            return self.scheduler.next_delay(self.graph, availability, self.clock.time())
+
+    def __fall_back(self, forced):
+        if not self._falling_back:
+            logger.warning('PV readings are stale, applying %s fallback', self.fallback)
+            self._falling_back = True
+        required = set(self.graph.closure(forced))
+        for p in self.graph.stop_order:
+            if p.is_running() and p not in required:
+                if self.fallback == 'stop_all' or (self.fallback == 'shed_chained' and p.is_chained()):
+                    p.turn_off()
+        for p in self.graph.start_order:
+            if p in required and not p.is_running():
+                p.turn_on()
+
+    async def run(self):
+        try:
+            while True:
+                delay = await self.tick()
+                await self.scheduler.wait(delay)
+        except asyncio.CancelledError:
+            logger.debug('auto_loop task cancelled')
+            raise
@@ -0,0 +1,73 @@
+import logging
+
+from clock import system_clock
+
+logger = logging.getLogger(__name__)
+
+class CycleGuard():
+    # Keeps relays from toggling tick after tick when the surplus hovers around the power
+    # of a pump. The allocator decision is only applied when it holds with some margin: a
+    # pump starts when deadband watts are left once it runs and stops when the deficit
+    # exceeds deadband. Pumps run at least min_run seconds and rest at least min_rest
+    # seconds between runs. When energy_debt is set, the grid energy imported while pumps
+    # are held through a deficit is capped to that many Wh, the surplus pays it back.
+    def __init__(self, deadband=0, min_run=0, min_rest=0, energy_debt=None, clock=None):
+        self.deadband = deadband
+        self.min_run = min_run
+        self.min_rest = min_rest
+        self.energy_debt = energy_debt
+        self.debt = 0
+        self._clock = clock or system_clock
+        self._last_tick = None
+
+    def __account(self, availability, running, now):
+        # The readings are assumed to have held since the previous tick
+        elapsed = now - self._last_tick if self._last_tick is not None else 0
+        self._last_tick = now
+        if availability < 0 and running:
+            self.debt += min(-availability, sum(p.power for p in running)) * elapsed / 3600
+        elif availability > 0:
+            self.debt = max(self.debt - availability * elapsed / 3600, 0)
+
+    def in_debt(self):
+        return self.energy_debt is not None and self.debt >= self.energy_debt
+
+    def resting(self, pump, now):
+        return pump.off_since is not None and now - pump.off_since < self.min_rest
+
+    def filter(self, graph, selected, availability, forced=()):
+        # Returns the pumps to run out of the allocator selection and the surplus left,
+        # forced pumps and the pumps they are chained to start regardless
+        now = self._clock.time()
+        running = [p for p in graph.pumps if p.is_running()]
+        self.__account(availability, running, now)
+        selected = set(selected)
+        eligible = graph.eligible()
+        held = []
+        for p in running:
+            if p in selected or p not in eligible:
+                continue
+            if now - p.on_since < self.min_run:
+                logger.debug('keeping pump %s running, it started %ss ago', p.name, round(now - p.on_since))
+                held.append(p)
+            elif self.deadband and -availability <= self.deadband and not self.in_debt():
+                logger.debug('keeping pump %s running, %sW deficit within deadband', p.name, -availability)
+                held.append(p)
+        kept = {p for p in graph.closure(held) if p.is_running()}
+        kept.update(p for p in running if p in selected)
+        # Surplus once the pumps that are not kept are stopped
+        remaining = availability + sum(p.power for p in running if p not in kept)
+        required = set(graph.closure(forced))
+        for p in graph.start_order:
+            if p not in selected or p.is_running() or not all(u in kept for u in p.upstreams):
+                continue
+            if p not in required:
+                if self.resting(p, now):
+                    logger.debug('not starting pump %s, it stopped %ss ago', p.name, round(now - p.off_since))
+                    continue
+                if remaining - p.power < self.deadband:
+                    logger.debug('not starting pump %s, %sW surplus within deadband', p.name, remaining)
+                    continue
+            kept.add(p)
+            remaining -= p.power
+        return [p for p in graph.pumps if p in kept], remaining
@@ -1,83 +1,387 @@
+import re
+import json
+import time
+import asyncio
+import threading
 import requests
 import urllib3
 
-from requests.exceptions import RequestException
-from json import JSONDecodeError
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
+from requests.exceptions import RequestException, Timeout
+
+import metrics
 from pvsystem import PVSystem
+from breaker import CircuitBreaker, HALF_OPEN
+from tokenstore import TokenStore
+from meterstream import MeterStreamParser
 import logging
 
+logger = logging.getLogger(__name__)
+
 # We accept self signed certificates with no warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Polls only need two numbers out of each document, they are looked up in the raw bytes
+# and the whole document is decoded only when they cannot be found that way
+NUMBER = rb'(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)'
+SECTION = re.compile(rb'"(production|consumption|storage)"\s*:\s*\[')
+EIM = re.compile(rb'"type"\s*:\s*"eim"')
+WNOW = re.compile(rb'"wNow"\s*:\s*' + NUMBER)
+READING = re.compile(rb'"(eid|activePower)"\s*:\s*' + NUMBER)
+
+def eim_watts(data):
+    for d in data:
+        if d['type'] == 'eim':
+            return d['wNow']
+    return None
+
+def scan_production(body):
+    # wNow of the first eim entry of the production and consumption arrays of production.json
+    sections = list(SECTION.finditer(body))
+    watts = {}
+    for i, section in enumerate(sections):
+        end = sections[i + 1].start() if i + 1 < len(sections) else len(body)
+        eim = EIM.search(body, section.end(), end)
+        wnow = eim and WNOW.search(body, eim.end(), end)
+        if wnow:
+            watts.setdefault(section.group(1), float(wnow.group(1)))
+    if b'production' in watts and b'consumption' in watts:
+        return watts[b'production'], watts[b'consumption']
+    return None
+
+def parse_production(body):
+    readings = scan_production(body)
+    if readings is None:
+        data = json.loads(body)
+        readings = eim_watts(data['production']), eim_watts(data['consumption'])
+    return readings
+
+def scan_readings(body, meters):
+    # activePower of the given meters in /ivp/meters/readings. The readings of each phase
+    # follow the one of their meter and are skipped as their eids are not in meters.
+    powers = {}
+    eid = None
+    for key, value in READING.findall(body):
+        if key == b'eid':
+            eid = int(value)
+        elif eid in meters and eid not in powers:
+            powers[eid] = float(value)
+    return powers
+
+def parse_readings(body, meters):
+    # meters maps the eids of the production and consumption meters to their measurement type
+    powers = scan_readings(body, meters)
+    if len(powers) != len(meters):
+        powers = {m['eid']: m['activePower'] for m in json.loads(body) if m['eid'] in meters}
+    by_type = {meters[eid]: power for eid, power in powers.items()}
+    production = by_type['production']
+    if 'total-consumption' in by_type:
+        return production, by_type['total-consumption']
+    # Net consumption is what the grid provides, negative when exporting
+    return production, production + by_type['net-consumption']
+
 class Envoy(PVSystem):
-    def __init__(self, ip, user='', password='', serial=''):
+    stream_timeout = 30
+    stream_min_delay = 5
+    stream_max_delay = 300
+    poll_timeout = 10
+    # Polls made while the breaker is half open only check that the gateway answers again
+    probe_timeout = 3
+
+    def __init__(self, ip, user='', password='', serial='', token_file=None, stream=False, averaging='sma', window=5, executor=None, stale=300, breaker=None, endpoint='production'):
         self._ip = ip
         self._user = user
         self._password = password
         self._serial = serial
-        self._token = ''
-        self._url = f'http://{ip}/production.json'
-        PVSystem.__init__(self)
+        self._tokens = TokenStore(token_file)
+        self._token_lock = threading.Lock()
+        self._refresh_future = None
+        self._stream_url = f'http://{ip}/stream/meter'
+        # production only polls production.json, auto probes the meters API on the next poll
+        # and polls the meter readings when available
+        self._endpoint = endpoint
+        self.__reset_endpoint()
+        self._stream = stream
+        self._stream_stop = threading.Event()
+        self._stream_response = None
+        self._last_stream_reading = 0
+        # Readings older than stale seconds are not acted upon, counted from startup
+        self._stale_after = stale
+        self._last_reading = time.time()
+        # Whether the last failed poll got an error status, see update()
+        self._error_status = False
+        # Skips polls of an unreachable gateway instead of waiting for a timeout every tick
+        self.breaker = breaker or CircuitBreaker(f'Envoy {ip}')
+        self._session = None
+        # Keeps HTTP calls off the event loop, possibly shared with the Envoys of other groups.
+        # update() awaits each poll so the session is never used by two threads at once.
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='envoy')
+        self.__bind_metrics()
+        PVSystem.__init__(self, averaging, window)
+
+    def __bind_metrics(self):
+        ip = self._ip
+        self._poll_seconds = metrics.pv_poll_seconds.labels(source=ip)
+        self._poll_errors = {reason: metrics.pv_poll_errors.labels(source=ip, reason=reason) for reason in ('status', 'auth', 'decode', 'timeout', 'request')}
+        self._refresh_seconds = metrics.token_refresh_seconds.labels(source=ip)
+        self._refresh_errors = metrics.token_refresh_errors.labels(source=ip)
+
+    def reconfigure(self, options):
+        restart = PVSystem.reconfigure(self, options)
+        if options.get('stream', False) != self._stream:
+            restart.append('stream')
+        if options['ip'] != self._ip:
+            logger.info('Envoy address changed from %s to %s', self._ip, options['ip'])
+            if self._stream:
+                restart.append('ip')
+            else:
+                self._ip = options['ip']
+                self._stream_url = f'http://{self._ip}/stream/meter'
+                self.__reset_endpoint()
+                # The next poll opens a connection to the new address
+                self._session = None
+                self.__bind_metrics()
+        if options.get('endpoint', 'production') != self._endpoint:
+            self._endpoint = options.get('endpoint', 'production')
+            self.__reset_endpoint()
+        self._stale_after = options.get('stale', 300)
+        breaker = options.get('breaker') or {}
+        self.breaker.threshold = breaker.get('threshold', 3)
+        self.breaker.min_delay = breaker.get('min_delay', 10)
+        self.breaker.max_delay = breaker.get('max_delay', 600)
+        credentials = (options['user'], options['password'], options['serial'])
+        if credentials != (self._user, self._password, self._serial):
+            logger.info('Envoy credentials changed, renewing the token')
+            self._user, self._password, self._serial = credentials
+            self._tokens.reset()
+        return restart
     
+    def __reset_endpoint(self):
+        self._url = f'http://{self._ip}/production.json'
+        self._probed = self._endpoint == 'production'
+        self._meters = None
+
     @staticmethod
-    def __get_eim_watts(data):
-        for d in data:
-            if d['type'] == 'eim':
-                return d['wNow']
-        return None
-    
+    def __new_session():
+        # Keep-alive connection pool reused between requests, saves the TLS handshake with the gateway
+        session = requests.Session()
+        session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def __refresh_token(self):
         data = {'user[email]': self._user, 'user[password]': self._password}
-        resp = requests.post('https://enlighten.enphaseenergy.com/login/login.json?', data=data)
+        resp = requests.post('https://enlighten.enphaseenergy.com/login/login.json?', data=data, timeout=30)
         if (resp.status_code != 200):
-            logging.error(f'failed authenticating with enlighten for user {self._user}')
+            logger.error('failed authenticating with enlighten for user %s', self._user)
             raise ConnectionRefusedError()
         session_data = resp.json()
         session_id = session_data['session_id']
         if (not session_id):
-            logging.error(f'no session_id provided after authentication')
+            logger.error('no session_id provided after authentication')
             raise ConnectionRefusedError
-        logging.debug(f'obtained session with id {session_id} for user {self._user}')
+        logger.debug('obtained session with id %s for user %s', session_id, self._user)
         data = {'session_id': session_id, 'serial_num': self._serial, 'username': self._user}
-        resp = requests.post('https://entrez.enphaseenergy.com/tokens', json=data)
+        resp = requests.post('https://entrez.enphaseenergy.com/tokens', json=data, timeout=30)
         if (resp.status_code != 200 or not resp.text):
-            logging.error(f'failed getting token for user {self._user} and serial {self._serial}')
+            logger.error('failed getting token for user %s and serial %s', self._user, self._serial)
             raise ConnectionRefusedError()
-        self._token = resp.text
-        logging.debug(f'successfully renewed token for user {self._user}')
+        self._tokens.update(resp.text)
+        logger.debug('successfully renewed token for user %s', self._user)
+
+    def __renew_token(self):
+        # Runs in a worker thread, failures back off instead of being retried on every poll
+        with self._token_lock:
+            if not self._tokens.needs_refresh():
+                # Renewed concurrently, or still backing off from a previous failure
+                return self._tokens.is_valid()
+            start = time.monotonic()
+            try:
+                self.__refresh_token()
+                return True
+            except (ConnectionRefusedError, RequestException, ValueError, KeyError) as e:
+                self._tokens.failed()
+                self._refresh_errors.inc()
+                return False
+            finally:
+                self._refresh_seconds.observe(time.monotonic() - start)
+
+    def __get(self, session, url, **kwargs):
+        if (self._tokens.token):
+            resp = session.get(url, headers={'Authorization': f'Bearer {self._tokens.token}'}, **kwargs)
+        else:
+            resp = session.get(url, **kwargs)
+
+        # we either have no token or the previous one expired
+        if (resp.status_code == 401):
+            logger.debug('authentication failed when calling Envoy API')
+            self._tokens.invalidate()
+            if not self.__renew_token():
+                raise ConnectionRefusedError()
+            # Try again
+            resp = session.get(url, headers={'Authorization': f'Bearer {self._tokens.token}'}, **kwargs)
+        return resp
 
-    def update(self):
+    def __probe(self, session, timeout):
+        # Meter readings are cheaper for the gateway to produce than production.json, they
+        # are used when a production meter and a consumption meter are enabled
+        resp = self.__get(session, f'http://{self._ip}/ivp/meters', timeout=timeout)
+        self._probed = True
+        meters = {}
+        if resp.status_code == 200:
+            try:
+                for m in json.loads(resp.content):
+                    if m.get('state') == 'enabled':
+                        meters.setdefault(m.get('measurementType'), m['eid'])
+            except (ValueError, TypeError, KeyError, AttributeError):
+                meters = {}
+        consumption = 'total-consumption' if 'total-consumption' in meters else 'net-consumption'
+        if 'production' in meters and consumption in meters:
+            self._meters = {meters['production']: 'production', meters[consumption]: consumption}
+            self._url = f'http://{self._ip}/ivp/meters/readings'
+            logger.info('polling meter readings of Envoy %s', self._ip)
+        else:
+            logger.info('no enabled meters on Envoy %s, polling production.json', self._ip)
+
+    def __poll(self, timeout):
+        # Runs in the executor thread, returns a (production, consumption) tuple or None
         try:
-            resp = None
-            if (self._token):
-                resp = requests.get(self._url, verify=False, headers={'Authorization': f'Bearer {self._token}'}, timeout=10)
+            # reconfigure() drops the session from the event loop when the address changes
+            session = self._session
+            if session is None:
+                session = self._session = self.__new_session()
+            if not self._probed:
+                self.__probe(session, timeout)
+            resp = self.__get(session, self._url, timeout=timeout)
+            if (resp.status_code != 200):
+                logger.debug('received unexpected HTTP status code %s when querying Envoy API', resp.status_code)
+                self._poll_errors['status'].inc()
+                # Empty rather than None, update() reports no surplus in that case
+                return ()
+            
+            if self._meters:
+                production, consumption = parse_readings(resp.content, self._meters)
             else:
-                resp = requests.get(self._url, verify=False, timeout=10)
+                production, consumption = parse_production(resp.content)
+            logger.debug('new reading: Production: %swH, Consumption: %swH', production, consumption)
+            return production, consumption
+        except ConnectionRefusedError as e:
+            logger.error('failed authenticating with Envoy device %s', self._ip)
+            self._poll_errors['auth'].inc()
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error('failed decoding JSON document from Envoy API %s', self._url)
+            self._poll_errors['decode'].inc()
+        except RequestException as e:
+            logger.error('GET request on %s triggered an exception %s', self._url, e.__class__.__name__)
+            self._poll_errors['timeout' if isinstance(e, Timeout) else 'request'].inc()
+        return None
 
-            # we either have no token or the previous one expired
-            if (resp.status_code == 401):
-                logging.debug(f'authentication failed when calling Envoy API')
-                self.__refresh_token()
-                # Try again
-                resp = requests.get(self._url, verify=False, headers={'Authorization': f'Bearer {self._token}'}, timeout=10)
-            elif (resp.status_code != 200):
-                logging.debug(f'received unexpected HTTP status code {resp.status_code} when querying Envoy API')
+    def __stream(self, loop):
+        # Runs in a dedicated thread for as long as streaming is enabled
+        parser = MeterStreamParser()
+        session = self.__new_session()
+        delay = self.stream_min_delay
+        while not self._stream_stop.is_set():
+            parser.reset()
+            try:
+                with self.__get(session, self._stream_url, stream=True, timeout=(10, self.stream_timeout)) as resp:
+                    if (resp.status_code != 200):
+                        logger.debug('received unexpected HTTP status code %s when opening Envoy meter stream', resp.status_code)
+                    else:
+                        logger.debug('connected to Envoy meter stream %s', self._stream_url)
+                        self._stream_response = resp
+                        for chunk in resp.iter_content(chunk_size=None):
+                            if self._stream_stop.is_set():
+                                break
+                            readings = parser.feed(chunk)
+                            if readings:
+                                delay = self.stream_min_delay
+                                loop.call_soon_threadsafe(self.__on_stream_readings, readings)
+            except ConnectionRefusedError as e:
+                logger.error('failed authenticating with Envoy device %s', self._ip)
+            except (RequestException, OSError) as e:
+                logger.debug('Envoy meter stream interrupted by %s', e.__class__.__name__)
+            self._stream_response = None
+            if not self._stream_stop.is_set():
+                logger.debug('reconnecting to Envoy meter stream in %s seconds', delay)
+                self._stream_stop.wait(delay)
+                delay = min(delay * 2, self.stream_max_delay)
+        session.close()
+
+    def __on_stream_readings(self, readings):
+        for production, consumption in readings:
+            self.production = production
+            self.consumption = consumption
+            self.notify_readings(production, consumption)
+        self._last_stream_reading = time.time()
+        self._last_reading = self._last_stream_reading
+
+    def is_streaming(self):
+        return self._stream and time.time() - self._last_stream_reading < self.stream_timeout
+
+    def is_stale(self):
+        return time.time() - self._last_reading > self._stale_after
+
+    async def task(self):
+        if not self._stream:
+            return
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        def run():
+            try:
+                self.__stream(loop)
+            finally:
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+        self._stream_stop.clear()
+        # Daemon thread so a stream blocked in a read never delays process exit
+        threading.Thread(target=run, name='envoy-stream', daemon=True).start()
+        try:
+            await done
+        except asyncio.CancelledError:
+            logger.debug('envoy stream task cancelled')
+            self._stream_stop.set()
+            resp = self._stream_response
+            if resp is not None:
+                resp.close()
+            raise
+
+    async def update(self):
+        loop = asyncio.get_running_loop()
+        # Renew the token in the background well before it expires
+        if self._user and self._tokens.token and self._tokens.needs_refresh():
+            if self._refresh_future is None or self._refresh_future.done():
+                logger.debug('Envoy token expires at %s, renewing in background', time.ctime(self._tokens.expires))
+                self._refresh_future = loop.run_in_executor(None, self.__renew_token)
+        if self.is_streaming():
+            # Readings are pushed by the meter stream, no need to poll
+            return self.production - self.consumption
+        if not self.breaker.allow():
+            # Down for a while, the last values are returned until the breaker lets a probe
+            # through, unless the gateway was answering with errors
+            return 0 if self._error_status else self.production - self.consumption
+        timeout = self.probe_timeout if self.breaker.state == HALF_OPEN else self.poll_timeout
+        start = time.monotonic()
+        readings = await loop.run_in_executor(self._executor, self.__poll, timeout)
+        self._poll_seconds.observe(time.monotonic() - start)
+        if not readings:
+            self.breaker.failure()
+            self._error_status = readings is not None
+            if readings is not None:
+                # The gateway answered with an error status, assume no surplus rather than
+                # keep acting on the last averages
                 return 0
-            
-            data = resp.json()
-            consumption = self.__get_eim_watts(data['consumption'])
-            production = self.__get_eim_watts(data['production'])
-            logging.debug(f'new reading: Production: {production}wH, Consumption: {consumption}wH')
+        else:
+            self.breaker.success()
+            self._error_status = False
+            self._last_reading = time.time()
             # Update moving average in base class
-            self.consumption = consumption
-            self.production = production
-            logging.debug(f'moving average: Production: {self.production}wH, Consumption: {self.consumption}wH')
-        except ConnectionRefusedError as e:
-            logging.error(f'failed authenticating with Envoy device {self._ip}')
-        except JSONDecodeError as e:
-            logging.error(f'failed decoding JSON document from Envoy production API')
-        except RequestException as e:
-            logging.error(f'GET request on {self._url} triggered an exception {e.__class__.__name__}')
+            self.production, self.consumption = readings
+            self.notify_readings(*readings)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('moving average: Production: %swH, Consumption: %swH', self.production, self.consumption)
         # Return the latest value even in case of timeouts
-        return self.production - self.consumption
\ No newline at end of file
+        return self.production - self.consumption
@@ -0,0 +1,118 @@
+import time
+from collections import deque
+
+# Averaging filters for power readings. They all cost O(1) per sample (amortized for the
+# time weighted one) so reading the average stays cheap with large windows or fast sources.
+
+class MovingAverage():
+    def __init__(self, window=5):
+        self._samples = deque([], maxlen=window)
+        self._sum = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def append(self, value, now=None):
+        if len(self._samples) == self._samples.maxlen:
+            self._sum -= self._samples[0]
+        self._samples.append(value)
+        self._sum += value
+
+    def value(self, now=None):
+        if not self._samples:
+            return None
+        return self._sum / len(self._samples)
+
+    def clear(self):
+        self._samples.clear()
+        self._sum = 0
+
+class ExponentialAverage():
+    def __init__(self, window=5):
+        # Same center of mass as a simple moving average over window samples
+        self._alpha = 2 / (window + 1)
+        self._value = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, now=None):
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += self._alpha * (value - self._value)
+        self._count += 1
+
+    def value(self, now=None):
+        return self._value
+
+    def clear(self):
+        self._value = None
+        self._count = 0
+
+class TimeWeightedAverage():
+    # Each sample holds until the next one, the average is the integral of that step
+    # function over the last window seconds divided by the covered duration.
+    def __init__(self, window=300, clock=None):
+        self._window = window
+        self._clock = clock or time.time
+        self._samples = deque()
+        # Integral of the completed segments, between the first and the last sample
+        self._area = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __evict(self, cutoff):
+        samples = self._samples
+        while len(samples) > 1 and samples[1][0] <= cutoff:
+            t, v = samples.popleft()
+            self._area -= v * (samples[0][0] - t)
+
+    def append(self, value, now=None):
+        if now is None:
+            now = self._clock()
+        if self._samples:
+            t, v = self._samples[-1]
+            self._area += v * (now - t)
+        self._samples.append((now, value))
+        self.__evict(now - self._window)
+
+    def value(self, now=None):
+        if not self._samples:
+            return None
+        if now is None:
+            now = self._clock()
+        cutoff = now - self._window
+        self.__evict(cutoff)
+        first_t, first_v = self._samples[0]
+        last_t, last_v = self._samples[-1]
+        area = self._area + last_v * (now - last_t)
+        start = first_t
+        if first_t < cutoff:
+            # Head segment only partially inside the window
+            area -= first_v * (cutoff - first_t)
+            start = cutoff
+        duration = now - start
+        if duration <= 0:
+            return last_v
+        return area / duration
+
+    def clear(self):
+        self._samples.clear()
+        self._area = 0
+
+FILTERS = {
+    'sma': MovingAverage,
+    'ewma': ExponentialAverage,
+    'time': TimeWeightedAverage,
+}
+
+def make_filter(name='sma', window=5, clock=None):
+    if name == 'time':
+        return TimeWeightedAverage(window, clock)
+    try:
+        return FILTERS[name](window)
+    except KeyError:
+        raise ValueError(f'unknown averaging filter {name}, expected one of {", ".join(FILTERS)}')
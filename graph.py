@@ -0,0 +1,67 @@
+import heapq
+
+class PumpGraph():
+    # Pumps chained to others form a directed acyclic graph, validated and sorted once so
+    # that every tick can walk it in start order (upstream pumps first) or stop order
+    # (dependent pumps first) in O(pumps + links).
+    def __init__(self, pumps):
+        self.pumps = list(pumps)
+        self._index = {p: i for i, p in enumerate(self.pumps)}
+        self._parents = []
+        children = [[] for p in self.pumps]
+        for i, p in enumerate(self.pumps):
+            parents = []
+            for u in p.upstreams:
+                if u not in self._index:
+                    raise ValueError(f'pump {p.name} is chained to unknown pump {u.name}')
+                parents.append(self._index[u])
+                children[self._index[u]].append(i)
+            self._parents.append(parents)
+
+        # Kahn's algorithm, ties broken by configuration order
+        indegree = [len(parents) for parents in self._parents]
+        heap = [i for i in range(len(self.pumps)) if not indegree[i]]
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            i = heapq.heappop(heap)
+            order.append(i)
+            for c in children[i]:
+                indegree[c] -= 1
+                if not indegree[c]:
+                    heapq.heappush(heap, c)
+        if len(order) != len(self.pumps):
+            cycle = ', '.join(p.name for i, p in enumerate(self.pumps) if indegree[i])
+            raise ValueError(f'dependency cycle between pumps {cycle}')
+        self._order = order
+        self.start_order = [self.pumps[i] for i in order]
+        self.stop_order = self.start_order[::-1]
+
+    @classmethod
+    def of(cls, pumps):
+        return pumps if isinstance(pumps, cls) else cls(pumps)
+
+    def __iter__(self):
+        return iter(self.pumps)
+
+    def __len__(self):
+        return len(self.pumps)
+
+    def eligible(self):
+        # Same as should_run() for every pump without walking the chains again for each
+        ok = [False] * len(self.pumps)
+        for i in self._order:
+            p = self.pumps[i]
+            ok[i] = p.runtime < p.desired_runtime and all(ok[u] for u in self._parents[i])
+        return {p for i, p in enumerate(self.pumps) if ok[i]}
+
+    def closure(self, pumps):
+        # The given pumps along with all the pumps they depend on, in start order
+        marked = [False] * len(self.pumps)
+        stack = [self._index[p] for p in pumps]
+        while stack:
+            i = stack.pop()
+            if not marked[i]:
+                marked[i] = True
+                stack.extend(self._parents[i])
+        return [self.pumps[i] for i in self._order if marked[i]]
@@ -0,0 +1,172 @@
+import time
+import asyncio
+import logging
+
+import metrics
+from graph import PumpGraph
+
+logger = logging.getLogger(__name__)
+
+class Group():
+    # One independent site: its pumps, PV source, control loop and MQTT device. Several
+    # groups run side by side on the same event loop, a failure in one of them is logged
+    # and does not affect the others.
+    def __init__(self, name, pumps, device, controller, mqtt_client=None, store=None, recorder=None, planner=None, tracer=None, config=None):
+        self.name = name
+        self.pumps = pumps
+        self.device = device
+        self.controller = controller
+        self.mqtt_client = mqtt_client
+        self.store = store
+        self.recorder = recorder
+        self.tracer = tracer
+        self.planner = planner
+        # Config the group was loaded from, compared with new ones by reconfigure()
+        self.config = config
+        self.mode = 'AUTO'
+        self._auto_task = None
+        self._tasks = []
+        if mqtt_client:
+            mqtt_client.attach(pumps, self.on_mode_changed, self.on_switch_command)
+            if planner:
+                mqtt_client.attach_planner(planner)
+            if tracer:
+                mqtt_client.attach_tracer(tracer)
+            if hasattr(device, 'breaker'):
+                mqtt_client.attach_breaker(device.breaker)
+
+    def on_mode_changed(self, new_mode):
+        if self.mode == new_mode:
+            return self.mode
+
+        logger.info('changing operation mode of %s from %s to %s', self.name, self.mode, new_mode)
+
+        if self.mode == 'AUTO':
+            if self._auto_task is not None:
+                self._auto_task.cancel()
+                self._auto_task = None
+
+        if new_mode == 'AUTO':
+            self._auto_task = self.__create_task(self.controller.run(), 'control')
+        else:
+            for p in self.pumps:
+                p.turn_off()
+
+        self.mode = new_mode
+
+        return self.mode
+
+    def on_switch_command(self, pump, command):
+        if self.mode != 'MANUAL':
+            logger.debug('ignoring switch command in non MANUAL modes')
+            return
+        else:
+            if command == 'ON':
+                pump.turn_on()
+            elif command == 'OFF':
+                pump.turn_off()
+            else:
+                logger.warning('Invalid command %s for pump %s', command, pump.name)
+
+    def collect_metrics(self):
+        for p in self.pumps:
+            runtime = p.runtime
+            if p.on_since:
+                runtime += time.time() - p.on_since
+            metrics.pump_runtime_seconds.labels(group=self.name, pump=p.name).set(round(runtime))
+            metrics.pump_running.labels(group=self.name, pump=p.name).set(1 if p.is_running() else 0)
+        if self.device:
+            metrics.surplus_watts.labels(group=self.name).set(self.device.production - self.device.consumption)
+        if self.mqtt_client:
+            self.mqtt_client.collect_metrics()
+
+    def __reconfigure_pumps(self, config):
+        specs = config.pump_specs()
+        if [s['name'] for s in specs] != [p.name for p in self.pumps]:
+            # Callbacks, history columns and MQTT entities are bound to the pumps at startup
+            return ['pumps']
+        restart = []
+        by_name = {p.name: p for p in self.pumps}
+        changed = False
+        for spec, p in zip(specs, self.pumps):
+            if spec['gpio'] != p.gpio:
+                restart.append(f'pumps.{p.name}.gpio')
+            upstreams = [by_name[n] for n in spec['chained'] if n in by_name]
+            if (spec['power'], spec['runtime'], spec['priority'], upstreams) != (p.power, p.desired_runtime, p.priority, p.upstreams):
+                logger.info('reconfiguring pump %s of %s', p.name, self.name)
+                p.reconfigure(spec['power'], spec['runtime'], spec['priority'], upstreams)
+                changed = True
+        if changed:
+            self.controller.graph = PumpGraph(self.pumps)
+            if self.planner:
+                self.planner.reconfigure(self.controller.graph)
+        return restart
+
+    def reconfigure(self, config):
+        # Applies a new configuration of this group to the live objects. Pumps keep running
+        # along with their counters, returns the options that need a restart to change.
+        restart = self.__reconfigure_pumps(config)
+        self.controller.fallback = config.section('pvsystem').get('fallback', 'shed_chained')
+        scheduler = config.load_scheduler()
+        self.controller.scheduler.min_interval = scheduler.min_interval
+        self.controller.scheduler.max_interval = scheduler.max_interval
+        self.controller.scheduler.margin = scheduler.margin
+        guard = config.load_guard()
+        if guard and self.controller.guard:
+            # Updated in place, the energy debt and its accounting carry over
+            for key in ('deadband', 'min_run', 'min_rest', 'energy_debt'):
+                setattr(self.controller.guard, key, getattr(guard, key))
+        else:
+            self.controller.guard = guard
+        pvsystem = config.pvsystem_options()
+        previous = self.config.pvsystem_options()
+        if self.device and pvsystem and pvsystem.get('type') == previous.get('type') \
+                and pvsystem.get('token_file') == previous.get('token_file'):
+            restart.extend(f'pvsystem.{key}' for key in self.device.reconfigure(pvsystem))
+        elif pvsystem != previous:
+            restart.append('pvsystem')
+        mqtt = config.section('mqtt')
+        if self.mqtt_client and mqtt:
+            restart.extend(f'mqtt.{key}' for key in self.mqtt_client.reconfigure(mqtt))
+        elif mqtt != self.config.section('mqtt'):
+            restart.append('mqtt')
+        for section in ('state', 'history', 'planner', 'trace'):
+            if config.section(section) != self.config.section(section):
+                restart.append(section)
+        self.config = config
+        return restart
+
+    def __on_task_done(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+        if not task.cancelled() and task.exception():
+            logger.error('%s task stopped', task.get_name(), exc_info=task.exception())
+
+    def __create_task(self, coro, what):
+        task = asyncio.get_running_loop().create_task(coro, name=f'{self.name} {what}')
+        task.add_done_callback(self.__on_task_done)
+        self._tasks.append(task)
+        return task
+
+    def start(self):
+        # Called from the event loop
+        if self.mode == 'AUTO':
+            self._auto_task = self.__create_task(self.controller.run(), 'control')
+        if self.device:
+            self.__create_task(self.device.task(), 'device')
+        if self.mqtt_client:
+            self.__create_task(self.mqtt_client.task(), 'mqtt')
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._auto_task = None
+
+    def close(self):
+        if self.store:
+            self.store.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.tracer:
+            self.tracer.close()
@@ -0,0 +1,53 @@
+import os
+import gzip
+import queue
+import shutil
+import logging
+import logging.handlers
+
+# Log records are queued by the calling code and written to disk by a background thread,
+# so a slow SD card never blocks the event loop. Rotated files are gzipped.
+
+def gzip_namer(name):
+    return name + '.gz'
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def file_handler(filename, max_bytes=1048576, when=None, backup_count=5, compress=True):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(filename, when=when, backupCount=backup_count)
+    else:
+        handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    if compress:
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+    return handler
+
+def set_levels(level='DEBUG', levels=None, previous=None):
+    # Module loggers are named after their module, e.g. envoy: DEBUG. Modules listed in
+    # previous but not in levels follow the root level again.
+    logging.getLogger().setLevel(level.upper())
+    levels = levels or {}
+    for name in previous or {}:
+        if name not in levels:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, module_level in levels.items():
+        logging.getLogger(name).setLevel(module_level.upper())
+
+def setup_logging(filename, level='DEBUG', levels=None, max_bytes=1048576, when=None, backup_count=5, compress=True):
+    # Returns the started listener, stop it before exiting to flush the queued records
+    handler = file_handler(filename, max_bytes, when, backup_count, compress)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    set_levels(level, levels)
+    listener.start()
+    return listener
@@ -0,0 +1,54 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MeterStreamParser():
+    # The Envoy live meter stream is a never ending chunked response of server sent
+    # events, one 'data: {...}' JSON document per line. Chunk boundaries are arbitrary
+    # so we only keep the trailing partial line between two calls to feed().
+    max_line = 64 * 1024
+
+    def __init__(self):
+        self._pending = b''
+
+    @staticmethod
+    def __phase_sum(meter):
+        return sum(phase.get('p', 0) for phase in meter.values() if isinstance(phase, dict))
+
+    def parse_line(self, line):
+        line = line.strip()
+        if not line.startswith(b'data:'):
+            # Blank separators, comments and other SSE fields
+            return None
+        try:
+            event = json.loads(line[5:])
+            production = self.__phase_sum(event['production'])
+            consumption = self.__phase_sum(event['total-consumption'])
+        except (ValueError, KeyError, AttributeError):
+            logger.debug('ignoring malformed event in Envoy meter stream')
+            return None
+        return round(production), round(consumption)
+
+    def feed(self, chunk):
+        readings = []
+        start = 0
+        end = chunk.find(b'\n')
+        if end >= 0 and self._pending:
+            chunk = self._pending + chunk
+            self._pending = b''
+            end = chunk.find(b'\n')
+        while end >= 0:
+            reading = self.parse_line(chunk[start:end])
+            if reading:
+                readings.append(reading)
+            start = end + 1
+            end = chunk.find(b'\n', start)
+        self._pending += chunk[start:]
+        if len(self._pending) > self.max_line:
+            logger.warning('discarding oversized line in Envoy meter stream')
+            self._pending = b''
+        return readings
+
+    def reset(self):
+        self._pending = b''
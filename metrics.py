@@ -0,0 +1,245 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Prometheus/OpenMetrics instrumentation. Updating a metric is an attribute increment or
+# a bisect over a handful of buckets, anything more expensive to compute (pump runtime,
+# surplus, MQTT counters) is read by collectors only when the endpoint is scraped.
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric():
+    # A family of samples sharing a name, children are bound once per label values with
+    # labels() and can be kept around by the instrumented code
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self.child()
+
+    def labels(self, **labels):
+        key = tuple((k, labels[k]) for k in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self.child()
+        return child
+
+    def remove(self, **labels):
+        self._children.pop(tuple((k, labels[k]) for k in self.labelnames), None)
+
+    def __getattr__(self, attr):
+        # Metrics without labels act as their only child
+        if attr.startswith('_') or self.labelnames:
+            raise AttributeError(attr)
+        return getattr(self._children[()], attr)
+
+    def render(self, openmetrics):
+        name = self.name
+        if self.type == 'counter' and not openmetrics:
+            name += '_total'
+        lines = [f'# HELP {name} {self.help}', f'# TYPE {name} {self.type}']
+        for labels, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, labels))
+        return lines
+
+class CounterValue():
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return [f'{name}_total{format_labels(labels)} {format_value(self.value)}']
+
+class Counter(Metric):
+    type = 'counter'
+    child = CounterValue
+
+class GaugeValue():
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return [f'{name}{format_labels(labels)} {format_value(self.value)}']
+
+class Gauge(Metric):
+    type = 'gauge'
+    child = GaugeValue
+
+class HistogramValue():
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self._buckets + [float('inf')], self._counts):
+            total += count
+            lines.append(f'{name}_bucket{format_labels(labels, ("le", format_value(float(bound))))} {total}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_value(self.sum)}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+class Histogram(Metric):
+    type = 'histogram'
+    buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+    def __init__(self, name, help, labelnames=(), buckets=None):
+        if buckets:
+            self.buckets = sorted(buckets)
+        Metric.__init__(self, name, help, labelnames)
+
+    def child(self):
+        return HistogramValue(self.buckets)
+
+class Registry():
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        # Called before each scrape to refresh gauges computed from the application state
+        self._collectors.append(collector)
+
+    def render(self, openmetrics=True):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception('metrics collector failed')
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+pv_poll_seconds = registry.histogram('pipump_pv_poll_seconds', 'Duration of PV source polls', ['source'])
+pv_poll_errors = registry.counter('pipump_pv_poll_errors', 'PV source polls without a reading', ['source', 'reason'])
+token_refresh_seconds = registry.histogram('pipump_token_refresh_seconds', 'Duration of Envoy token refreshes', ['source'])
+token_refresh_errors = registry.counter('pipump_token_refresh_errors', 'Failed Envoy token refreshes', ['source'])
+pv_breaker_state = registry.gauge('pipump_pv_breaker_state', 'Circuit breaker of the PV source, 0 closed, 1 half open, 2 open', ['source'])
+mqtt_messages_sent = registry.counter('pipump_mqtt_messages_sent', 'State messages sent to the MQTT broker', ['group'])
+mqtt_messages_suppressed = registry.counter('pipump_mqtt_messages_suppressed', 'Duplicate or coalesced state messages not sent', ['group'])
+mqtt_reconnects = registry.counter('pipump_mqtt_reconnects', 'Connections to the MQTT broker lost or failed', ['group'])
+loop_lag_seconds = registry.histogram('pipump_loop_lag_seconds', 'Event loop wake up delays', buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1])
+loop_lag_max_seconds = registry.gauge('pipump_loop_lag_max_seconds', 'Largest event loop wake up delay since the previous scrape')
+pump_runtime_seconds = registry.gauge('pipump_pump_runtime_seconds', 'Runtime of the pump today', ['group', 'pump'])
+pump_running = registry.gauge('pipump_pump_running', 'Whether the pump is running', ['group', 'pump'])
+surplus_watts = registry.gauge('pipump_surplus_watts', 'Averaged production minus consumption', ['group'])
+
+class LoopMonitor():
+    # Measures how late the event loop wakes up a task sleeping interval seconds
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._max = 0
+        registry.add_collector(self.collect)
+
+    def collect(self):
+        loop_lag_max_seconds.set(self._max)
+        self._max = 0
+
+    async def task(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - start - self.interval, 0)
+            loop_lag_seconds.observe(lag)
+            self._max = max(self._max, lag)
+
+class MetricsServer():
+    # Minimal HTTP/1.1 server answering GET /metrics on the event loop
+    def __init__(self, host='0.0.0.0', port=9108, registry=registry):
+        self._host = host
+        self._port = port
+        self._registry = registry
+        self._server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            lines = request.decode('latin-1').split('\r\n')
+            method, path = lines[0].split(' ')[:2]
+            accept = ''
+            for line in lines[1:]:
+                if line.lower().startswith('accept:'):
+                    accept = line[7:]
+            if method != 'GET' or path.split('?')[0] not in ('/metrics', '/'):
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            else:
+                openmetrics = 'application/openmetrics-text' in accept
+                body = self._registry.render(openmetrics).encode()
+                content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8' if openmetrics else 'text/plain; version=0.0.4; charset=utf-8'
+                writer.write(f'HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        logger.debug('serving metrics on %s:%s', self._host, self._port)
+        return self._port
+
+    async def task(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            logger.debug('metrics server task cancelled')
+            raise
+        finally:
+            self._server.close()
@@ -4,58 +4,193 @@ import json
 
 import paho.mqtt.client as mqtt
 
-class MQTTClient():
-    def __init__(self, options):
+import metrics
+from publisher import StatePublisher
+from tracer import null_tracer
+
+logger = logging.getLogger(__name__)
+
+class MQTTConnection():
+    # paho client driven by the event loop, which watches the socket for reads and writes
+    # instead of a network thread polling it. Subclasses subscribe in on_connected.
+    def __init__(self, client_id, options, label):
         self._host = options.get('host', '127.0.0.1')
         self._port = options.get('port', 1883)
         self._username = options.get('username', None)
         self._password = options.get('password', None)
         self._timeout = options.get('timeout', 60)
+        self._loop = None
+        self._misc_task = None
+        self._disconnected = None
+        # Socket callbacks fired while connect() runs in a worker thread
+        self._deferred = None
+
+        self._client = mqtt.Client(client_id = client_id, clean_session = True, userdata = None, protocol = 4)
+        if self._username:
+            self._client.username_pw_set(username = self._username, password = self._password)
+        self._client.on_connect = self.on_connected
+        self._reconnects = metrics.mqtt_reconnects.labels(group=label)
+
+    def on_connected(self, client, userdata, flags, rc):
+        pass
+
+    def on_socket_open(self, client, userdata, sock):
+        # Let the event loop tell paho when the socket is readable instead of polling it
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_task = self._loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+        if self._disconnected and not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        # Outgoing packets are queued, write them as soon as the socket accepts data
+        self._loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    def __deferrable(self, callback):
+        def call(client, userdata, sock):
+            if self._deferred is not None:
+                self._deferred.append((callback, (client, userdata, sock)))
+            else:
+                callback(client, userdata, sock)
+        return call
+
+    async def __connect(self):
+        # paho opens the TCP connection synchronously, waiting up to several seconds for
+        # an unreachable broker. It runs in a worker thread and the socket callbacks it
+        # fires are replayed on the event loop once it returned, before any read or write.
+        self._deferred = []
+        try:
+            await self._loop.run_in_executor(None, self._client.connect, self._host, self._port, self._timeout)
+        finally:
+            deferred, self._deferred = self._deferred, None
+            for callback, args in deferred:
+                callback(*args)
+
+    async def misc_loop(self):
+        # Keepalive pings and retries, paho expects this to be called about once per second
+        while self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def task(self):
+        self._loop = asyncio.get_running_loop()
+        self._client.on_socket_open = self.__deferrable(self.on_socket_open)
+        self._client.on_socket_close = self.__deferrable(self.on_socket_close)
+        self._client.on_socket_register_write = self.__deferrable(self.on_socket_register_write)
+        self._client.on_socket_unregister_write = self.__deferrable(self.on_socket_unregister_write)
+        try:
+            while True:
+                try:
+                    logger.debug('connecting to MQTT server %s:%s', self._host, self._port)
+                    await self.__connect()
+                    logger.debug('connected to MQTT server %s:%s', self._host, self._port)
+                    self._disconnected = self._loop.create_future()
+                    await self._disconnected
+                    logger.debug('connection to MQTT server lost, will retry')
+                except (OSError, mqtt.WebsocketConnectionError):
+                    logger.debug('MQTT connection attempt failed, will try again')
+                self._reconnects.inc()
+                await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            logger.debug('mqtt_loop task cancelled')
+            self._client.disconnect()
+            raise
+
+class MQTTClient(MQTTConnection):
+    def __init__(self, options, group='pipump'):
         self._uid = options.get('uid', '12345')
+        # Metrics are labelled with the group name like the ones of the group itself
+        self._group = group
         self._discovery = options.get('discovery', True)
         self._discovery_prefix = options.get('discovery_prefix', 'homeassistant')
+        self._coalesce_window = options.get('coalesce_window', 1.0)
         self._pumps = []
+        # Command topic of each pump, all of them matched by one wildcard subscription
+        self._switch_topics = {}
+        self._planner = None
+        self._breaker = None
+        self._mode = 'AUTO'
         self._mode_changed_callback = None
         self._switch_callback = None
-
-        self._client = mqtt.Client(client_id = f'pipump_{self._uid}', clean_session = True, userdata = None, protocol = 4)
-        if self._username:
-            self._client.username_pw_set(username = self._username, password = self._password)
-        self._client.on_connect = self.on_connected
+        MQTTConnection.__init__(self, f'pipump_{self._uid}', options, group)
+        self._publisher = StatePublisher(self._client, self._coalesce_window)
+        self._tracer = null_tracer
     
     def attach(self, pumps, mode_callback, switch_callback):
         self._pumps = pumps
+        self._switch_topics = {f'{self._discovery_prefix}/switch/pipump_{self._uid}/{p.name}/set': p for p in pumps}
         for p in pumps:
             p.add_state_callback(self.on_pump_state_changed)
             p.add_update_callback(self.on_pump_updated)
         self._mode_changed_callback = mode_callback
         self._switch_callback = switch_callback
     
+    def attach_tracer(self, tracer):
+        # Times the publishes triggered by pump callbacks within control ticks
+        self._tracer = tracer
+
+    def attach_planner(self, planner):
+        self._planner = planner
+        planner.add_probability_callback(self.on_goal_probability)
+
+    def attach_breaker(self, breaker):
+        self._breaker = breaker
+        breaker.add_state_callback(self.on_breaker_state)
+
+    def on_breaker_state(self, breaker, state):
+        self._publisher.publish(f'{self._discovery_prefix}/sensor/pipump_{self._uid}/pvsystem/state', state, retain=True)
+
+    def on_goal_probability(self, pump, probability):
+        topic = f'{self._discovery_prefix}/sensor/pipump_{self._uid}/{pump.name}_probability/state'
+        with self._tracer.span('mqtt.publish'):
+            self._publisher.publish(topic, round(probability * 100), retain=True)
+
     def on_pump_updated(self, pump, progress):
         topic = f'{self._discovery_prefix}/sensor/pipump_{self._uid}/{pump.name}/state'
-        self._client.publish(topic, progress, retain=True)
+        with self._tracer.span('mqtt.publish'):
+            self._publisher.publish(topic, progress, retain=True)
 
     def on_pump_state_changed(self, pump, state):
         topic = f'{self._discovery_prefix}/switch/pipump_{self._uid}/{pump.name}/state'
-        self._client.publish(topic, state, retain=True)
+        with self._tracer.span('mqtt.publish'):
+            self._publisher.publish(topic, state, retain=True)
     
+    @property
+    def messages_sent(self):
+        return self._publisher.sent
+
+    @property
+    def messages_suppressed(self):
+        return self._publisher.suppressed
+
+    def collect_metrics(self):
+        metrics.mqtt_messages_sent.labels(group=self._group).value = self._publisher.sent
+        metrics.mqtt_messages_suppressed.labels(group=self._group).value = self._publisher.suppressed
+
     def on_select_message(self, client, userdata, msg):
         new_mode = msg.payload.decode("utf-8")
         if self._mode_changed_callback:
             res = self._mode_changed_callback(new_mode)
             if res:
+                self._mode = res
                 topic = f'{self._discovery_prefix}/select/pipump_{self._uid}/state'
-                client.publish(topic, new_mode, retain=True)
+                self._publisher.publish(topic, new_mode, retain=True)
 
     def on_switch_message(self, client, userdata, msg):
         if self._switch_callback:
-            payload = msg.payload.decode("utf-8")
-            topic_parts = msg.topic.split('/')
-            pump_name = topic_parts[len(topic_parts) - 2]
-            for p in self._pumps:
-                if p.name == pump_name:
-                    self._switch_callback(p, payload)
-                    break
+            pump = self._switch_topics.get(msg.topic)
+            if pump is None:
+                logger.debug('ignoring command for unknown switch %s', msg.topic)
+                return
+            self._switch_callback(pump, msg.payload.decode("utf-8"))
     
     def announce_select(self):
         base_topic = f'{self._discovery_prefix}/select/pipump_{self._uid}'
@@ -83,7 +218,7 @@ class MQTTClient():
 
         self._client.message_callback_add(f'{base_topic}/set', self.on_select_message)
         self._client.subscribe(f'{base_topic}/set')
-        self._client.publish(f'{base_topic}/state', 'AUTO', retain=True)
+        self._publisher.publish(f'{base_topic}/state', self._mode, retain=True, force=True)
 
     def announce_sensor(self, pump):
         base_topic = f'{self._discovery_prefix}/sensor/pipump_{self._uid}/{pump.name}'
@@ -107,7 +242,47 @@ class MQTTClient():
 
             self._client.publish(f'{base_topic}/config', json.dumps(payload), retain=True)
         
-        self._client.publish(f'{base_topic}/state', pump.goal_progress, retain=True)
+        self._publisher.publish(f'{base_topic}/state', pump.goal_progress, retain=True, force=True)
+
+    def announce_probability_sensor(self, pump):
+        base_topic = f'{self._discovery_prefix}/sensor/pipump_{self._uid}/{pump.name}_probability'
+
+        if self._discovery:
+            device = {}
+            device['identifiers'] = [ f'pipump.{self._uid}_{pump.name}' ]
+            device['model'] = 'Water pump'
+            device['name'] = 'Pump ' + pump.name
+            device['suggested_area'] = 'Swimming pool'
+            device['via_device'] = f'pipump.{self._uid}'
+
+            payload = {}
+            payload['name'] = 'Daily goal probability'
+            payload['unique_id'] = f'pipump.{self._uid}_{pump.name}_probability'
+            payload['icon'] = 'mdi:weather-partly-cloudy'
+            payload['entity_category'] = 'diagnostic'
+            payload['unit_of_measurement'] = '%'
+            payload['state_topic'] = base_topic + '/state'
+            payload['device'] = device
+
+            self._client.publish(f'{base_topic}/config', json.dumps(payload), retain=True)
+
+    def announce_breaker_sensor(self):
+        base_topic = f'{self._discovery_prefix}/sensor/pipump_{self._uid}/pvsystem'
+
+        if self._discovery:
+            payload = {}
+            payload['name'] = 'PV source'
+            payload['unique_id'] = f'pipump.{self._uid}_pvsystem'
+            payload['icon'] = 'mdi:solar-power'
+            payload['entity_category'] = 'diagnostic'
+            payload['device_class'] = 'enum'
+            payload['options'] = ['closed', 'half_open', 'open']
+            payload['state_topic'] = base_topic + '/state'
+            payload['device'] = {'identifiers': [ f'pipump.{self._uid}' ]}
+
+            self._client.publish(f'{base_topic}/config', json.dumps(payload), retain=True)
+
+        self._publisher.publish(f'{base_topic}/state', self._breaker.state, retain=True, force=True)
 
     def announce_pump(self, pump):
         base_topic = f'{self._discovery_prefix}/switch/pipump_{self._uid}/{pump.name}'
@@ -131,39 +306,62 @@ class MQTTClient():
 
             self._client.publish(f'{base_topic}/config', json.dumps(payload), retain=True)
         
-        self._client.message_callback_add(f'{base_topic}/set', self.on_switch_message)
-        self._client.subscribe(f'{base_topic}/set')
-        self._client.publish(f'{base_topic}/state', 'ON' if pump.is_running() else 'OFF', retain=True)
+        self._publisher.publish(f'{base_topic}/state', 'ON' if pump.is_running() else 'OFF', retain=True, force=True)
+
+    def subscribe_switches(self):
+        # A single subscription for the commands of all pumps, routed by on_switch_message
+        topic = f'{self._discovery_prefix}/switch/pipump_{self._uid}/+/set'
+        self._client.message_callback_add(topic, self.on_switch_message)
+        self._client.subscribe(topic)
+
+    def announce_pumps(self):
+        if self._breaker:
+            self.announce_breaker_sensor()
+        for p in self._pumps:
+            self.announce_pump(p)
+            self.announce_sensor(p)
+            if self._planner:
+                self.announce_probability_sensor(p)
+
+    def clear_discovery(self):
+        # Empty retained configs remove the entities from Home Assistant
+        base_topic = f'{self._discovery_prefix}/%s/pipump_{self._uid}'
+        topics = [base_topic % 'select']
+        if self._breaker:
+            topics.append(f'{base_topic % "sensor"}/pvsystem')
+        for p in self._pumps:
+            topics.append(f'{base_topic % "switch"}/{p.name}')
+            topics.append(f'{base_topic % "sensor"}/{p.name}')
+            if self._planner:
+                topics.append(f'{base_topic % "sensor"}/{p.name}_probability')
+        for topic in topics:
+            self._client.publish(f'{topic}/config', '', retain=True)
+
+    def reconfigure(self, options):
+        # Applies the options that can change while connected, returns the ones needing a restart
+        restart = []
+        current = {'host': self._host, 'port': self._port, 'username': self._username, 'password': self._password,
+                   'timeout': self._timeout, 'uid': self._uid, 'discovery_prefix': self._discovery_prefix}
+        defaults = {'host': '127.0.0.1', 'port': 1883, 'timeout': 60, 'uid': '12345', 'discovery_prefix': 'homeassistant'}
+        for key, value in current.items():
+            if options.get(key, defaults.get(key)) != value:
+                restart.append(key)
+        self._publisher.window = options.get('coalesce_window', 1.0)
+        discovery = options.get('discovery', True)
+        if discovery != self._discovery:
+            logger.info('Home Assistant discovery %s', 'enabled' if discovery else 'disabled')
+            if not discovery:
+                self.clear_discovery()
+            self._discovery = discovery
+            if discovery and self._pumps:
+                self.announce_select()
+                self.announce_pumps()
+        return restart
 
     def on_connected(self, client, userdata, flags, rc):
         # Announce our select and one switch per pump
+        self._publisher.reset()
         if self._pumps:
             self.announce_select()
-            for p in self._pumps:
-                self.announce_pump(p)
-                self.announce_sensor(p)
-
-    async def task(self):
-        try:
-            try:
-                logging.debug(f'connecting to MQTT server {self._host}:{self._port}')
-                self._client.connect(self._host, self._port, self._timeout)
-                logging.debug(f'connected to MQTT server {self._host}:{self._port}')
-            except (OSError, mqtt.WebsocketConnectionError):
-                logging.debug('initial MQTT connection failed')
-            while True:
-                rc = self._client.loop(timeout=1, max_packets=1)
-                if rc > 0:
-                    logging.debug('connection to MQTT server lost, will retry')
-                    await asyncio.sleep(30)
-                    try:
-                        logging.debug(f'reconnecting to MQTT server {self._host}:{self._port}')
-                        self._client.reconnect()
-                        logging.debug(f'connected to MQTT server {self._host}:{self._port}')
-                    except (OSError, mqtt.WebsocketConnectionError):
-                        logging.debug('reconnection attempt failed, will try again')
-                else:
-                    await asyncio.sleep(0.1)
-        except asyncio.CancelledError:
-            logging.debug('mqtt_loop task cancelled')
-            raise
+            self.subscribe_switches()
+            self.announce_pumps()
@@ -0,0 +1,125 @@
+import logging
+
+import metrics
+from pvsystem import PVSystem
+from mqttclient import MQTTConnection
+from selector import Selector
+
+logger = logging.getLogger(__name__)
+
+class MQTTMeter(PVSystem, MQTTConnection):
+    # Power readings pushed by a smart meter or an inverter to MQTT topics. Every message
+    # goes straight into the averages, nothing is polled. Consumption is either published
+    # as such or derived from the grid power, imported power being positive. When a topic
+    # has been silent for stale seconds the production is assumed to be gone, so that
+    # pumps are stopped rather than left running on grid power.
+    def __init__(self, options, averaging='sma', window=5, clock=None):
+        PVSystem.__init__(self, averaging, window, clock)
+        self._selectors = self.__selectors(options)
+        self._stale_after = options.get('stale', 60)
+        self._stale = False
+        # Silence is counted from startup until the first message of each topic
+        self._seen = dict.fromkeys(self._selectors, self._clock.time())
+        self._last = {}
+        # Consumption cleared by the controller after switching a pump, until the next reading
+        self._switched = False
+        source = f'mqtt:{self._selectors["production"].topic}'
+        self._errors = {reason: metrics.pv_poll_errors.labels(source=source, reason=reason) for reason in ('decode', 'stale')}
+        MQTTConnection.__init__(self, options.get('client_id', ''), options, source)
+
+    @staticmethod
+    def __selectors(options):
+        if 'consumption' not in options and 'grid' not in options:
+            raise ValueError('the MQTT meter needs a consumption or grid topic')
+        return {key: Selector(options[key]) for key in ('production', 'consumption', 'grid') if key in options}
+
+    def on_connected(self, client, userdata, flags, rc):
+        for topic in {s.topic for s in self._selectors.values()}:
+            self._client.message_callback_add(topic, self.on_message)
+            self._client.subscribe(topic)
+
+    def on_message(self, client, userdata, msg):
+        # Several readings may come in the same message, production is handled first
+        now = self._clock.time()
+        for key, selector in self._selectors.items():
+            if selector.topic != msg.topic:
+                continue
+            try:
+                value = selector.value(msg.payload)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.debug('ignoring %s payload on %s: %s', key, msg.topic, e)
+                self._errors['decode'].inc()
+                continue
+            self._seen[key] = now
+            self.__on_reading(key, value)
+
+    def __on_reading(self, key, value):
+        if key == 'production':
+            self.production = value
+        elif key == 'grid':
+            if 'production' not in self._last:
+                return
+            # Grid power is the consumption minus the production
+            key, value = 'consumption', self._last['production'] + value
+        if key == 'consumption':
+            self.consumption = value
+            self._switched = False
+        self._last[key] = value
+        if len(self._last) == 2:
+            self.notify_readings(self._last['production'], self._last['consumption'])
+
+    # The controller clears the consumption average after switching a pump so that the
+    # next update() reads it again. Readings are pushed here, until the meter publishes
+    # one the last raw value stands in and no surplus is reported.
+    @property
+    def consumption(self):
+        if not len(self._consumption_readings) and 'consumption' in self._last:
+            return round(self._last['consumption'])
+        return PVSystem.consumption.fget(self)
+
+    @consumption.setter
+    def consumption(self, value):
+        PVSystem.consumption.fset(self, value)
+
+    @consumption.deleter
+    def consumption(self):
+        PVSystem.consumption.fdel(self)
+        self._switched = True
+
+    def is_stale(self, now=None):
+        if now is None:
+            now = self._clock.time()
+        return any(now - seen > self._stale_after for seen in self._seen.values())
+
+    async def update(self):
+        if self.is_stale():
+            if not self._stale:
+                logger.warning('no power readings on %s for %s seconds, assuming no production',
+                               ', '.join(s.topic for s in self._selectors.values()), self._stale_after)
+                self._stale = True
+                self._errors['stale'].inc()
+            del self.production
+        elif self._stale:
+            logger.info('power readings are back')
+            self._stale = False
+        if self._switched:
+            logger.debug('no consumption reading since the last pump switch, holding')
+            return min(self.production - self.consumption, 0)
+        return self.production - self.consumption
+
+    def reconfigure(self, options):
+        restart = PVSystem.reconfigure(self, options)
+        for key, default in (('host', '127.0.0.1'), ('port', 1883), ('username', None), ('password', None), ('timeout', 60)):
+            if options.get(key, default) != getattr(self, f'_{key}'):
+                restart.append(key)
+        selectors = self.__selectors(options)
+        if {k: s.topic for k, s in selectors.items()} != {k: s.topic for k, s in self._selectors.items()}:
+            # Subscriptions are made when connecting
+            restart.append('topics')
+        else:
+            self._selectors = selectors
+        self._stale_after = options.get('stale', 60)
+        return restart
+
+    async def task(self):
+        await MQTTConnection.task(self)
@@ -0,0 +1,153 @@
+import time
+import logging
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from graph import PumpGraph
+
+logger = logging.getLogger(__name__)
+
+MINUTES = 24 * 60
+
+def record_dtypes():
+    # Record layouts of the history day files by version, see recorder.DayFile
+    fields = [('timestamp', '<f8'), ('production', '<i4'), ('consumption', '<i4')]
+    return {1: np.dtype(fields + [('pumps', '<u4')]), 2: np.dtype(fields + [('pumps', '<u8')])}
+
+class Planner():
+    # Learns the per minute surplus of the site from the recorded history of the past days
+    # and checks every tick whether each pump can still reach its daily goal on solar
+    # power. A pump is forced to run on grid power once the minutes left before the
+    # deadline are just enough to complete its runtime.
+    def __init__(self, recorder, pumps, days=14, deadline=None, margin=5):
+        if np is None:
+            raise ImportError('the planner requires numpy')
+        self._recorder = recorder
+        self._pumps = pumps
+        self._graph = PumpGraph.of(pumps)
+        self._days = days
+        # Time of day as 'HH:MM', sunset learned from history otherwise
+        self._deadline = deadline
+        self._margin = margin
+        self._powers = np.array([p.power for p in pumps], dtype=float)
+        self._dtypes = record_dtypes()
+        self._learned_on = None
+        # Days x minutes matrices of production and surplus excluding our own pumps
+        self._production = np.zeros((0, MINUTES))
+        self._surplus = np.zeros((0, MINUTES))
+        self._probability_callbacks = []
+
+    def reconfigure(self, graph):
+        # Pump powers or links changed, learn the curve again without our new powers
+        self._graph = graph
+        self._powers = np.array([p.power for p in self._pumps], dtype=float)
+        self._learned_on = None
+
+    def add_probability_callback(self, callback):
+        self._probability_callbacks.append(callback)
+
+    def __records(self, start, end):
+        # Records decoded straight from the day files, without a Python loop per record
+        chunks = [np.frombuffer(data, dtype=self._dtypes[version]) for version, data in self._recorder.iter_raw(start, end)]
+        if not chunks:
+            return None
+        if len(chunks) == 1:
+            return chunks[0]
+        return {name: np.concatenate([c[name] for c in chunks]) for name in ('timestamp', 'production', 'consumption', 'pumps')}
+
+    def __day_profile(self, day):
+        start = datetime.combine(day, datetime.min.time()).timestamp()
+        records = self.__records(start, start + 24 * 3600)
+        if records is None:
+            return None
+        timestamp = records['timestamp']
+        production = records['production'].astype(float)
+        consumption = records['consumption'].astype(float)
+        mask = records['pumps'].astype(np.uint64)
+        # Remove the power drawn by our own pumps from the household consumption
+        bits = (mask[:, None] >> np.arange(len(self._powers), dtype=np.uint64)) & 1
+        consumption -= bits @ self._powers
+        minute = ((timestamp - start) // 60).astype(int).clip(0, MINUTES - 1)
+        counts = np.bincount(minute, minlength=MINUTES)
+        profile = np.full((2, MINUTES), np.nan)
+        seen = counts > 0
+        profile[0, seen] = np.bincount(minute, weights=production, minlength=MINUTES)[seen] / counts[seen]
+        profile[1, seen] = np.bincount(minute, weights=production - consumption, minlength=MINUTES)[seen] / counts[seen]
+        # Hold the last reading over minutes without samples
+        index = np.where(seen, np.arange(MINUTES), 0)
+        np.maximum.accumulate(index, out=index)
+        profile = profile[:, index]
+        profile[:, :np.argmax(seen)] = np.nan
+        return profile
+
+    def learn(self, today):
+        profiles = []
+        for i in range(1, self._days + 1):
+            profile = self.__day_profile(today - timedelta(days=i))
+            if profile is not None:
+                profiles.append(profile)
+        if profiles:
+            stacked = np.nan_to_num(np.stack(profiles), nan=0.0)
+            self._production = stacked[:, 0]
+            self._surplus = stacked[:, 1]
+        else:
+            self._production = np.zeros((0, MINUTES))
+            self._surplus = np.zeros((0, MINUTES))
+        self._learned_on = today
+        logger.debug('planner learned production curve from %s days', len(profiles))
+
+    def deadline(self):
+        # Minute of the day by which daily goals have to be met
+        if self._deadline:
+            hours, minutes = self._deadline.split(':')
+            return int(hours) * 60 + int(minutes)
+        if not len(self._production):
+            return MINUTES
+        producing = np.nonzero(np.median(self._production, axis=0) > 0)[0]
+        return int(producing[-1]) + 1 if len(producing) else MINUTES
+
+    def plan(self, now=None):
+        if now is None:
+            now = time.time()
+        current = datetime.fromtimestamp(now)
+        if current.date() != self._learned_on:
+            self.learn(current.date())
+        minute = current.hour * 60 + current.minute
+        deadline = self.deadline()
+        left = max(deadline - minute, 0)
+        surplus = self._surplus[:, minute:deadline]
+        if len(self._production) and minute:
+            # Scale past days so that they match what today produced so far
+            today = self.__records(now - minute * 60, now)
+            past = self._production[:, :minute].sum(axis=1) / minute
+            if today is not None and past.mean() > 0:
+                surplus = surplus * min(max(today['production'].mean() / past.mean(), 0), 1.5)
+        forced = []
+        probabilities = {}
+        for p in self._pumps:
+            if p.desired_runtime <= 0:
+                continue
+            running_for = now - p.on_since if p.on_since else 0
+            needed = max(p.desired_runtime - p.runtime - running_for, 0) / 60
+            # Upstream pumps which are not running yet have to be powered along
+            power = p.power + sum(u.power for u in self._graph.closure([p]) if u is not p and not u.is_running())
+            if needed <= 0:
+                probability = 1.0
+            elif len(surplus):
+                # Share of the past days with enough solar minutes left to meet the goal
+                probability = float(np.mean((surplus >= power).sum(axis=1) >= needed))
+            else:
+                probability = 0.0
+            probabilities[p] = probability
+            if needed > 0 and left <= needed + self._margin:
+                forced.append(p)
+        for p, probability in probabilities.items():
+            for cb in self._probability_callbacks:
+                cb(p, probability)
+        if forced and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('planner forcing %s to meet goals before minute %s', ', '.join(p.name for p in forced), deadline)
+        return forced, probabilities
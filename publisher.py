@@ -0,0 +1,80 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StatePublisher():
+    # Sits in front of the paho client for state topics. A value identical to the last
+    # one sent on a topic is dropped, and values published again on a topic within
+    # window seconds are collapsed so that only the latest one goes out when it ends.
+    def __init__(self, client, window=1.0):
+        self._client = client
+        self.window = window
+        self._last = {}
+        self._sent_at = {}
+        self._pending = {}
+        # One flush timer per topic with a pending value
+        self._timers = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def __send(self, topic, payload, retain):
+        info = self._client.publish(topic, payload, retain=retain)
+        if info.rc != 0:
+            # Not connected, forget the topic so the value goes out once we are back
+            logger.debug('failed publishing on %s, error %s', topic, info.rc)
+            self._last.pop(topic, None)
+            return
+        self._last[topic] = payload
+        self._sent_at[topic] = time.monotonic()
+        self.sent += 1
+
+    def __flush(self, topic):
+        self._timers.pop(topic, None)
+        if topic not in self._pending:
+            return
+        payload, retain = self._pending.pop(topic)
+        if self._last.get(topic) == payload:
+            self.suppressed += 1
+            return
+        self.__send(topic, payload, retain)
+
+    def publish(self, topic, payload, retain=False, force=False):
+        if force:
+            self.__cancel(topic)
+            self.__send(topic, payload, retain)
+            return
+        if topic in self._pending:
+            # Burst on that topic, the pending value is superseded and never sent
+            self._pending[topic] = (payload, retain)
+            self.suppressed += 1
+            return
+        if self._last.get(topic) == payload:
+            self.suppressed += 1
+            return
+        elapsed = time.monotonic() - self._sent_at.get(topic, float('-inf'))
+        if elapsed < self.window:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop:
+                self._pending[topic] = (payload, retain)
+                self._timers[topic] = loop.call_later(self.window - elapsed, self.__flush, topic)
+                return
+        self.__send(topic, payload, retain)
+
+    def __cancel(self, topic):
+        timer = self._timers.pop(topic, None)
+        if timer:
+            timer.cancel()
+        return self._pending.pop(topic, None)
+
+    def reset(self):
+        # After a reconnection nothing can be assumed about what the broker holds, values
+        # held back go out right away
+        self._last.clear()
+        for topic in list(self._pending):
+            payload, retain = self.__cancel(topic)
+            self.__send(topic, payload, retain)
@@ -1,6 +1,8 @@
-import time
 import logging
-from datetime import datetime
+
+from clock import system_clock
+
+logger = logging.getLogger(__name__)
 
 emulate_pi = False
 try:
@@ -14,63 +16,100 @@ class Pump:
     desired_runtime = 0
     runtime = 0
     on_since = None
-    chained_to = None
+    off_since = None
+    upstreams = ()
+    priority = 1
     
-    def __init__(self, name, power, runtime, GPIO_ID = None):
+    def __init__(self, name, power, runtime, GPIO_ID = None, priority = 1, clock = None):
         self.power = power
+        self.priority = priority
         self.name = name
         self.desired_runtime = runtime
         self._GPIO_ID = GPIO_ID
-        self._current_date = datetime.today().date()
+        self._clock = clock or system_clock
+        self.upstreams = []
+        self._current_date = self._clock.today()
         self._state_callbacks = []
         self._update_callbacks = []
 
         if self._GPIO_ID and not emulate_pi:
-            logging.debug(f'setting up GPIO {self._GPIO_ID} for pump {self.name}')
+            logger.debug('setting up GPIO %s for pump %s', self._GPIO_ID, self.name)
             GPIO.setup(self._GPIO_ID, GPIO.OUT, initial=GPIO.HIGH)
     
     @property
     def goal_progress(self):
         runtime = self.runtime
         if self.on_since:
-            runtime += time.time() - self.on_since
+            runtime += self._clock.time() - self.on_since
+        if not self.desired_runtime:
+            # Nothing to run, the goal is met
+            return 100
         return round(runtime * 100 / self.desired_runtime)
 
+    @property
+    def gpio(self):
+        return self._GPIO_ID
+
+    @property
+    def chained_to(self):
+        return self.upstreams[0] if self.upstreams else None
+
     def should_run(self):
-        if self.chained_to and not self.chained_to.should_run():
-            return False
+        # PumpGraph.eligible() answers this for all pumps at once
+        for u in self.upstreams:
+            if not u.should_run():
+                return False
         return self.runtime < self.desired_runtime
     
     def can_run(self, available_power):
-        if self.chained_to:
-            # We can only run when our upstream pump already runs
-            if not self.chained_to.is_running():
+        # We can only run when all our upstream pumps already run
+        for u in self.upstreams:
+            if not u.is_running():
                 return False, available_power
-            if self.is_running():
-                return available_power >= 0, available_power
-            else:
-                start, availability = self.chained_to.can_run(available_power - self.power)
-                if start:
-                    return True, available_power - self.power
-                else:
-                    return False, available_power
+        if self.is_running():
+            return available_power >= 0, available_power
+        if available_power >= self.power:
+            return True, available_power - self.power
         else:
-            if self.is_running():
-                return available_power >= 0, available_power
-            if available_power >= self.power:
-                return True, available_power - self.power
-            else:
-                return False, available_power
+            return False, available_power
     
     def is_running(self):
         return self.on_since != None
     
     def chain(self, pump):
-        self.chained_to = pump
+        if pump not in self.upstreams:
+            self.upstreams.append(pump)
     
     def is_chained(self):
-        return self.chained_to != None
+        return len(self.upstreams) > 0
+
+    def reconfigure(self, power, runtime, priority, upstreams):
+        # New settings applied in place, a running pump keeps running and its day runtime
+        # is kept. The goal progress is published again when the desired runtime changes.
+        notify = runtime != self.desired_runtime
+        self.power = power
+        self.priority = priority
+        self.desired_runtime = runtime
+        self.upstreams = list(upstreams)
+        if notify:
+            progress = self.goal_progress
+            for cb in self._update_callbacks:
+                cb(self, progress)
     
+    def get_state(self):
+        return {'runtime': self.runtime, 'on_since': self.on_since, 'date': self._current_date.isoformat()}
+
+    def restore_state(self, state):
+        if state.get('date') != self._current_date.isoformat():
+            logger.debug('ignoring saved state of pump %s from %s', self.name, state.get('date'))
+            return
+        self.runtime = state.get('runtime', 0)
+        on_since = state.get('on_since')
+        if on_since:
+            # The relay was released when we went down, count the run until the last record
+            self.runtime += max(state.get('seen', on_since) - on_since, 0)
+        logger.info('restored pump %s day runtime %s seconds', self.name, round(self.runtime))
+
     def add_state_callback(self, callback):
         self._state_callbacks.append(callback)
     
@@ -79,25 +118,26 @@ class Pump:
     
     def turn_on(self):
         if not self.is_running():
-            logging.info(f'starting pump {self.name}')
+            logger.info('starting pump %s', self.name)
             # Call GPIO to turn the pump on
             if self._GPIO_ID and not emulate_pi:
-                logging.debug(f'setting GPIO {self._GPIO_ID} to LOW for pump {self.name}')
+                logger.debug('setting GPIO %s to LOW for pump %s', self._GPIO_ID, self.name)
                 GPIO.output(self._GPIO_ID, GPIO.LOW)
-            self.on_since = time.time()
+            self.on_since = self._clock.time()
             for cb in self._state_callbacks:
                 cb(self, 'ON')
     
     def turn_off(self):
         if self.is_running():
-            ran_for = time.time() - self.on_since
-            logging.info(f'stopping pump {self.name}, ran for {round(ran_for)} seconds, day runtime {round(self.runtime)} seconds')
+            ran_for = self._clock.time() - self.on_since
+            logger.info('stopping pump %s, ran for %s seconds, day runtime %s seconds', self.name, round(ran_for), round(self.runtime))
             # Call GPIO to turn the pump off
             if self._GPIO_ID and not emulate_pi:
-                logging.debug(f'setting GPIO {self._GPIO_ID} to HIGH for pump {self.name}')
+                logger.debug('setting GPIO %s to HIGH for pump %s', self._GPIO_ID, self.name)
                 GPIO.output(self._GPIO_ID, GPIO.HIGH)
             self.runtime += ran_for
             self.on_since = None
+            self.off_since = self._clock.time()
             for cb in self._state_callbacks:
                 cb(self, 'OFF')
 
@@ -105,14 +145,14 @@ class Pump:
         notify = False
         if self.is_running():
             notify = True
-            ran_for = time.time() - self.on_since
+            ran_for = self._clock.time() - self.on_since
             if self.runtime + ran_for >= self.desired_runtime:
                 self.turn_off()
         
-        now = datetime.today().date()
+        now = self._clock.today()
         if self._current_date != now:
             notify = True
-            logging.debug(f'date changed to next day for pump {self.name}, resetting counters and turning off if running')
+            logger.debug('date changed to next day for pump %s, resetting counters and turning off if running', self.name)
             self.turn_off()
             # Reset counters
             self.runtime = 0
@@ -123,4 +163,5 @@ class Pump:
             for cb in self._update_callbacks:
                 cb(self, progress)
 
-        logging.debug(f'pump {self.name} updated, day runtime {round(self.runtime)}, desired {self.desired_runtime}, running {self.is_running()}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('pump %s updated, day runtime %s, desired %s, running %s', self.name, round(self.runtime), self.desired_runtime, self.is_running())
@@ -1,16 +1,65 @@
-from collections import deque
-from statistics import mean
+import logging
+
+from filters import make_filter
+from clock import system_clock
+
+logger = logging.getLogger(__name__)
 
 class PVSystem:
-    def __init__(self):
-        self._consumption_readings = deque([], maxlen=5)
-        self._production_readings = deque([], maxlen=5)
+    def __init__(self, averaging='sma', window=5, clock=None):
+        self._clock = clock or system_clock
+        self._averaging = averaging
+        self._window = window
+        self._consumption_readings = make_filter(averaging, window, self._clock.time)
+        self._production_readings = make_filter(averaging, window, self._clock.time)
+        self._reading_callbacks = []
+
+    def __refilter(self, readings):
+        # Seeded with the current average so that pumps are not stopped meanwhile
+        value = readings.value()
+        readings = make_filter(self._averaging, self._window, self._clock.time)
+        if value is not None:
+            readings.append(value)
+        return readings
+
+    def reconfigure(self, options):
+        # Applies the options that can change at runtime, returns the ones needing a restart
+        averaging = options.get('averaging', 'sma')
+        window = options.get('window', 5)
+        if (averaging, window) != (self._averaging, self._window):
+            logger.info('averaging readings with %s over %s', averaging, window)
+            self._averaging = averaging
+            self._window = window
+            self._consumption_readings = self.__refilter(self._consumption_readings)
+            self._production_readings = self.__refilter(self._production_readings)
+        return []
+
+    async def update(self):
+        # Subclasses refresh their readings before returning the availability
+        return self.production - self.consumption
+
+    def add_reading_callback(self, callback):
+        self._reading_callbacks.append(callback)
+
+    def notify_readings(self, production, consumption):
+        # Called by sources with every raw reading they receive
+        for cb in self._reading_callbacks:
+            cb(self, production, consumption)
+
+    def is_stale(self):
+        # Readings too old to act upon, the controller falls back to a safe policy
+        return False
+
+    async def task(self):
+        # Background work for sources pushing their readings, nothing to do by default
+        pass
 
     @property
     def consumption(self):
-        if not len(self._consumption_readings):
+        value = self._consumption_readings.value()
+        if value is None:
             return 0
-        return round(mean(self._consumption_readings))
+        return round(value)
     
     @consumption.setter
     def consumption(self, value):
@@ -22,9 +71,10 @@ class PVSystem:
 
     @property
     def production(self):
-        if not len(self._production_readings):
+        value = self._production_readings.value()
+        if value is None:
             return 0
-        return round(mean(self._production_readings))
+        return round(value)
     
     @production.setter
     def production(self, value):
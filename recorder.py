@@ -0,0 +1,230 @@
+import os
+import csv
+import mmap
+import time
+import struct
+import logging
+from array import array
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class DayFile():
+    # One memory mapped ring of fixed width records per day. The header holds the total
+    # number of records ever appended, the write slot is that count modulo capacity.
+    header = struct.Struct('<4sHHIQ')
+    header_size = 32
+    # Record layout of each version, the pumps mask went from 32 to 64 bits in version 2.
+    # Files of older versions are still read and appended to.
+    records = {1: struct.Struct('<diiI'), 2: struct.Struct('<diiQ')}
+    magic = b'PIPR'
+    version = 2
+    record = records[version]
+
+    def __init__(self, filename, capacity, writable=False):
+        self.filename = filename
+        size = self.header_size + capacity * self.record.size
+        if writable:
+            fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, self.header.pack(self.magic, self.version, self.record.size, capacity, 0), 0)
+                self._mm = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+        else:
+            with open(filename, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, record_size, self.capacity, self.count = self.header.unpack_from(self._mm, 0)
+        self.record = self.records.get(self.version)
+        if magic != self.magic or self.record is None or record_size != self.record.size:
+            self._mm.close()
+            raise ValueError(f'{filename} is not a pipump history file')
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, values):
+        self.record.pack_into(self._mm, self.header_size + (self.count % self.capacity) * self.record.size, *values)
+        self.count += 1
+        struct.pack_into('<Q', self._mm, 12, self.count)
+
+    def __slot(self, index):
+        # index is relative to the oldest record still in the ring
+        first = self.count - len(self)
+        return self.header_size + ((first + index) % self.capacity) * self.record.size
+
+    def timestamp(self, index):
+        return struct.unpack_from('<d', self._mm, self.__slot(index))[0]
+
+    def get(self, index):
+        return self.record.unpack_from(self._mm, self.__slot(index))
+
+    def read(self, start, stop):
+        # Raw bytes of the records from index start to stop, oldest first. Slicing the map
+        # copies them, nothing keeps it from being closed afterwards.
+        size = self.record.size
+        first = (self.count - len(self) + start) % self.capacity
+        count = stop - start
+        begin = self.header_size + first * size
+        if first + count <= self.capacity:
+            return self._mm[begin:begin + count * size]
+        wrapped = first + count - self.capacity
+        return self._mm[begin:self.header_size + self.capacity * size] + self._mm[self.header_size:self.header_size + wrapped * size]
+
+    def bisect(self, timestamp):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+
+class Recorder():
+    # Bits of the pumps mask of a record
+    max_pumps = 64
+
+    def __init__(self, directory, capacity=86400, keep_days=30):
+        self._directory = directory
+        self._capacity = capacity
+        self._keep_days = keep_days
+        self._pumps = []
+        self._device = None
+        self._day = None
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __filename(self, day):
+        return os.path.join(self._directory, f'{day.isoformat()}.rec')
+
+    def __expire(self, today):
+        oldest = (today - timedelta(days=self._keep_days)).isoformat()
+        for name in os.listdir(self._directory):
+            if name.endswith('.rec') and name[:-4] < oldest:
+                os.remove(os.path.join(self._directory, name))
+
+    def append(self, timestamp, production, consumption, pumps=0):
+        day = datetime.fromtimestamp(timestamp).date()
+        if day != self._day:
+            if self._file:
+                self._file.close()
+            self._file = DayFile(self.__filename(day), self._capacity, writable=True)
+            self._day = day
+            self.__expire(day)
+        self._file.append((timestamp, round(production), round(consumption), pumps))
+
+    def __pumps_mask(self):
+        mask = 0
+        for i, p in enumerate(self._pumps):
+            if p.is_running():
+                mask |= 1 << i
+        return mask
+
+    def __record(self, production, consumption):
+        # Called from the pumps and the PV source, a failure to record must not stop them
+        try:
+            self.append(time.time(), production, consumption, self.__pumps_mask())
+        except (OSError, ValueError, struct.error) as e:
+            logger.error('failed recording history: %s', e)
+
+    def on_readings(self, device, production, consumption):
+        self.__record(production, consumption)
+
+    def on_pump_state_changed(self, pump, state):
+        # Mark on/off transitions with the current averages
+        self.__record(self._device.production, self._device.consumption)
+
+    def attach(self, device, pumps):
+        # Pumps are mapped to bits of the record mask in configuration order
+        if len(pumps) > self.max_pumps:
+            raise ValueError(f'the history records at most {self.max_pumps} pumps, got {len(pumps)}')
+        self._device = device
+        self._pumps = pumps
+        device.add_reading_callback(self.on_readings)
+        for p in pumps:
+            p.add_state_callback(self.on_pump_state_changed)
+
+    def __iter_files(self, start, end):
+        day = datetime.fromtimestamp(start).date()
+        last = datetime.fromtimestamp(end).date()
+        while day <= last:
+            if day == self._day:
+                f = self._file
+            elif os.path.exists(self.__filename(day)):
+                f = DayFile(self.__filename(day), self._capacity)
+            else:
+                f = None
+            if f:
+                try:
+                    yield f
+                finally:
+                    if f is not self._file:
+                        f.close()
+            day += timedelta(days=1)
+
+    def iter_records(self, start, end):
+        for f in self.__iter_files(start, end):
+            for i in range(f.bisect(start), len(f)):
+                record = f.get(i)
+                if record[0] >= end:
+                    break
+                yield record
+
+    def iter_raw(self, start, end):
+        # (version, bytes) of the records between start and end for each day file, for
+        # readers decoding whole days at once, with numpy.frombuffer for instance
+        for f in self.__iter_files(start, end):
+            data = f.read(f.bisect(start), f.bisect(end))
+            if data:
+                yield f.version, data
+
+    def query(self, start, end):
+        columns = {
+            'timestamp': array('d'),
+            'production': array('i'),
+            'consumption': array('i'),
+            'pumps': array('Q'),
+        }
+        timestamp, production, consumption, pumps = columns.values()
+        for t, p, c, m in self.iter_records(start, end):
+            timestamp.append(t)
+            production.append(p)
+            consumption.append(c)
+            pumps.append(m)
+        return columns
+
+    def export_csv(self, start, end, out):
+        names = [p.name for p in self._pumps]
+        writer = csv.writer(out)
+        # Without attached pumps the raw mask is exported
+        writer.writerow(['time', 'production', 'consumption'] + (names or ['pumps']))
+        rows = 0
+        for t, p, c, m in self.iter_records(start, end):
+            states = [(m >> i) & 1 for i in range(len(names))] if names else [m]
+            writer.writerow([datetime.fromtimestamp(t).isoformat(timespec='seconds'), p, c] + states)
+            rows += 1
+        return rows
+
+    def close(self):
+        if self._file:
+            self._file.flush()
+            self._file.close()
+            self._file = None
+            self._day = None
+
+if __name__ == '__main__':
+    # Usage: recorder.py DIRECTORY FIRST_DAY [LAST_DAY] > history.csv
+    import sys
+    first = datetime.fromisoformat(sys.argv[2])
+    last = datetime.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else first
+    recorder = Recorder(sys.argv[1])
+    recorder.export_csv(first.timestamp(), (last + timedelta(days=1)).timestamp(), sys.stdout)
@@ -0,0 +1,59 @@
+import logging
+
+from config import Config
+from watcher import FileWatcher
+from logsetup import set_levels
+
+logger = logging.getLogger(__name__)
+
+class Reloader():
+    # Applies the changes of config.yaml to the running groups when the file is saved.
+    # The new file is parsed, validated and its pumps, scheduler and filters built without
+    # touching GPIOs first, an invalid file is logged and ignored and the current
+    # configuration stays in place.
+    def __init__(self, config, groups, interval=5):
+        self._config = config
+        self._groups = groups
+        self._interval = interval
+
+    def __load(self):
+        try:
+            config = Config(self._config.path)
+            configs = config.groups()
+            for c in configs:
+                c.check()
+            return config, configs
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error('ignoring new configuration: %s', e)
+            return None, None
+
+    def reload(self):
+        config, configs = self.__load()
+        if config is None:
+            return False
+        logger.info('applying new configuration from %s', config.path)
+
+        logging_options = config.section('logging')
+        previous = self._config.section('logging')
+        set_levels(logging_options.get('level', 'DEBUG'), logging_options.get('levels'), previous.get('levels'))
+        restart = [key for key in ('file', 'max_bytes', 'when', 'backup_count', 'compress') if logging_options.get(key) != previous.get(key)]
+        restart = [f'logging.{key}' for key in restart]
+        for key in ('metrics', 'http_workers'):
+            if config.get(key) != self._config.get(key):
+                restart.append(key)
+
+        groups = {g.name: g for g in self._groups}
+        if sorted(c.name or 'pipump' for c in configs) != sorted(groups):
+            restart.append('groups')
+        for c in configs:
+            group = groups.get(c.name or 'pipump')
+            if group:
+                restart.extend(f'{group.name}: {key}' for key in group.reconfigure(c))
+
+        if restart:
+            logger.warning('changes to %s need a restart to apply', ', '.join(restart))
+        self._config = config
+        return True
+
+    async def task(self):
+        await FileWatcher(self._config.path, self.reload, self._interval).task()
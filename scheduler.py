@@ -0,0 +1,75 @@
+import time
+import asyncio
+import logging
+
+from graph import PumpGraph
+
+logger = logging.getLogger(__name__)
+
+class Scheduler():
+    # Decides when the control loop should run again. It sleeps until the next pump
+    # reaches its daily runtime, polls faster when the surplus is close to a start or
+    # stop threshold and wakes up early when pushed readings cross one of them.
+    def __init__(self, min_interval=10, max_interval=120, margin=1000):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.margin = margin
+        self._low = float('-inf')
+        self._high = float('inf')
+        self._wakeup = asyncio.Event()
+        self._last_tick = 0
+
+    def __update_band(self, pumps, availability):
+        # Availability range within which no pump would be started or stopped
+        self._low = float('-inf')
+        self._high = float('inf')
+        eligible = PumpGraph.of(pumps).eligible()
+        for p in pumps:
+            if p.is_running():
+                self._low = 0
+            elif p in eligible and all(u.is_running() for u in p.upstreams):
+                self._high = min(self._high, p.power)
+
+    def next_delay(self, pumps, availability, now=None):
+        if now is None:
+            now = time.time()
+        self.__update_band(pumps, availability)
+        margin = min(availability - self._low, self._high - availability)
+        if margin == float('inf'):
+            # Nothing can change until the next day or a mode change
+            delay = self.max_interval
+        else:
+            ratio = min(max(margin, 0) / self.margin, 1)
+            delay = self.min_interval + (self.max_interval - self.min_interval) * ratio
+        for p in pumps:
+            if p.is_running():
+                remaining = p.desired_runtime - p.runtime - (now - p.on_since)
+                delay = min(delay, max(remaining, 1))
+        logger.debug('next control tick in %s seconds, surplus %sW, margin %sW', round(delay), availability, margin)
+        return delay
+
+    def on_readings(self, device, production, consumption):
+        availability = device.production - device.consumption
+        if availability < self._low or availability >= self._high:
+            self._wakeup.set()
+
+    async def wait(self, delay):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        earliest = self._last_tick + self.min_interval
+        self._wakeup.clear()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            self._wakeup.clear()
+            if loop.time() >= earliest:
+                logger.debug('new readings crossed a threshold, running control tick early')
+                break
+            # Too close to the previous tick, wait until min_interval elapsed
+            deadline = min(deadline, earliest)
+        self._last_tick = loop.time()
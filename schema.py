@@ -0,0 +1,277 @@
+from selector import compile_path
+
+# Structure of config.yaml, checked when the file is loaded or reloaded so that a typo is
+# reported with its location instead of failing somewhere in the middle of a reload.
+
+class ConfigError(ValueError):
+    pass
+
+class Value():
+    def __init__(self, types, required=False, check=None, choices=None):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.required = required
+        self.check = check
+        self.choices = choices
+
+    def validate(self, value, path, errors):
+        # bool is an int for Python, not for this configuration
+        if not isinstance(value, self.types) or (isinstance(value, bool) and bool not in self.types):
+            names = ' or '.join(t.__name__ for t in self.types)
+            errors.append(f'{path}: expected {names}, got {type(value).__name__}')
+        elif self.choices and value not in self.choices:
+            errors.append(f'{path}: expected one of {", ".join(map(str, self.choices))}, got {value}')
+        elif self.check and not self.check(value):
+            errors.append(f'{path}: invalid value {value}')
+
+class Mapping():
+    # check(value, path, errors) validates options depending on each other
+    def __init__(self, fields, required=False, check=None):
+        self.fields = fields
+        self.required = required
+        self.check = check
+
+    def validate(self, value, path, errors):
+        if value is None:
+            # A section with all its options commented out
+            value = {}
+        if not isinstance(value, dict):
+            errors.append(f'{path}: expected a mapping, got {type(value).__name__}')
+            return
+        for key, field in self.fields.items():
+            if key in value and value[key] is not None:
+                field.validate(value[key], f'{path}.{key}' if path else key, errors)
+            elif field.required:
+                errors.append(f'{path}.{key}: missing' if path else f'{key}: missing')
+        for key in value:
+            if key not in self.fields:
+                errors.append(f'{path}.{key}: unknown option' if path else f'{key}: unknown option')
+        if self.check:
+            self.check(value, path, errors)
+
+class Sequence():
+    def __init__(self, item, required=False):
+        self.item = item
+        self.required = required
+
+    def validate(self, value, path, errors):
+        if not isinstance(value, list):
+            errors.append(f'{path}: expected a list, got {type(value).__name__}')
+            return
+        for i, item in enumerate(value):
+            self.item.validate(item, f'{path}[{i}]', errors)
+
+class OneOf():
+    def __init__(self, *choices, required=False):
+        self.choices = choices
+        self.required = required
+
+    def validate(self, value, path, errors):
+        for choice in self.choices:
+            attempt = []
+            choice.validate(value, path, attempt)
+            if not attempt:
+                return
+        errors.append(f'{path}: unexpected value {value}')
+
+class Variant():
+    # Mapping whose options depend on the value of one of its keys
+    def __init__(self, key, variants, required=False):
+        self.key = key
+        self.variants = variants
+        self.required = required
+
+    def validate(self, value, path, errors):
+        kind = value.get(self.key) if isinstance(value, dict) else None
+        if kind not in self.variants:
+            errors.append(f'{path}.{self.key}: expected one of {", ".join(self.variants)}, got {kind}')
+            return
+        self.variants[kind].validate(value, path, errors)
+
+NUMBER = (int, float)
+positive = lambda v: v > 0
+not_negative = lambda v: v >= 0
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'debug', 'info', 'warning', 'error', 'critical']
+
+AVERAGING = ['sma', 'ewma', 'time']
+FALLBACKS = ['hold', 'shed_chained', 'stop_all']
+
+def window_fits_averaging(value, path, errors):
+    # Seconds for the time weighted average, a number of samples otherwise
+    averaging = value.get('averaging') or 'sma'
+    window = value.get('window')
+    if averaging != 'time' and isinstance(window, float):
+        errors.append(f'{path}.window: expected a number of samples with {averaging} averaging, got {window}')
+
+def meter_topics(value, path, errors):
+    if 'consumption' not in value and 'grid' not in value:
+        errors.append(f'{path}: a consumption or grid topic is needed')
+    window_fits_averaging(value, path, errors)
+
+def valid_path(path):
+    try:
+        compile_path(path)
+        return True
+    except ValueError:
+        return False
+
+TOPIC = Mapping({
+    'topic': Value(str, required=True),
+    'path': Value(str, check=valid_path),
+    'scale': Value(NUMBER),
+})
+
+PUMP = Mapping({
+    'name': Value(str, required=True),
+    'power': Value(NUMBER, required=True, check=positive),
+    'runtime': Value(NUMBER, required=True, check=not_negative),
+    'gpio': Value(int, required=True),
+    'priority': Value(NUMBER, check=positive),
+    'chained': OneOf(Value(str), Sequence(Value(str))),
+})
+
+SECTIONS = {
+    'mqtt': Mapping({
+        'uid': Value((str, int), required=True),
+        'host': Value(str),
+        'port': Value(int, check=positive),
+        'username': Value(str),
+        'password': Value(str),
+        'timeout': Value(NUMBER, check=positive),
+        'discovery': Value(bool),
+        'discovery_prefix': Value(str),
+        'coalesce_window': Value(NUMBER, check=not_negative),
+    }),
+    'pvsystem': Variant('type', {
+        'envoy': Mapping({
+            'type': Value(str, required=True),
+            'ip': Value(str, required=True),
+            'user': Value(str, required=True),
+            'password': Value(str, required=True),
+            'serial': Value((str, int), required=True),
+            'token_file': Value(str),
+            'stream': Value(bool),
+            'endpoint': Value(str, choices=['auto', 'production']),
+            'averaging': Value(str, choices=AVERAGING),
+            'window': Value(NUMBER, check=positive),
+            'stale': Value(NUMBER, check=positive),
+            'fallback': Value(str, choices=FALLBACKS),
+            'breaker': Mapping({
+                'threshold': Value(int, check=positive),
+                'min_delay': Value(NUMBER, check=positive),
+                'max_delay': Value(NUMBER, check=positive),
+            }),
+        }, check=window_fits_averaging),
+        'mqtt': Mapping({
+            'type': Value(str, required=True),
+            'host': Value(str),
+            'port': Value(int, check=positive),
+            'username': Value(str),
+            'password': Value(str),
+            'timeout': Value(NUMBER, check=positive),
+            'client_id': Value(str),
+            'production': Mapping(TOPIC.fields, required=True),
+            'consumption': TOPIC,
+            'grid': TOPIC,
+            'stale': Value(NUMBER, check=positive),
+            'fallback': Value(str, choices=FALLBACKS),
+            'averaging': Value(str, choices=AVERAGING),
+            'window': Value(NUMBER, check=positive),
+        }, check=meter_topics),
+    }),
+    'scheduler': Mapping({
+        'min_interval': Value(NUMBER, check=positive),
+        'max_interval': Value(NUMBER, check=positive),
+        'margin': Value(NUMBER, check=positive),
+    }),
+    'cycling': Mapping({
+        'deadband': Value(NUMBER, check=not_negative),
+        'min_run': Value(NUMBER, check=not_negative),
+        'min_rest': Value(NUMBER, check=not_negative),
+        'energy_debt': Value(NUMBER, check=not_negative),
+    }),
+    'state': Mapping({
+        'enabled': Value(bool),
+        'directory': Value(str),
+        'sync_interval': Value(NUMBER, check=not_negative),
+        'compact_every': Value(int, check=positive),
+    }),
+    'history': Mapping({
+        'directory': Value(str),
+        'capacity': Value(int, check=positive),
+        'keep_days': Value(int, check=positive),
+    }),
+    'planner': Mapping({
+        'days': Value(int, check=positive),
+        'deadline': Value(str),
+        'margin': Value(NUMBER, check=not_negative),
+    }),
+    'trace': Mapping({
+        'directory': Value(str),
+        'file': Value(str),
+        'sample': Value(NUMBER, check=lambda v: 0 <= v <= 1),
+        'profile': Value(str, choices=['cprofile', 'tracemalloc']),
+        'profile_ticks': Value(int, check=positive),
+        'report': Value(str),
+    }),
+    'pumps': Sequence(PUMP, required=True),
+}
+
+# Sections of the whole process, groups cannot override them
+GLOBAL_SECTIONS = {
+    'logging': Mapping({
+        'file': Value(str),
+        'level': Value(str, choices=LEVELS),
+        'levels': Value(dict, check=lambda v: all(level in LEVELS for level in v.values())),
+        'max_bytes': Value(int, check=positive),
+        'when': Value(str),
+        'backup_count': Value(int, check=not_negative),
+        'compress': Value(bool),
+    }),
+    'metrics': Mapping({
+        'host': Value(str),
+        'port': Value(int, check=not_negative),
+        'loop_interval': Value(NUMBER, check=positive),
+    }),
+    'reload': Value(bool),
+    'http_workers': Value(int, check=positive),
+}
+
+SITE = Mapping({**SECTIONS, **GLOBAL_SECTIONS})
+GROUP = Mapping({'name': Value(str, required=True), **SECTIONS})
+
+def merge(shared, group):
+    # Sections a group does not define are inherited from the top level, mappings are
+    # merged key by key so that groups can share the MQTT broker and only set their uid
+    merged = {k: v for k, v in shared.items() if k in SECTIONS}
+    for section, value in group.items():
+        if isinstance(value, dict) and isinstance(merged.get(section), dict):
+            merged[section] = {**merged[section], **value}
+        else:
+            merged[section] = value
+    return merged
+
+def validate(config):
+    if not isinstance(config, dict):
+        raise ConfigError('invalid configuration, expected a mapping')
+    errors = []
+    groups = config.get('groups')
+    if groups is None:
+        SITE.validate(config, '', errors)
+    elif not isinstance(groups, list):
+        errors.append(f'groups: expected a list, got {type(groups).__name__}')
+    else:
+        # Sections are checked as each group sees them once merged with the top level, so
+        # mistakes in inherited sections are reported for every group inheriting them
+        for key in config:
+            if key not in SECTIONS and key not in GLOBAL_SECTIONS and key != 'groups':
+                errors.append(f'{key}: unknown option')
+        for key, field in GLOBAL_SECTIONS.items():
+            if config.get(key) is not None:
+                field.validate(config[key], key, errors)
+        for i, group in enumerate(groups):
+            if not isinstance(group, dict):
+                errors.append(f'groups[{i}]: expected a mapping, got {type(group).__name__}')
+                continue
+            GROUP.validate(merge(config, group), f'groups[{i}]', errors)
+    if errors:
+        raise ConfigError('invalid configuration, ' + '; '.join(errors))
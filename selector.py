@@ -0,0 +1,44 @@
+import re
+import json
+
+# JSONPath-like selectors: $ is the payload, followed by .name, ['name'] or [index] steps
+STEP = re.compile(r'''\.([^.\[\]]+)|\[(-?\d+)\]|\[(['"])(.*?)\3\]''')
+
+def compile_path(path):
+    if not path or path == '$':
+        return []
+    if not path.startswith('$'):
+        path = '$.' + path
+    steps = []
+    position = 1
+    while position < len(path):
+        match = STEP.match(path, position)
+        if not match:
+            raise ValueError(f'invalid selector {path} at position {position}')
+        name, index, quote, quoted = match.groups()
+        steps.append(int(index) if index is not None else name if name is not None else quoted)
+        position = match.end()
+    return steps
+
+def select(steps, document):
+    for step in steps:
+        document = document[step]
+    return document
+
+class Selector():
+    # Extracts a power value in watts from the payloads of one topic
+    def __init__(self, options):
+        self.topic = options['topic']
+        self.path = options.get('path', '$')
+        self.scale = options.get('scale', 1)
+        self._steps = compile_path(self.path)
+
+    def value(self, payload):
+        if self._steps:
+            value = select(self._steps, json.loads(payload))
+        else:
+            # Plain numbers, or JSON documents holding just a number
+            value = json.loads(payload)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{value!r} is not a number')
+        return value * self.scale
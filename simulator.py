@@ -0,0 +1,155 @@
+import math
+import random
+import asyncio
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from clock import VirtualClock
+from pvsystem import PVSystem
+from allocator import Allocator
+from scheduler import Scheduler
+from controller import Controller
+from cycling import CycleGuard
+
+class TraceSource(PVSystem):
+    # Replays recorded or synthetic production and household consumption, the power of
+    # the simulated pumps currently running is added to the consumption.
+    def __init__(self, trace, pumps, clock, averaging='sma', window=5):
+        self._timestamps, self._production, self._consumption = trace
+        self._pumps = pumps
+        PVSystem.__init__(self, averaging, window, clock)
+
+    def sample(self, now):
+        i = max(bisect_right(self._timestamps, now) - 1, 0)
+        return self._production[i], self._consumption[i]
+
+    async def update(self):
+        production, consumption = self.sample(self._clock.time())
+        consumption += sum(p.power for p in self._pumps if p.is_running())
+        self.production = production
+        self.consumption = consumption
+        return self.production - self.consumption
+
+def synthetic_day(day, peak=4000, clouds=0.0, base=300, step=60, seed=None):
+    # Bell shaped production between 7:00 and 20:00, clouds randomly cut it down
+    rng = random.Random(seed)
+    start = datetime.combine(day, datetime.min.time()).timestamp()
+    timestamps, production, consumption = [], [], []
+    shade = 1.0
+    for t in range(0, 24 * 3600, step):
+        hour = t / 3600
+        if rng.random() < clouds * step / 600:
+            shade = rng.uniform(0.1, 1.0)
+        sun = math.sin(math.pi * (hour - 7) / 13) if 7 <= hour < 20 else 0
+        timestamps.append(start + t)
+        production.append(round(peak * sun * shade))
+        consumption.append(round(base * rng.uniform(0.8, 1.5)))
+    return timestamps, production, consumption
+
+def recorded_day(recorder, day):
+    start = datetime.combine(day, datetime.min.time()).timestamp()
+    columns = recorder.query(start, start + 24 * 3600)
+    return list(columns['timestamp']), list(columns['production']), list(columns['consumption'])
+
+def default_controller(pumps, device, clock):
+    return Controller(pumps, device, Allocator(), Scheduler(), clock=clock)
+
+class Simulator():
+    # Runs the control loop over whole days of traces on a virtual clock. make_pumps(clock)
+    # returns fresh pumps, make_controller(pumps, device, clock) builds the policy to test.
+    def __init__(self, make_pumps, make_controller=default_controller):
+        self._make_pumps = make_pumps
+        self._make_controller = make_controller
+
+    async def __run_day(self, trace, results):
+        timestamps, production, consumption = trace
+        clock = VirtualClock(timestamps[0])
+        pumps = self._make_pumps(clock)
+        device = TraceSource(trace, pumps, clock)
+        controller = self._make_controller(pumps, device, clock)
+        actuations = {'count': 0}
+        def on_state_changed(pump, state):
+            actuations['count'] += 1
+        for p in pumps:
+            p.add_state_callback(on_state_changed)
+
+        end = timestamps[0] + 24 * 3600 - 1
+        grid_import = 0
+        pumps_energy = 0
+        while clock.time() < end:
+            now = clock.time()
+            delay = await controller.tick()
+            # Integrate energy over the trace samples until the next tick
+            load = sum(p.power for p in pumps if p.is_running())
+            until = min(now + delay, end)
+            i = max(bisect_right(timestamps, now) - 1, 0)
+            t = now
+            while t < until:
+                next_t = min(timestamps[i + 1] if i + 1 < len(timestamps) else until, until)
+                grid_import += max(consumption[i] + load - production[i], 0) * (next_t - t)
+                pumps_energy += load * (next_t - t)
+                t = next_t
+                i += 1
+            clock.set(until)
+        for p in pumps:
+            p.turn_off()
+
+        results['days'] += 1
+        results['grid_import'] += grid_import / 3600000
+        results['pumps_energy'] += pumps_energy / 3600000
+        results['actuations'] += actuations['count']
+        for p in pumps:
+            met = results['goals'].setdefault(p.name, 0)
+            results['goals'][p.name] = met + (1 if p.runtime >= p.desired_runtime else 0)
+
+    def run(self, traces):
+        results = {'days': 0, 'grid_import': 0, 'pumps_energy': 0, 'actuations': 0, 'goals': {}}
+        async def run_all():
+            for trace in traces:
+                await self.__run_day(trace, results)
+        asyncio.run(run_all())
+        days = results['days'] or 1
+        results['goal_attainment'] = {name: met / days for name, met in results['goals'].items()}
+        results['actuations_per_day'] = results['actuations'] / days
+        return results
+
+def report(name, results):
+    goals = ', '.join(f'{n} {round(v * 100)}%' for n, v in results['goal_attainment'].items())
+    return f'{name}: {results["days"]} days, goals met {goals}, grid import {results["grid_import"]:.1f}kWh, pumps {results["pumps_energy"]:.1f}kWh, {results["actuations_per_day"]:.1f} relay actuations per day'
+
+if __name__ == '__main__':
+    # Usage: simulator.py [DAYS] [CLOUDS] [HISTORY_DIRECTORY]
+    # Replays synthetic days, or the last recorded days when a history directory is given,
+    # with the configured pumps under a few control policies.
+    import sys
+    import time
+    from config import Config
+    from recorder import Recorder
+
+    logging.disable(logging.CRITICAL)
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    clouds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    if len(sys.argv) > 3:
+        recorder = Recorder(sys.argv[3])
+        today = datetime.today().date()
+        traces = [recorded_day(recorder, today - timedelta(days=d)) for d in range(days, 0, -1)]
+        traces = [t for t in traces if t[0]]
+    else:
+        first = datetime(2020, 6, 1).date()
+        traces = [synthetic_day(first + timedelta(days=d), clouds=clouds, seed=d) for d in range(days)]
+    config = Config('config.yaml')
+    # The cycling section of the configuration, or a moderate one when there is none
+    guard = lambda clock: config.load_guard(clock) or CycleGuard(deadband=200, min_run=600, min_rest=300, energy_debt=100, clock=clock)
+    policies = {
+        'adaptive ticks': default_controller,
+        'adaptive ticks, cycle guard': lambda pumps, device, clock: Controller(pumps, device, Allocator(), Scheduler(), clock=clock, guard=guard(clock)),
+        'fixed 60s ticks': lambda pumps, device, clock: Controller(pumps, device, Allocator(), Scheduler(60, 60), clock=clock),
+        'fixed 60s ticks, cycle guard': lambda pumps, device, clock: Controller(pumps, device, Allocator(), Scheduler(60, 60), clock=clock, guard=guard(clock)),
+    }
+    for name, make_controller in policies.items():
+        start = time.perf_counter()
+        # Simulated pumps never touch the relays
+        results = Simulator(lambda clock: config.load_pumps(clock, gpio=False), make_controller).run(traces)
+        print(report(name, results))
+        print(f'  simulated {len(traces)} days in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StateStore():
+    # Pump counters survive restarts through a snapshot file and an append-only journal.
+    # Journal lines are buffered and only fsynced every sync_interval seconds to spare
+    # the SD card, the journal is folded into the snapshot every compact_every entries.
+    def __init__(self, directory, sync_interval=60, compact_every=1000):
+        os.makedirs(directory, exist_ok=True)
+        self._snapshot_file = os.path.join(directory, 'state.json')
+        self._journal_file = os.path.join(directory, 'state.journal')
+        self._sync_interval = sync_interval
+        self._compact_every = compact_every
+        self._journal = None
+        self._entries = 0
+        self._last_sync = 0
+        self.state = {}
+
+    def load(self):
+        self.state = {}
+        try:
+            with open(self._snapshot_file, 'r') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning('ignoring corrupted state snapshot %s', self._snapshot_file)
+        replayed = 0
+        try:
+            with open(self._journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.state[entry.pop('pump')] = entry
+                        replayed += 1
+                    except (ValueError, KeyError):
+                        # Torn write from a crash, everything before it is still valid
+                        logger.warning('ignoring truncated entry in state journal %s', self._journal_file)
+                        break
+        except FileNotFoundError:
+            pass
+        logger.debug('loaded state of %s pumps, replayed %s journal entries', len(self.state), replayed)
+        return self.state
+
+    def record(self, name, state, now=None, sync=False):
+        if now is None:
+            now = time.time()
+        state = dict(state, seen=now)
+        self.state[name] = state
+        if self._journal is None:
+            self._journal = open(self._journal_file, 'a')
+        self._journal.write(json.dumps(dict(state, pump=name), separators=(',', ':')) + '\n')
+        self._entries += 1
+        if self._entries >= self._compact_every:
+            self.compact()
+        elif sync or now - self._last_sync >= self._sync_interval:
+            self.sync(now)
+
+    def sync(self, now=None):
+        if self._journal is None:
+            return
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._last_sync = now if now is not None else time.time()
+
+    def compact(self):
+        tmp = self._snapshot_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._snapshot_file)
+        # The snapshot now holds everything, start a new journal
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self._journal_file, 'w')
+        self._entries = 0
+
+    def close(self):
+        if self._journal is not None:
+            self.sync()
+            self._journal.close()
+            self._journal = None
+
+    def __on_pump_state_changed(self, pump, state):
+        # Pumps start and stop a few times a day, make those durable right away
+        self.record(pump.name, pump.get_state(), sync=True)
+
+    def __on_pump_updated(self, pump, progress):
+        self.record(pump.name, pump.get_state())
+
+    def attach(self, pumps):
+        self.load()
+        for p in pumps:
+            state = self.state.get(p.name)
+            if state:
+                p.restore_state(state)
+        # Fold the replayed journal so that startup cost stays constant
+        self.compact()
+        for p in pumps:
+            p.add_state_callback(self.__on_pump_state_changed)
+            p.add_update_callback(self.__on_pump_updated)
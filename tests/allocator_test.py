@@ -0,0 +1,141 @@
+import unittest
+import time
+import random
+import itertools
+
+from pump import Pump
+from allocator import solve, solve_tree, solve_dag, Allocator
+
+def brute_force(powers, values, parents, budget):
+    best = 0
+    for r in range(len(powers) + 1):
+        for subset in itertools.combinations(range(len(powers)), r):
+            chosen = set(subset)
+            if sum(powers[i] for i in chosen) > budget:
+                continue
+            if any(p not in chosen for i in chosen for p in parents[i]):
+                continue
+            best = max(best, sum(values[i] for i in chosen))
+    return best
+
+class TestSolve(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(solve([], [], [], 1000), [])
+
+    def test_fills_budget_better_than_greedy(self):
+        # Greedy by order would take the 600W load and leave 400W unused
+        self.assertEqual(sorted(solve([600, 500, 500], [600, 500, 500], [[], [], []], 1000)), [1, 2])
+
+    def test_precedence(self):
+        # The 300W load is only worth running with its 900W upstream
+        self.assertEqual(solve([900, 300], [900, 3000], [[], [0]], 1000), [0])
+        self.assertEqual(sorted(solve([900, 100], [900, 3000], [[], [0]], 1000)), [0, 1])
+        self.assertEqual(solve([1100, 100], [900, 3000], [[], [0]], 1000), [])
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError):
+            solve_tree([100, 100], [1, 1], [[1], [0]], 1000)
+        with self.assertRaises(ValueError):
+            solve_dag([100, 100], [1, 1], [[1], [0]], 1000)
+
+    def check_against_brute_force(self, solver, max_parents):
+        rng = random.Random(42)
+        for n in range(1, 11):
+            powers = [rng.randint(1, 40) * 50 for i in range(n)]
+            values = [rng.randint(1, 5000) for i in range(n)]
+            parents = [rng.sample(range(i), min(i, rng.randint(0, max_parents))) if rng.random() < 0.4 else [] for i in range(n)]
+            budget = rng.randint(0, sum(powers))
+            selected = solver(powers, values, parents, budget)
+            self.assertLessEqual(sum(powers[i] for i in selected), budget)
+            self.assertTrue(all(p in selected for i in selected for p in parents[i]))
+            self.assertEqual(sum(values[i] for i in selected), brute_force(powers, values, parents, budget))
+
+    def test_tree_matches_brute_force(self):
+        self.check_against_brute_force(solve_tree, 1)
+
+    def test_dag_matches_brute_force(self):
+        self.check_against_brute_force(solve_dag, 3)
+        self.check_against_brute_force(solve_dag, 1)
+
+    def test_dag_search_is_capped(self):
+        rng = random.Random(1)
+        n = 64
+        powers = [rng.randint(100, 3000) for i in range(n)]
+        values = [p * rng.uniform(1, 2) * rng.choice([1, 1, 2]) for p in powers]
+        parents = [rng.sample(range(i), min(i, rng.randint(0, 2))) for i in range(n)]
+        budget = sum(powers) / 2
+        start = time.perf_counter()
+        selected = solve_dag(powers, values, parents, budget, max_nodes=500)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertLessEqual(sum(powers[i] for i in selected), budget)
+        self.assertTrue(all(p in selected for i in selected for p in parents[i]))
+        # Never worse than the selection of the first parents tree, once repaired
+        tree = set(solve_tree(powers, values, [p[:1] for p in parents], budget))
+        repaired = set()
+        for i in range(n):
+            if i in tree and all(p in repaired for p in parents[i]):
+                repaired.add(i)
+        self.assertGreaterEqual(sum(values[i] for i in selected), sum(values[i] for i in repaired))
+
+    def test_negative_budget(self):
+        self.assertEqual(solve([100], [100], [[]], -10), [])
+
+class TestAllocator(unittest.TestCase):
+    def test_starts_what_fits(self):
+        main = Pump('main', 1650, 3 * 3600)
+        aux = Pump('aux', 1100, 1800)
+        aux.chain(main)
+        allocator = Allocator()
+        self.assertEqual(allocator.allocate([main, aux], 1000), ([], 1000))
+        self.assertEqual(allocator.allocate([main, aux], 2000), ([main], 350))
+        self.assertEqual(allocator.allocate([main, aux], 3000), ([main, aux], 250))
+
+    def test_running_pumps_count_in_budget(self):
+        main = Pump('main', 1650, 3 * 3600)
+        aux = Pump('aux', 1100, 1800)
+        aux.chain(main)
+        main.turn_on()
+        aux.turn_on()
+        allocator = Allocator()
+        # Surplus turned negative, the chained pump is shed first
+        self.assertEqual(allocator.allocate([main, aux], -500), ([main], 600))
+        self.assertEqual(allocator.allocate([main, aux], -2000), ([], 750))
+
+    def test_skips_pumps_done_for_the_day(self):
+        main = Pump('main', 1650, 3 * 3600)
+        other = Pump('other', 500, 3600)
+        main.runtime = 3 * 3600
+        self.assertEqual(Allocator().allocate([main, other], 2000), ([other], 1500))
+
+    def test_priority(self):
+        a = Pump('a', 1000, 3600)
+        b = Pump('b', 1000, 3600, priority=2)
+        self.assertEqual(Allocator().allocate([a, b], 1500)[0], [b])
+
+    def test_urgency(self):
+        a = Pump('a', 1000, 3600)
+        b = Pump('b', 1000, 3600)
+        a.runtime = 3000
+        self.assertEqual(Allocator().allocate([a, b], 1500)[0], [b])
+
+    def test_forced_pumps_run_on_grid(self):
+        main = Pump('main', 1650, 3 * 3600)
+        aux = Pump('aux', 1100, 1800)
+        aux.chain(main)
+        other = Pump('other', 500, 3600)
+        # The chained pump brings its upstream pump along, nothing else fits
+        self.assertEqual(Allocator().allocate([main, aux, other], 600, forced=[aux]), ([main, aux], -2150))
+        self.assertEqual(Allocator().allocate([main, aux, other], 3500, forced=[aux]), ([main, aux, other], 250))
+
+    def test_pump_with_several_upstreams(self):
+        main = Pump('main', 1650, 3 * 3600)
+        filter = Pump('filter', 300, 3600)
+        heater = Pump('heater', 1000, 3600, priority=5)
+        heater.chain(main)
+        heater.chain(filter)
+        allocator = Allocator()
+        self.assertEqual(allocator.allocate([main, filter, heater], 2900), ([main, filter], 950))
+        self.assertEqual(allocator.allocate([main, filter, heater], 3000), ([main, filter, heater], 50))
+        self.assertEqual(allocator.allocate([main, filter, heater], 0, forced=[heater]), ([main, filter, heater], -2950))
+        filter.runtime = 3600
+        self.assertEqual(allocator.allocate([main, filter, heater], 3000), ([main], 1350))
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1672574400)
+        self.breaker = CircuitBreaker('test', threshold=3, min_delay=10, max_delay=25, clock=self.clock)
+        self.states = Mock()
+        self.breaker.add_state_callback(self.states)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        with self.assertLogs('breaker', level='WARNING'):
+            self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.states.assert_called_once_with(self.breaker, OPEN)
+
+    def test_probes_with_growing_delay(self):
+        for i in range(3):
+            self.breaker.failure()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.breaker.failure()
+        self.clock.advance(19)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(1)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        # Capped at max_delay
+        self.clock.advance(25)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual([c.args[1] for c in self.states.call_args_list], [OPEN, HALF_OPEN, OPEN, HALF_OPEN, OPEN, HALF_OPEN, CLOSED])
@@ -0,0 +1,74 @@
+# In-process MQTT broker shared by the tests and the benchmarks
+import struct
+import asyncio
+
+class BrokerStub():
+    # Just enough of an MQTT 3.1.1 broker to accept one client, acknowledge its
+    # CONNECT and SUBSCRIBE packets, record its PUBLISH packets and push messages
+    def __init__(self):
+        self.published = []
+        self.subscribed = []
+        self.received = asyncio.Event()
+        self._writer = None
+        self._handler = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._writer:
+            self._writer.close()
+        if self._handler:
+            await self._handler
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def encode(packet_type, body):
+        length = len(body)
+        header = bytearray([packet_type])
+        while True:
+            byte = length % 128
+            length //= 128
+            header.append(byte | 0x80 if length else byte)
+            if not length:
+                break
+        return bytes(header) + body
+
+    def publish(self, topic, payload):
+        topic = topic.encode()
+        self._writer.write(self.encode(0x30, struct.pack('!H', len(topic)) + topic + payload.encode()))
+
+    async def handle(self, reader, writer):
+        self._writer = writer
+        self._handler = asyncio.current_task()
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type = header[0] & 0xf0
+                if packet_type == 0x10:
+                    writer.write(b'\x20\x02\x00\x00')
+                elif packet_type == 0x80:
+                    topic_length = struct.unpack('!H', body[2:4])[0]
+                    self.subscribed.append(body[4:4 + topic_length].decode())
+                    writer.write(b'\x90\x03' + body[:2] + b'\x00')
+                elif packet_type == 0x30:
+                    topic_length = struct.unpack('!H', body[:2])[0]
+                    offset = 2 + topic_length + (2 if header[0] & 0x06 else 0)
+                    self.published.append((body[2:2 + topic_length].decode(), body[offset:].decode()))
+                    self.received.set()
+                elif packet_type == 0xc0:
+                    writer.write(b'\xd0\x00')
+                elif packet_type == 0xe0:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
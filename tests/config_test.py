@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config as config_module
+from config import Config
+from schema import ConfigError
+
+class TestConfigGroups(unittest.TestCase):
+    def test_single_site(self):
+        config = Config('config.yaml', config={'pumps': []})
+        self.assertEqual(config.groups(), [config])
+        self.assertIsNone(config.name)
+
+    def test_groups_inherit_top_level_sections(self):
+        config = Config('config.yaml', config={
+            'mqtt': {'host': 'broker', 'uid': 'a'},
+            'scheduler': {'min_interval': 5},
+            'pumps': [{'name': 'Main', 'power': 1000, 'runtime': 1, 'gpio': 8}],
+            'groups': [
+                {'name': 'pool', 'mqtt': {'uid': 'b'}},
+                {'name': 'spa', 'mqtt': {'uid': 'c'}, 'pumps': [{'name': 'Jets', 'power': 500, 'runtime': 1, 'gpio': 10}]},
+            ],
+        })
+        pool, spa = config.groups()
+        self.assertEqual(pool.name, 'pool')
+        self.assertEqual(pool._config['mqtt'], {'host': 'broker', 'uid': 'b'})
+        self.assertEqual(spa._config['mqtt'], {'host': 'broker', 'uid': 'c'})
+        self.assertEqual(spa.load_scheduler().min_interval, 5)
+        self.assertEqual([p.name for p in pool.load_pumps(gpio=False)], ['Main'])
+        self.assertEqual([p.name for p in spa.load_pumps(gpio=False)], ['Jets'])
+
+    def test_mqtt_meter_shares_broker(self):
+        config = Config('config.yaml', config={'mqtt': {'uid': 'a', 'host': 'broker', 'port': 1884},
+                                               'pvsystem': {'type': 'mqtt', 'port': 1885, 'production': {'topic': 'solar'}, 'consumption': {'topic': 'house'}}})
+        meter = config.load_pvsystem()
+        self.assertEqual((meter._host, meter._port), ('broker', 1885))
+
+    def test_groups_need_unique_names_and_uids(self):
+        with self.assertRaises(ValueError):
+            Config('config.yaml', config={'groups': [{'name': 'pool'}, {'name': 'pool'}]}).groups()
+        with self.assertRaises(ValueError):
+            Config('config.yaml', config={'mqtt': {'uid': 'a'}, 'groups': [{'name': 'pool'}, {'name': 'spa'}]}).groups()
+
+    def test_groups_need_their_own_pumps(self):
+        main = {'name': 'Main', 'power': 1000, 'runtime': 1, 'gpio': 8}
+        jets = {'name': 'Jets', 'power': 500, 'runtime': 1, 'gpio': 10}
+        with self.assertRaisesRegex(ValueError, 'pump Main'):
+            # Both groups inherit the top level pumps
+            Config('config.yaml', config={'pumps': [main], 'groups': [{'name': 'pool'}, {'name': 'spa'}]}).groups()
+        with self.assertRaisesRegex(ValueError, 'GPIO 8'):
+            Config('config.yaml', config={'pumps': [main], 'groups': [{'name': 'pool'}, {'name': 'spa', 'pumps': [{**jets, 'gpio': 8}]}]}).groups()
+        with self.assertRaisesRegex(ValueError, 'pump Main'):
+            Config('config.yaml', config={'pumps': [main], 'groups': [{'name': 'pool'}, {'name': 'spa', 'pumps': [{**main, 'gpio': 10}]}]}).groups()
+        pool, spa = Config('config.yaml', config={'pumps': [main], 'groups': [{'name': 'pool'}, {'name': 'spa', 'pumps': [jets]}]}).groups()
+
+class TestConfigSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'config.yaml')
+        self.write('pumps:\n  - {name: Main, power: 1650, runtime: 3, gpio: 8}\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content):
+        with open(self.filename, 'w') as f:
+            f.write(content)
+
+    def test_snapshot_skips_parsing(self):
+        self.assertEqual(Config(self.filename).pump_specs()[0]['power'], 1650)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, '.config.yaml.cache')))
+        with patch('config.parse') as parse:
+            self.assertEqual(Config(self.filename).pump_specs()[0]['power'], 1650)
+            parse.assert_not_called()
+
+    def test_snapshot_follows_changes(self):
+        Config(self.filename)
+        self.write('pumps:\n  - {name: Main, power: 990, runtime: 3, gpio: 8}\n')
+        self.assertEqual(Config(self.filename).pump_specs()[0]['power'], 990)
+        self.write('pumps:\n  - {name: Main, power: 990, runtime: 3}\n')
+        with self.assertRaises(ConfigError):
+            Config(self.filename)
+
+    def test_corrupt_snapshot_is_ignored(self):
+        with open(os.path.join(self.directory.name, '.config.yaml.cache'), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(Config(self.filename).pump_specs()[0]['name'], 'Main')
+
+    def test_invalid_yaml(self):
+        self.write('pumps: [\n')
+        with self.assertRaises(ConfigError):
+            config_module.load(self.filename)
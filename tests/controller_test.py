@@ -0,0 +1,125 @@
+import unittest
+import asyncio
+
+from pump import Pump
+from clock import VirtualClock
+from pvsystem import PVSystem
+from allocator import Allocator
+from scheduler import Scheduler
+from controller import Controller
+from cycling import CycleGuard
+
+class FixedSource(PVSystem):
+    def __init__(self, availability):
+        PVSystem.__init__(self)
+        self.availability = availability
+        self.stale = False
+
+    def is_stale(self):
+        return self.stale
+
+    async def update(self):
+        return self.availability
+
+class TestController(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1579309325)
+        self.main = Pump('main', 1650, 3 * 3600, clock=self.clock)
+        self.aux = Pump('aux', 1100, 1800, clock=self.clock)
+        self.aux.chain(self.main)
+        self.states = []
+        for p in [self.main, self.aux]:
+            p.add_state_callback(lambda pump, state: self.states.append((pump.name, state)))
+        self.device = FixedSource(0)
+        self.controller = Controller([self.main, self.aux], self.device, Allocator(), Scheduler(), clock=self.clock)
+
+    def test_starts_upstream_first(self):
+        self.device.availability = 3000
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('main', 'ON'), ('aux', 'ON')])
+
+    def test_stops_chained_first(self):
+        self.main.turn_on()
+        self.aux.turn_on()
+        self.states.clear()
+        self.device.availability = -3000
+        # One pump at a time, polling again soon while shedding
+        delay = asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('aux', 'OFF')])
+        self.assertEqual(delay, self.controller.scheduler.min_interval)
+        self.device.availability = -1900
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('aux', 'OFF'), ('main', 'OFF')])
+
+    def test_guard_holds_pumps_around_threshold(self):
+        self.controller.guard = CycleGuard(deadband=200, min_run=600, clock=self.clock)
+        self.device.availability = 1700
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [])
+        self.device.availability = 1900
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('main', 'ON')])
+        # The surplus drops below zero right after the start
+        self.device.availability = -500
+        self.clock.advance(60)
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('main', 'ON')])
+        self.clock.advance(600)
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('main', 'ON'), ('main', 'OFF')])
+
+    def test_falls_back_on_stale_readings(self):
+        self.main.turn_on()
+        self.aux.turn_on()
+        self.states.clear()
+        self.device.availability = 5000
+        self.device.stale = True
+        with self.assertLogs('controller', level='WARNING'):
+            delay = asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('aux', 'OFF')])
+        self.assertEqual(delay, self.controller.scheduler.min_interval)
+        # Nothing started on stale readings, whatever they say
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('aux', 'OFF')])
+        self.device.stale = False
+        asyncio.run(self.controller.tick())
+        self.assertEqual(self.states, [('aux', 'OFF'), ('aux', 'ON')])
+
+    def test_fallback_policies(self):
+        self.device.stale = True
+        for fallback, running in (('hold', [True, True]), ('stop_all', [False, False])):
+            self.main.turn_on()
+            self.aux.turn_on()
+            controller = Controller([self.main, self.aux], self.device, Allocator(), Scheduler(), clock=self.clock, fallback=fallback)
+            with self.assertLogs('controller', level='WARNING'):
+                asyncio.run(controller.tick())
+            self.assertEqual([p.is_running() for p in (self.main, self.aux)], running)
+        with self.assertRaises(ValueError):
+            Controller([self.main], self.device, Allocator(), Scheduler(), fallback='panic')
+
+    def test_starts_graph_in_order(self):
+        filter = Pump('filter', 500, 3600, clock=self.clock)
+        heater = Pump('heater', 1000, 3600, clock=self.clock)
+        heater.chain(filter)
+        heater.chain(self.aux)
+        states = []
+        for p in [filter, heater, self.main, self.aux]:
+            p.add_state_callback(lambda pump, state: states.append(pump.name))
+        controller = Controller([heater, self.aux, filter, self.main], self.device, Allocator(), Scheduler(), clock=self.clock)
+        self.device.availability = 5000
+        asyncio.run(controller.tick())
+        self.assertEqual(states, ['filter', 'main', 'aux', 'heater'])
+
+    def test_returns_next_delay(self):
+        self.device.availability = 2000
+        delay = asyncio.run(self.controller.tick())
+        self.assertTrue(self.main.is_running())
+        self.assertGreater(delay, 0)
+
+    def test_stops_pump_at_desired_runtime(self):
+        self.device.availability = 2000
+        asyncio.run(self.controller.tick())
+        self.clock.advance(3 * 3600)
+        asyncio.run(self.controller.tick())
+        self.assertFalse(self.main.is_running())
+        self.assertEqual(self.main.runtime, 3 * 3600)
@@ -0,0 +1,68 @@
+import unittest
+
+from pump import Pump
+from graph import PumpGraph
+from clock import VirtualClock
+from cycling import CycleGuard
+
+class TestCycleGuard(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1579309325)
+        self.main = Pump('main', 1650, 3 * 3600, clock=self.clock)
+        self.aux = Pump('aux', 1100, 1800, clock=self.clock)
+        self.aux.chain(self.main)
+        self.graph = PumpGraph([self.main, self.aux])
+
+    def test_starts_beyond_deadband(self):
+        guard = CycleGuard(deadband=200, clock=self.clock)
+        self.assertEqual(guard.filter(self.graph, [self.main], 1700), ([], 1700))
+        self.assertEqual(guard.filter(self.graph, [self.main], 1900), ([self.main], 250))
+        # Chained pumps only start along with the pumps they depend on
+        self.assertEqual(guard.filter(self.graph, [self.main, self.aux], 2900), ([self.main], 1250))
+
+    def test_holds_through_deficit_within_deadband(self):
+        guard = CycleGuard(deadband=200, clock=self.clock)
+        self.main.turn_on()
+        self.aux.turn_on()
+        self.assertEqual(guard.filter(self.graph, [self.main], -150), ([self.main, self.aux], -150))
+        self.assertEqual(guard.filter(self.graph, [self.main], -250), ([self.main], 850))
+
+    def test_no_deadband_follows_allocator(self):
+        guard = CycleGuard(clock=self.clock)
+        self.main.turn_on()
+        self.assertEqual(guard.filter(self.graph, [], 0), ([], 1650))
+        self.assertEqual(guard.filter(self.graph, [self.main, self.aux], 1100), ([self.main, self.aux], 0))
+
+    def test_min_run_and_rest(self):
+        guard = CycleGuard(min_run=600, min_rest=300, clock=self.clock)
+        self.main.turn_on()
+        self.clock.advance(500)
+        self.assertEqual(guard.filter(self.graph, [], -1000), ([self.main], -1000))
+        self.clock.advance(100)
+        self.assertEqual(guard.filter(self.graph, [], -1000), ([], 650))
+        self.main.turn_off()
+        self.clock.advance(200)
+        self.assertEqual(guard.filter(self.graph, [self.main], 2000), ([], 2000))
+        self.clock.advance(100)
+        self.assertEqual(guard.filter(self.graph, [self.main], 2000), ([self.main], 350))
+
+    def test_forced_pumps_start_regardless(self):
+        guard = CycleGuard(deadband=200, min_rest=300, clock=self.clock)
+        self.main.turn_on()
+        self.main.turn_off()
+        self.assertEqual(guard.filter(self.graph, [self.main, self.aux], 100, [self.aux]), ([self.main, self.aux], -2650))
+
+    def test_energy_debt_ends_hold(self):
+        guard = CycleGuard(deadband=200, energy_debt=10, clock=self.clock)
+        self.main.turn_on()
+        self.assertEqual(guard.filter(self.graph, [], -100), ([self.main], -100))
+        # 100W imported for 6 minutes
+        self.clock.advance(360)
+        self.assertEqual(guard.filter(self.graph, [], -100), ([], 1550))
+        self.assertAlmostEqual(guard.debt, 10)
+        self.main.turn_off()
+        # Paid back by the surplus
+        self.clock.advance(360)
+        guard.filter(self.graph, [], 50)
+        self.assertAlmostEqual(guard.debt, 5)
+        self.assertFalse(guard.in_debt())
@@ -1,15 +1,21 @@
 import unittest
-from unittest.mock import patch
+import asyncio
+import json
+import time
+from unittest.mock import Mock, patch
 
 from requests.exceptions import Timeout
 
-from envoy import Envoy
+from envoy import Envoy, parse_production, parse_readings
+from clock import VirtualClock
+from breaker import CircuitBreaker
 
 class TestEnvoy(unittest.TestCase):
     def mocked_requests_get(*args, **kwargs):
         class MockResponse:
             def __init__(self, json_data, status_code):
                 self.json_data = json_data
+                self.content = json.dumps(json_data).encode()
                 self.status_code = status_code
 
             def json(self):
@@ -24,6 +30,7 @@ class TestEnvoy(unittest.TestCase):
         class MockResponse:
             def __init__(self, status_code, json_data=None, headers={}):
                 self.json_data = json_data
+                self.content = json.dumps(json_data).encode()
                 self.status_code = status_code
                 self.headers = headers
             def json(self):
@@ -41,16 +48,250 @@ class TestEnvoy(unittest.TestCase):
         self.assertEqual(envoy._ip, '127.0.0.1')
         self.assertEqual(envoy._url, 'http://127.0.0.1/production.json')
     
+    def test_reconfigure(self):
+        envoy = Envoy('127.0.0.1', user='john', password='doe', serial='1234')
+        envoy._tokens.update('cached')
+        options = {'type': 'envoy', 'ip': '127.0.0.2', 'user': 'john', 'password': 'doe', 'serial': '1234'}
+        self.assertEqual(envoy.reconfigure(options), [])
+        self.assertEqual(envoy._url, 'http://127.0.0.2/production.json')
+        self.assertTrue(envoy._tokens.is_valid())
+        self.assertEqual(envoy.reconfigure({**options, 'password': 'new', 'stream': True}), ['stream'])
+        self.assertEqual(envoy._password, 'new')
+        self.assertTrue(envoy._tokens.needs_refresh())
+
     def test_update_absorbs_timeout(self):
         envoy = Envoy('127.0.0.1')
         with patch('envoy.requests') as mock_requests:
-            mock_requests.get.side_effect = Timeout
-            envoy.update()
-            mock_requests.get.assert_called_once()
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.side_effect = Timeout
+            asyncio.run(envoy.update())
+            mock_session.get.assert_called_once()
     
+    def test_breaker_skips_polls_of_unreachable_gateway(self):
+        clock = VirtualClock(1672574400)
+        envoy = Envoy('127.0.0.1', breaker=CircuitBreaker('envoy', threshold=2, min_delay=10, clock=clock))
+        with patch('envoy.requests') as mock_requests:
+            mock_get = mock_requests.Session.return_value.get
+            mock_get.side_effect = Timeout
+            with self.assertLogs('envoy', level='ERROR'):
+                for i in range(5):
+                    asyncio.run(envoy.update())
+            self.assertEqual(mock_get.call_count, 2)
+            clock.advance(10)
+            mock_get.side_effect = self.mocked_requests_get
+            self.assertEqual(asyncio.run(envoy.update()), 100)
+            # The probe uses a shorter timeout
+            self.assertEqual(mock_get.call_args.kwargs['timeout'], Envoy.probe_timeout)
+            self.assertEqual(envoy.breaker.state, 'closed')
+
+    def test_breaker_opened_by_error_statuses_reports_no_surplus(self):
+        clock = VirtualClock(1672574400)
+        envoy = Envoy('127.0.0.1', breaker=CircuitBreaker('envoy', threshold=3, min_delay=10, clock=clock))
+        with patch('envoy.requests') as mock_requests:
+            mock_get = mock_requests.Session.return_value.get
+            mock_get.side_effect = self.mocked_requests_get
+            self.assertEqual(asyncio.run(envoy.update()), 100)
+            mock_get.side_effect = None
+            mock_get.return_value = Mock(status_code=500)
+            self.assertEqual([asyncio.run(envoy.update()) for i in range(6)], [0] * 6)
+            self.assertEqual(envoy.breaker.state, 'open')
+            self.assertEqual(mock_get.call_count, 4)
+            self.assertFalse(envoy.is_stale())
+
+    def test_stale_readings(self):
+        envoy = Envoy('127.0.0.1', stale=60)
+        self.assertFalse(envoy.is_stale())
+        envoy._last_reading -= 61
+        self.assertTrue(envoy.is_stale())
+        with patch('envoy.requests') as mock_requests:
+            mock_requests.Session.return_value.get.side_effect = self.mocked_requests_get
+            asyncio.run(envoy.update())
+        self.assertFalse(envoy.is_stale())
+
     def test_update_returns_availability(self):
         envoy = Envoy('127.0.0.1')
         with patch('envoy.requests') as mock_requests:
-            mock_requests.get.side_effect = self.mocked_requests_get
-            availability = envoy.update()
+            mock_requests.Session.return_value.get.side_effect = self.mocked_requests_get
+            availability = asyncio.run(envoy.update())
+            self.assertEqual(availability, 100)
             self.assertEqual(availability, envoy.production - envoy.consumption)
+
+    def test_update_error_status_reports_no_surplus(self):
+        envoy = Envoy('127.0.0.1', endpoint='production')
+        with patch('envoy.requests') as mock_requests:
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.side_effect = self.mocked_requests_get
+            self.assertEqual(asyncio.run(envoy.update()), 100)
+            mock_session.get.side_effect = None
+            mock_session.get.return_value = Mock(status_code=500)
+            self.assertEqual(asyncio.run(envoy.update()), 0)
+            # The averages are kept for when the gateway answers again
+            self.assertEqual(envoy.production - envoy.consumption, 100)
+
+    def test_update_reuses_session(self):
+        envoy = Envoy('127.0.0.1')
+        with patch('envoy.requests') as mock_requests:
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.side_effect = self.mocked_requests_get
+            asyncio.run(envoy.update())
+            asyncio.run(envoy.update())
+            mock_requests.Session.assert_called_once()
+            self.assertEqual(mock_session.get.call_count, 2)
+
+    METERS = [{'eid': 11, 'state': 'enabled', 'measurementType': 'production'},
+              {'eid': 12, 'state': 'enabled', 'measurementType': 'net-consumption'},
+              {'eid': 13, 'state': 'disabled', 'measurementType': 'total-consumption'}]
+    READINGS = [{'eid': 11, 'activePower': 2500.5, 'channels': [{'eid': 1, 'activePower': 800}]},
+                {'eid': 12, 'activePower': -1700.25, 'channels': [{'eid': 2, 'activePower': -600}]}]
+
+    def test_parse_production(self):
+        data = {'production': [{'type': 'inverters', 'wNow': 1900}, {'type': 'eim', 'wNow': 2000.5}],
+                'consumption': [{'type': 'eim', 'measurementType': 'total-consumption', 'wNow': 800},
+                                {'type': 'eim', 'measurementType': 'net-consumption', 'wNow': -1200.5}],
+                'storage': [{'type': 'acb', 'wNow': 0}]}
+        self.assertEqual(parse_production(json.dumps(data, indent=2).encode()), (2000.5, 800))
+        # Documents without meters are decoded as a whole
+        data = {'production': [{'type': 'inverters', 'wNow': 1900}], 'consumption': []}
+        self.assertEqual(parse_production(json.dumps(data).encode()), (None, None))
+
+    def test_parse_readings(self):
+        meters = {11: 'production', 12: 'net-consumption'}
+        self.assertEqual(parse_readings(json.dumps(self.READINGS).encode(), meters), (2500.5, 800.25))
+        self.assertEqual(parse_readings(json.dumps(self.READINGS).encode(), {11: 'production', 12: 'total-consumption'}), (2500.5, -1700.25))
+        with self.assertRaises(KeyError):
+            parse_readings(json.dumps(self.READINGS[:1]).encode(), meters)
+
+    def test_update_polls_meter_readings(self):
+        envoy = Envoy('127.0.0.1', endpoint='auto')
+        documents = {'http://127.0.0.1/ivp/meters': self.METERS, 'http://127.0.0.1/ivp/meters/readings': self.READINGS}
+
+        class MockResponse:
+            def __init__(self, url, **kwargs):
+                self.status_code = 200 if url in documents else 404
+                self.content = json.dumps(documents.get(url)).encode()
+
+        with patch('envoy.requests') as mock_requests:
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.side_effect = MockResponse
+            self.assertEqual(asyncio.run(envoy.update()), 1700)
+            asyncio.run(envoy.update())
+            urls = [c.args[0] for c in mock_session.get.call_args_list]
+        self.assertEqual(urls, ['http://127.0.0.1/ivp/meters'] + ['http://127.0.0.1/ivp/meters/readings'] * 2)
+        # A new address is probed again
+        envoy.reconfigure({'type': 'envoy', 'ip': '127.0.0.2', 'user': '', 'password': '', 'serial': '', 'endpoint': 'auto'})
+        self.assertEqual(envoy._url, 'http://127.0.0.2/production.json')
+        self.assertFalse(envoy._probed)
+
+    def test_update_production_endpoint_skips_probe(self):
+        # production.json is smaller than the meter readings, it is polled by default
+        envoy = Envoy('127.0.0.1')
+        with patch('envoy.requests') as mock_requests:
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.side_effect = self.mocked_requests_get
+            self.assertEqual(asyncio.run(envoy.update()), 100)
+            mock_session.get.assert_called_once()
+
+    def test_update_does_not_block_event_loop(self):
+        envoy = Envoy('127.0.0.1')
+        ticks = []
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.3)
+            raise Timeout()
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(ticker())
+            await envoy.update()
+            task.cancel()
+
+        with patch('envoy.requests') as mock_requests:
+            mock_requests.Session.return_value.get.side_effect = slow_get
+            asyncio.run(run())
+        self.assertGreater(len(ticks), 10)
+
+    def test_update_renews_expiring_token_in_background(self):
+        envoy = Envoy('127.0.0.1', user='john', password='doe', serial='1234')
+        envoy._tokens.token = 'cached'
+        envoy._tokens.issued = time.time() - 900
+        envoy._tokens.expires = time.time() + 100
+
+        class MockResponse:
+            def __init__(self, status_code, json_data=None, text=''):
+                self.status_code = status_code
+                self.json_data = json_data
+                self.text = text
+            def json(self):
+                return self.json_data
+
+        def mocked_post(url, **kwargs):
+            if 'enlighten' in url:
+                return MockResponse(200, {'session_id': 'abcd'})
+            return MockResponse(200, text='renewed')
+
+        async def run():
+            await envoy.update()
+            await envoy._refresh_future
+
+        with patch('envoy.requests') as mock_requests:
+            mock_requests.Session.return_value.get.side_effect = self.mocked_requests_get
+            mock_requests.post.side_effect = mocked_post
+            asyncio.run(run())
+            self.assertEqual(mock_requests.post.call_count, 2)
+        self.assertEqual(envoy._tokens.token, 'renewed')
+
+    def test_update_backs_off_after_failed_renewal(self):
+        envoy = Envoy('127.0.0.1', user='john', password='doe', serial='1234')
+
+        class MockResponse:
+            status_code = 401
+
+        with patch('envoy.requests') as mock_requests:
+            mock_requests.Session.return_value.get.return_value = MockResponse()
+            mock_requests.post.return_value = MockResponse()
+            asyncio.run(envoy.update())
+            asyncio.run(envoy.update())
+            # Only the first poll tried to log in with enlighten
+            mock_requests.post.assert_called_once()
+
+    def test_stream_feeds_readings(self):
+        envoy = Envoy('127.0.0.1', stream=True)
+        chunks = [b'data: {"production":{"ph-a":{"p":20', b'00}},"total-consumption":{"ph-a":{"p":500}}}\n\n']
+
+        class MockStreamResponse:
+            status_code = 200
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+                pass
+            def iter_content(self, chunk_size):
+                yield from chunks
+                envoy._stream_stop.set()
+            def close(self):
+                pass
+
+        async def run():
+            await envoy.task()
+            # Let the loop process readings pushed by the stream thread
+            await asyncio.sleep(0)
+            self.assertTrue(envoy.is_streaming())
+            return await envoy.update()
+
+        with patch('envoy.requests') as mock_requests:
+            mock_session = mock_requests.Session.return_value
+            mock_session.get.return_value = MockStreamResponse()
+            availability = asyncio.run(run())
+            mock_session.get.assert_called_once()
+            self.assertTrue(mock_session.get.call_args.kwargs['stream'])
+        self.assertEqual(availability, 1500)
+
+    def test_update_polls_when_stream_is_down(self):
+        envoy = Envoy('127.0.0.1', stream=True)
+        self.assertFalse(envoy.is_streaming())
+        with patch('envoy.requests') as mock_requests:
+            mock_requests.Session.return_value.get.side_effect = self.mocked_requests_get
+            self.assertEqual(asyncio.run(envoy.update()), 100)
@@ -0,0 +1,109 @@
+import unittest
+
+from filters import MovingAverage, ExponentialAverage, TimeWeightedAverage, make_filter
+
+class TestMovingAverage(unittest.TestCase):
+    def test_empty(self):
+        f = MovingAverage(3)
+        self.assertIsNone(f.value())
+        self.assertEqual(len(f), 0)
+
+    def test_window(self):
+        f = MovingAverage(3)
+        for v in [10, 20, 30, 40]:
+            f.append(v)
+        self.assertEqual(len(f), 3)
+        self.assertEqual(f.value(), 30)
+
+    def test_large_window(self):
+        f = MovingAverage(1000)
+        for v in range(5000):
+            f.append(v)
+        self.assertEqual(f.value(), sum(range(4000, 5000)) / 1000)
+
+    def test_clear(self):
+        f = MovingAverage(3)
+        f.append(10)
+        f.clear()
+        self.assertIsNone(f.value())
+        f.append(20)
+        self.assertEqual(f.value(), 20)
+
+class TestExponentialAverage(unittest.TestCase):
+    def test_first_value(self):
+        f = ExponentialAverage(3)
+        self.assertIsNone(f.value())
+        f.append(100)
+        self.assertEqual(f.value(), 100)
+
+    def test_smoothing(self):
+        f = ExponentialAverage(3)
+        f.append(100)
+        f.append(200)
+        self.assertEqual(f.value(), 150)
+        f.append(200)
+        self.assertEqual(f.value(), 175)
+
+    def test_clear(self):
+        f = ExponentialAverage(3)
+        f.append(100)
+        f.clear()
+        self.assertIsNone(f.value())
+        self.assertEqual(len(f), 0)
+
+class TestTimeWeightedAverage(unittest.TestCase):
+    def test_single_sample(self):
+        f = TimeWeightedAverage(60)
+        f.append(100, now=1000)
+        self.assertEqual(f.value(now=1000), 100)
+        self.assertEqual(f.value(now=2000), 100)
+
+    def test_weights_by_duration(self):
+        f = TimeWeightedAverage(60)
+        f.append(100, now=1000)
+        f.append(400, now=1030)
+        # 30s at 100, 10s at 400
+        self.assertEqual(f.value(now=1040), (30 * 100 + 10 * 400) / 40)
+
+    def test_window_clips_old_samples(self):
+        f = TimeWeightedAverage(60)
+        f.append(100, now=1000)
+        f.append(400, now=1030)
+        f.append(200, now=1060)
+        # Window is [1020, 1080]: 10s at 100, 30s at 400, 20s at 200
+        self.assertEqual(f.value(now=1080), (10 * 100 + 30 * 400 + 20 * 200) / 60)
+        # Window is [1100, 1160]: only the last sample is left
+        self.assertEqual(f.value(now=1160), 200)
+        self.assertEqual(len(f), 1)
+
+    def test_evicts_on_append(self):
+        f = TimeWeightedAverage(10)
+        for t in range(1000):
+            f.append(t, now=t)
+        self.assertLessEqual(len(f), 12)
+        self.assertAlmostEqual(f.value(now=999), sum(range(989, 999)) / 10)
+
+    def test_uses_clock(self):
+        now = [1000]
+        f = TimeWeightedAverage(60, clock=lambda: now[0])
+        f.append(100)
+        now[0] = 1010
+        f.append(300)
+        now[0] = 1020
+        self.assertEqual(f.value(), 200)
+
+    def test_clear(self):
+        f = TimeWeightedAverage(60)
+        f.append(100, now=1000)
+        f.clear()
+        self.assertIsNone(f.value(now=1000))
+
+class TestMakeFilter(unittest.TestCase):
+    def test_make_filter(self):
+        self.assertIsInstance(make_filter(), MovingAverage)
+        self.assertIsInstance(make_filter('ewma', 10), ExponentialAverage)
+        self.assertIsInstance(make_filter('time', 300), TimeWeightedAverage)
+
+    def test_make_filter_unknown(self):
+        with self.assertRaises(ValueError):
+            make_filter('median')
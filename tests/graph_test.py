@@ -0,0 +1,56 @@
+import unittest
+
+from pump import Pump
+from graph import PumpGraph
+
+class TestPumpGraph(unittest.TestCase):
+    def setUp(self):
+        # main feeds both the heater and the cleaner, the heater also needs the filter
+        self.main = Pump('main', 1650, 3600)
+        self.filter = Pump('filter', 300, 3600)
+        self.heater = Pump('heater', 1000, 3600)
+        self.cleaner = Pump('cleaner', 1100, 1800)
+        self.heater.chain(self.main)
+        self.heater.chain(self.filter)
+        self.cleaner.chain(self.main)
+        self.graph = PumpGraph([self.cleaner, self.heater, self.filter, self.main])
+
+    def test_start_order(self):
+        self.assertEqual(self.graph.start_order, [self.filter, self.main, self.cleaner, self.heater])
+        self.assertEqual(self.graph.stop_order, [self.heater, self.cleaner, self.main, self.filter])
+
+    def test_rejects_cycles(self):
+        self.main.chain(self.heater)
+        with self.assertRaises(ValueError):
+            PumpGraph([self.cleaner, self.heater, self.filter, self.main])
+
+    def test_rejects_unknown_upstream(self):
+        with self.assertRaises(ValueError):
+            PumpGraph([self.cleaner, self.heater, self.main])
+
+    def test_eligible_matches_should_run(self):
+        self.filter.runtime = 3600
+        eligible = self.graph.eligible()
+        for p in self.graph:
+            self.assertEqual(p in eligible, p.should_run())
+        self.assertEqual(eligible, {self.main, self.cleaner})
+
+    def test_closure(self):
+        self.assertEqual(self.graph.closure([self.heater]), [self.filter, self.main, self.heater])
+        self.assertEqual(self.graph.closure([self.cleaner, self.filter]), [self.filter, self.main, self.cleaner])
+
+    def test_of_reuses_graph(self):
+        self.assertIs(PumpGraph.of(self.graph), self.graph)
+        self.assertEqual(PumpGraph.of([self.main]).pumps, [self.main])
+
+class TestPumpGraphScale(unittest.TestCase):
+    def test_long_chain(self):
+        # Deeper than the recursion limit would allow with should_run()
+        pumps = [Pump('p0', 100, 3600)]
+        for i in range(1, 5000):
+            p = Pump(f'p{i}', 100, 3600)
+            p.chain(pumps[-1])
+            pumps.append(p)
+        graph = PumpGraph(reversed(pumps))
+        self.assertEqual(graph.start_order, pumps)
+        self.assertEqual(len(graph.eligible()), 5000)
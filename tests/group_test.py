@@ -0,0 +1,56 @@
+import unittest
+import asyncio
+from unittest.mock import Mock
+
+from pump import Pump
+from group import Group
+
+class TestGroup(unittest.TestCase):
+    def setUp(self):
+        self.pump = Pump('main', 1650, 3 * 3600)
+        self.controller = Mock()
+        self.controller.run = Mock(side_effect=lambda: asyncio.sleep(3600))
+        self.mqtt_client = Mock()
+        self.mqtt_client.task = Mock(side_effect=lambda: asyncio.sleep(3600))
+        self.group = Group('pool', [self.pump], None, self.controller, self.mqtt_client)
+
+    def test_attaches_mqtt_client(self):
+        self.mqtt_client.attach.assert_called_once_with([self.pump], self.group.on_mode_changed, self.group.on_switch_command)
+
+    def test_switch_commands_only_in_manual_mode(self):
+        self.group.on_switch_command(self.pump, 'ON')
+        self.assertFalse(self.pump.is_running())
+        self.group.mode = 'MANUAL'
+        self.group.on_switch_command(self.pump, 'ON')
+        self.assertTrue(self.pump.is_running())
+        self.group.on_switch_command(self.pump, 'OFF')
+        self.assertFalse(self.pump.is_running())
+
+    def test_mode_changes(self):
+        async def run():
+            self.group.start()
+            self.assertEqual(self.controller.run.call_count, 1)
+            self.pump.turn_on()
+            self.assertEqual(self.group.on_mode_changed('OFF'), 'OFF')
+            self.assertFalse(self.pump.is_running())
+            self.assertEqual(self.group.on_mode_changed('AUTO'), 'AUTO')
+            self.assertEqual(self.controller.run.call_count, 2)
+            self.group.stop()
+        asyncio.run(run())
+
+    def test_failures_stay_within_group(self):
+        async def fail():
+            raise RuntimeError('boom')
+        failing = Mock()
+        failing.run = Mock(side_effect=fail)
+        broken = Group('broken', [], None, failing)
+        async def run():
+            broken.start()
+            self.group.start()
+            with self.assertLogs(level='ERROR') as logs:
+                await asyncio.sleep(0.01)
+            self.assertIn('broken control task stopped', logs.output[0])
+            self.assertEqual(len(self.group._tasks), 2)
+            self.assertFalse(any(t.done() for t in self.group._tasks))
+            self.group.stop()
+        asyncio.run(run())
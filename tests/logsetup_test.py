@@ -0,0 +1,60 @@
+import os
+import gzip
+import logging
+import unittest
+import tempfile
+
+from logsetup import setup_logging
+
+class TestLogSetup(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'debug.log')
+        root = logging.getLogger()
+        self.saved = (root.handlers[:], root.level)
+
+    def tearDown(self):
+        if self.listener._thread:
+            self.listener.stop()
+        self.listener.handlers[0].close()
+        root = logging.getLogger()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+        root.handlers[:], level = self.saved
+        root.setLevel(level)
+        logging.getLogger('test_quiet').setLevel(logging.NOTSET)
+        self.directory.cleanup()
+
+    def read(self):
+        self.listener.stop()
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_per_module_levels(self):
+        self.listener = setup_logging(self.filename, level='DEBUG', levels={'test_quiet': 'WARNING'})
+        logging.getLogger('test_verbose').debug('reading %s', 42)
+        logging.getLogger('test_quiet').debug('hidden')
+        logging.getLogger('test_quiet').warning('shown')
+        content = self.read()
+        self.assertIn('test_verbose: reading 42', content)
+        self.assertNotIn('hidden', content)
+        self.assertIn('test_quiet: shown', content)
+
+    def test_disabled_lines_are_not_formatted(self):
+        self.listener = setup_logging(self.filename, level='INFO')
+        class Expensive():
+            def __str__(self):
+                raise AssertionError('formatted a disabled line')
+        logging.getLogger('test_verbose').debug('value %s', Expensive())
+        self.assertEqual(self.read(), '')
+
+    def test_rotation_compresses(self):
+        self.listener = setup_logging(self.filename, max_bytes=200, backup_count=2)
+        logger = logging.getLogger('test_verbose')
+        for i in range(20):
+            logger.info('line %s %s', i, 'x' * 40)
+        self.listener.stop()
+        rotated = sorted(f for f in os.listdir(self.directory.name) if f != 'debug.log')
+        self.assertEqual(rotated, ['debug.log.1.gz', 'debug.log.2.gz'])
+        with gzip.open(os.path.join(self.directory.name, 'debug.log.1.gz'), 'rt') as f:
+            self.assertIn('line', f.read())
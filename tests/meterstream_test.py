@@ -0,0 +1,47 @@
+import unittest
+
+from meterstream import MeterStreamParser
+
+EVENT = b'data: {"production":{"ph-a":{"p":1200.5,"q":10},"ph-b":{"p":300,"q":5}},"net-consumption":{"ph-a":{"p":-500}},"total-consumption":{"ph-a":{"p":700.2},"ph-b":{"p":100}}}'
+
+class TestMeterStreamParser(unittest.TestCase):
+    def test_parse_line(self):
+        parser = MeterStreamParser()
+        self.assertEqual(parser.parse_line(EVENT), (1500, 800))
+    
+    def test_parse_line_ignores_other_fields(self):
+        parser = MeterStreamParser()
+        self.assertIsNone(parser.parse_line(b''))
+        self.assertIsNone(parser.parse_line(b': keep-alive'))
+        self.assertIsNone(parser.parse_line(b'event: meter'))
+        self.assertIsNone(parser.parse_line(b'data: {"production": {}}'))
+        self.assertIsNone(parser.parse_line(b'data: {not json'))
+
+    def test_feed_complete_events(self):
+        parser = MeterStreamParser()
+        self.assertEqual(parser.feed(EVENT + b'\n\n' + EVENT + b'\n\n'), [(1500, 800), (1500, 800)])
+
+    def test_feed_split_across_chunks(self):
+        parser = MeterStreamParser()
+        data = (EVENT + b'\r\n\r\n') * 3
+        readings = []
+        for i in range(0, len(data), 7):
+            readings += parser.feed(data[i:i + 7])
+        self.assertEqual(readings, [(1500, 800)] * 3)
+
+    def test_feed_keeps_partial_line(self):
+        parser = MeterStreamParser()
+        self.assertEqual(parser.feed(EVENT[:20]), [])
+        self.assertEqual(parser.feed(EVENT[20:]), [])
+        self.assertEqual(parser.feed(b'\n'), [(1500, 800)])
+
+    def test_feed_discards_oversized_line(self):
+        parser = MeterStreamParser()
+        parser.feed(b'x' * (MeterStreamParser.max_line + 1))
+        self.assertEqual(parser.feed(b'\n' + EVENT + b'\n'), [(1500, 800)])
+
+    def test_reset(self):
+        parser = MeterStreamParser()
+        parser.feed(EVENT[:20])
+        parser.reset()
+        self.assertEqual(parser.feed(EVENT + b'\n'), [(1500, 800)])
@@ -0,0 +1,97 @@
+import time
+import unittest
+import asyncio
+
+from metrics import Registry, MetricsServer, LoopMonitor
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        errors = self.registry.counter('test_errors', 'Errors', ['reason'])
+        errors.labels(reason='timeout').inc()
+        errors.labels(reason='timeout').inc(2)
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE test_errors counter', lines)
+        self.assertIn('test_errors_total{reason="timeout"} 3', lines)
+        self.assertEqual(lines[-1], '# EOF')
+        # The classic text format names the family after its sample
+        lines = self.registry.render(openmetrics=False).splitlines()
+        self.assertIn('# TYPE test_errors_total counter', lines)
+        self.assertNotIn('# EOF', lines)
+
+    def test_gauge_without_labels(self):
+        gauge = self.registry.gauge('test_lag', 'Lag')
+        gauge.set(0.5)
+        self.assertIn('test_lag 0.5', self.registry.render().splitlines())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('test_poll_seconds', 'Polls', buckets=[0.1, 1])
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertIn('test_poll_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('test_poll_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('test_poll_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('test_poll_seconds_count 4', lines)
+        self.assertIn('test_poll_seconds_sum 3.65', lines)
+
+    def test_label_values_are_escaped(self):
+        gauge = self.registry.gauge('test_runtime', 'Runtime', ['pump'])
+        gauge.labels(pump='a "b"').set(1)
+        self.assertIn('test_runtime{pump="a \\"b\\""} 1', self.registry.render().splitlines())
+
+    def test_collectors_run_on_scrape(self):
+        gauge = self.registry.gauge('test_surplus', 'Surplus')
+        self.registry.add_collector(lambda: gauge.set(1200))
+        self.assertIn('test_surplus 1200', self.registry.render().splitlines())
+
+class TestMetricsServer(unittest.TestCase):
+    def test_scrape(self):
+        registry = Registry()
+        registry.counter('test_polls', 'Polls').inc()
+        server = MetricsServer('127.0.0.1', 0, registry)
+
+        async def get(path, accept):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server._port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: {accept}\r\n\r\n'.encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(server.task())
+            while server._server is None:
+                await asyncio.sleep(0.01)
+            response = await get('/metrics', 'application/openmetrics-text; version=1.0.0')
+            self.assertTrue(response.startswith('HTTP/1.1 200 OK'))
+            self.assertIn('Content-Type: application/openmetrics-text', response)
+            self.assertIn('test_polls_total 1', response)
+            self.assertTrue(response.endswith('# EOF\n'))
+            response = await get('/metrics', 'text/plain')
+            self.assertIn('Content-Type: text/plain; version=0.0.4', response)
+            response = await get('/other', '*/*')
+            self.assertTrue(response.startswith('HTTP/1.1 404'))
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+
+class TestLoopMonitor(unittest.TestCase):
+    def test_records_lag(self):
+        monitor = LoopMonitor(0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(monitor.task())
+            await asyncio.sleep(0.02)
+            # Block the loop, the next wake up of the monitor is late
+            time.sleep(0.05)
+            await asyncio.sleep(0.02)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertGreaterEqual(monitor._max, 0.03)
+        monitor.collect()
+        self.assertEqual(monitor._max, 0)
@@ -1,7 +1,13 @@
+import json
 import unittest
+import time
+import asyncio
 from unittest.mock import Mock, patch
 
+import metrics
 from mqttclient import MQTTClient
+from breaker import CircuitBreaker
+from brokerstub import BrokerStub
 
 class TestMQTTClient(unittest.TestCase):
     def test_constructor_default_values(self):
@@ -58,4 +64,151 @@ class TestMQTTClient(unittest.TestCase):
         self.assertEqual(client._pumps, pumps)
         for p in pumps:
             p.add_state_callback.assert_called_once()
-            p.add_update_callback.assert_called_once()
\ No newline at end of file
+            p.add_update_callback.assert_called_once()
+
+    def test_switch_commands_routed_by_topic(self):
+        client = MQTTClient({})
+        pumps = [Mock() for i in range(3)]
+        for i, p in enumerate(pumps):
+            p.name = f'pump{i}'
+        switch_cb = Mock()
+        client.attach(pumps, Mock(), switch_cb)
+        msg = Mock(topic='homeassistant/switch/pipump_12345/pump2/set', payload=b'ON')
+        client.on_switch_message(None, None, msg)
+        switch_cb.assert_called_once_with(pumps[2], 'ON')
+        # Commands for switches of other devices or unknown pumps are ignored
+        for topic in ['homeassistant/switch/pipump_other/pump2/set', 'homeassistant/switch/pipump_12345/pump9/set']:
+            client.on_switch_message(None, None, Mock(topic=topic, payload=b'ON'))
+        switch_cb.assert_called_once()
+
+    def test_single_subscription_for_all_switches(self):
+        with patch('mqttclient.mqtt') as mock_mqtt:
+            client = MQTTClient({'discovery': False})
+            pumps = [Mock(goal_progress=0) for i in range(50)]
+            for i, p in enumerate(pumps):
+                p.name = f'pump{i}'
+                p.is_running.return_value = False
+            client.attach(pumps, Mock(), Mock())
+            client.on_connected(None, None, None, 0)
+            internal_client = mock_mqtt.Client.return_value
+            self.assertEqual([c.args[0] for c in internal_client.subscribe.call_args_list],
+                             ['homeassistant/select/pipump_12345/set', 'homeassistant/switch/pipump_12345/+/set'])
+
+    def test_breaker_sensor(self):
+        with patch('mqttclient.mqtt') as mock_mqtt:
+            client = MQTTClient({'uid': 'a'})
+            internal_client = mock_mqtt.Client.return_value
+            internal_client.publish.return_value.rc = 0
+            breaker = CircuitBreaker('envoy')
+            client.attach([], Mock(), Mock())
+            client.attach_breaker(breaker)
+            client.announce_pumps()
+            published = {c.args[0]: c.args[1] for c in internal_client.publish.call_args_list}
+            self.assertEqual(json.loads(published['homeassistant/sensor/pipump_a/pvsystem/config'])['entity_category'], 'diagnostic')
+            self.assertEqual(published['homeassistant/sensor/pipump_a/pvsystem/state'], 'closed')
+            for i in range(3):
+                breaker.failure()
+            internal_client.publish.assert_called_with('homeassistant/sensor/pipump_a/pvsystem/state', 'open', retain=True)
+
+    def test_metrics_labelled_with_group(self):
+        with patch('mqttclient.mqtt') as mock_mqtt:
+            client = MQTTClient({'uid': 'a', 'coalesce_window': 0}, 'pool')
+            internal_client = mock_mqtt.Client.return_value
+            internal_client.publish.return_value.rc = 0
+            client._publisher.publish('pool/state', 'ON')
+            client.collect_metrics()
+            self.assertEqual(metrics.mqtt_messages_sent.labels(group='pool').value, 1)
+            self.assertIs(client._reconnects, metrics.mqtt_reconnects.labels(group='pool'))
+
+    def test_reconfigure(self):
+        with patch('mqttclient.mqtt') as mock_mqtt:
+            client = MQTTClient({'uid': 'a', 'discovery': False})
+            pump = Mock(goal_progress=0)
+            pump.name = 'main'
+            pump.is_running.return_value = False
+            client.attach([pump], Mock(), Mock())
+            internal_client = mock_mqtt.Client.return_value
+            internal_client.publish.return_value.rc = 0
+            self.assertEqual(client.reconfigure({'uid': 'a', 'discovery': True, 'coalesce_window': 0.5}), [])
+            self.assertEqual(client._publisher.window, 0.5)
+            topics = [c.args[0] for c in internal_client.publish.call_args_list]
+            self.assertIn('homeassistant/switch/pipump_a/main/config', topics)
+            internal_client.publish.reset_mock()
+            self.assertEqual(client.reconfigure({'uid': 'b', 'host': 'broker', 'discovery': False}), ['host', 'uid'])
+            configs = {c.args[0]: c.args[1] for c in internal_client.publish.call_args_list}
+            self.assertEqual(configs['homeassistant/switch/pipump_a/main/config'], '')
+            self.assertEqual(configs['homeassistant/select/pipump_a/config'], '')
+
+class TestMQTTClientEventLoop(unittest.TestCase):
+    def test_exchanges_messages_without_polling(self):
+        broker = BrokerStub()
+        pump = Mock()
+        pump.name = 'main'
+        pump.goal_progress = 0
+        pump.is_running.return_value = False
+        mode_cb = Mock(return_value='MANUAL')
+
+        async def wait_for(condition):
+            while not condition():
+                broker.received.clear()
+                await asyncio.wait_for(broker.received.wait(), 2)
+
+        async def run():
+            port = await broker.start()
+            client = MQTTClient({'host': '127.0.0.1', 'port': port, 'coalesce_window': 0})
+            switch_cb = Mock()
+            client.attach([pump], mode_cb, switch_cb)
+            task = asyncio.get_running_loop().create_task(client.task())
+            await wait_for(lambda: ('homeassistant/switch/pipump_12345/main/state', 'OFF') in broker.published)
+            self.assertIn('homeassistant/select/pipump_12345/set', broker.subscribed)
+            self.assertIn('homeassistant/switch/pipump_12345/+/set', broker.subscribed)
+            broker.publish('homeassistant/select/pipump_12345/set', 'MANUAL')
+            await wait_for(lambda: ('homeassistant/select/pipump_12345/state', 'MANUAL') in broker.published)
+            mode_cb.assert_called_once_with('MANUAL')
+            broker.publish('homeassistant/switch/pipump_12345/main/set', 'ON')
+            for i in range(200):
+                if switch_cb.called:
+                    break
+                await asyncio.sleep(0.01)
+            switch_cb.assert_called_once_with(pump, 'ON')
+            # Publishes from our own code are written by the event loop too
+            client.on_pump_state_changed(pump, 'ON')
+            await wait_for(lambda: ('homeassistant/switch/pipump_12345/main/state', 'ON') in broker.published)
+            client.on_pump_state_changed(pump, 'ON')
+            self.assertEqual(client.messages_suppressed, 1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await broker.stop()
+
+        asyncio.run(run())
+
+    def test_connect_does_not_block_event_loop(self):
+        client = MQTTClient({'host': '127.0.0.1'})
+        reconnects = client._reconnects.value
+        ticks = []
+
+        def slow_connect(*args):
+            # An unreachable broker, paho waits for the TCP connection to time out
+            time.sleep(0.3)
+            raise OSError('timed out')
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            ticking = asyncio.get_running_loop().create_task(ticker())
+            task = asyncio.get_running_loop().create_task(client.task())
+            await asyncio.sleep(0.2)
+            # The loop kept running while the connection attempt was pending
+            self.assertEqual(client._reconnects.value, reconnects)
+            self.assertGreater(len(ticks), 10)
+            await asyncio.sleep(0.2)
+            self.assertEqual(client._reconnects.value, reconnects + 1)
+            task.cancel()
+            ticking.cancel()
+
+        with patch.object(client._client, 'connect', side_effect=slow_connect):
+            asyncio.run(run())
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from pump import Pump
+from clock import VirtualClock
+from allocator import Allocator
+from scheduler import Scheduler
+from controller import Controller
+from mqttmeter import MQTTMeter
+from brokerstub import BrokerStub
+
+def message(topic, payload):
+    return SimpleNamespace(topic=topic, payload=payload.encode())
+
+class TestMQTTMeter(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1672574400)
+        self.meter = MQTTMeter({'production': {'topic': 'solar', 'path': '$.power'},
+                                'grid': {'topic': 'meter', 'path': '$.grid', 'scale': 1000},
+                                'stale': 30}, clock=self.clock)
+        self.callback = Mock()
+        self.meter.add_reading_callback(self.callback)
+
+    def test_requires_consumption_or_grid(self):
+        with self.assertRaises(ValueError):
+            MQTTMeter({'production': {'topic': 'solar'}})
+
+    def test_readings_pushed_into_averages(self):
+        self.meter.on_message(None, None, message('meter', '{"grid": 0.2}'))
+        self.callback.assert_not_called()
+        self.meter.on_message(None, None, message('solar', '{"power": 3000}'))
+        self.meter.on_message(None, None, message('meter', '{"grid": -1.0}'))
+        self.assertEqual(self.meter.production, 3000)
+        self.assertEqual(self.meter.consumption, 2000)
+        self.callback.assert_called_once_with(self.meter, 3000, 2000)
+        self.assertEqual(asyncio.run(self.meter.update()), 1000)
+
+    def test_bad_payloads_are_ignored(self):
+        self.meter.on_message(None, None, message('solar', '{"power": 3000}'))
+        self.meter.on_message(None, None, message('solar', 'offline'))
+        self.meter.on_message(None, None, message('solar', '{"voltage": 230}'))
+        self.assertEqual(self.meter.production, 3000)
+
+    def test_stale_readings(self):
+        self.meter.on_message(None, None, message('solar', '{"power": 3000}'))
+        self.meter.on_message(None, None, message('meter', '{"grid": -1.0}'))
+        self.clock.advance(20)
+        self.meter.on_message(None, None, message('solar', '{"power": 3000}'))
+        self.assertFalse(self.meter.is_stale())
+        self.clock.advance(20)
+        self.assertTrue(self.meter.is_stale())
+        with self.assertLogs('mqttmeter', level='WARNING'):
+            availability = asyncio.run(self.meter.update())
+        # No production assumed until the meter publishes again
+        self.assertEqual(availability, -2000)
+        self.meter.on_message(None, None, message('meter', '{"grid": -1.0}'))
+        self.meter.on_message(None, None, message('solar', '{"power": 3000}'))
+        self.assertEqual(asyncio.run(self.meter.update()), 1000)
+
+    def test_pump_switch_waits_for_next_reading(self):
+        self.meter.on_message(None, None, message('solar', '{"power": 1700}'))
+        self.meter.on_message(None, None, message('meter', '{"grid": -1.2}'))
+        pumps = [Pump('a', 1000, 3600, clock=self.clock), Pump('b', 1000, 3600, priority=2, clock=self.clock)]
+        controller = Controller(pumps, self.meter, Allocator(), Scheduler(), clock=self.clock)
+        asyncio.run(controller.tick())
+        self.assertEqual([p.is_running() for p in pumps], [False, True])
+        # The consumption average was cleared, the last reading stands in for it
+        self.assertEqual(self.meter.consumption, 500)
+        self.clock.advance(10)
+        asyncio.run(controller.tick())
+        self.assertEqual([p.is_running() for p in pumps], [False, True])
+        self.meter.on_message(None, None, message('meter', '{"grid": -0.2}'))
+        self.assertEqual(asyncio.run(self.meter.update()), 200)
+
+class TestMQTTMeterBroker(unittest.TestCase):
+    def test_subscribes_and_receives_readings(self):
+        broker = BrokerStub()
+        async def run():
+            port = await broker.start()
+            meter = MQTTMeter({'host': '127.0.0.1', 'port': port,
+                               'production': {'topic': 'tele/inverter/SENSOR', 'path': '$.ENERGY.Power'},
+                               'consumption': {'topic': 'tele/meter/SENSOR', 'path': "$['SML']['Power_curr']"}})
+            readings = asyncio.Queue()
+            meter.add_reading_callback(lambda device, production, consumption: readings.put_nowait((production, consumption)))
+            task = asyncio.get_running_loop().create_task(meter.task())
+            for i in range(200):
+                if len(broker.subscribed) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(sorted(broker.subscribed), ['tele/inverter/SENSOR', 'tele/meter/SENSOR'])
+            broker.publish('tele/inverter/SENSOR', '{"ENERGY": {"Power": 2500}}')
+            broker.publish('tele/meter/SENSOR', '{"SML": {"Power_curr": 700}}')
+            self.assertEqual(await asyncio.wait_for(readings.get(), 2), (2500, 700))
+            self.assertEqual(await meter.update(), 1800)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await broker.stop()
+        asyncio.run(run())
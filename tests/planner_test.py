@@ -0,0 +1,91 @@
+import unittest
+import tempfile
+from datetime import datetime
+from unittest.mock import Mock
+
+from pump import Pump
+from recorder import Recorder
+
+try:
+    import numpy
+    from planner import Planner
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.recorder = Recorder(self.tmpdir.name, keep_days=100000)
+        self.today = datetime(2020, 6, 18).timestamp()
+        self.main = Pump('main', 1500, 3 * 3600)
+        self.aux = Pump('aux', 500, 3600)
+        self.aux.chain(self.main)
+
+    def tearDown(self):
+        self.recorder.close()
+        self.tmpdir.cleanup()
+
+    def record_day(self, day, peak, consumption=300, pumps=0):
+        # Production from 08:00 to 18:00, peaking at noon
+        start = self.today - day * 86400
+        for minute in range(0, 24 * 60, 5):
+            production = max(0, peak * (1 - abs(minute - 13 * 60) / 300)) if 8 * 60 <= minute < 18 * 60 else 0
+            self.recorder.append(start + minute * 60, production, consumption + (1500 if pumps else 0), pumps)
+
+    def planner(self, **kwargs):
+        return Planner(self.recorder, [self.main, self.aux], **kwargs)
+
+    def test_learns_sunset(self):
+        for day in [1, 2, 3]:
+            self.record_day(day, 4000)
+        planner = self.planner()
+        planner.learn(datetime.fromtimestamp(self.today).date())
+        self.assertEqual(planner._production.shape, (3, 24 * 60))
+        self.assertEqual(planner.deadline(), 18 * 60)
+
+    def test_configured_deadline(self):
+        self.assertEqual(self.planner(deadline='20:30').deadline(), 20 * 60 + 30)
+
+    def test_excludes_own_pumps_from_consumption(self):
+        self.record_day(1, 4000, pumps=1)
+        planner = self.planner()
+        planner.learn(datetime.fromtimestamp(self.today).date())
+        # At noon: 4000 * 0.8 production, 300 household consumption once the main pump is removed
+        self.assertAlmostEqual(planner._surplus[0, 12 * 60], 4000 * 0.8 - 300)
+
+    def test_probability_sunny_and_cloudy(self):
+        for day in [1, 2, 3]:
+            self.record_day(day, 4000)
+        self.record_day(4, 1000)
+        callback = Mock()
+        planner = self.planner()
+        planner.add_probability_callback(callback)
+        forced, probabilities = planner.plan(self.today + 6 * 3600)
+        self.assertEqual(forced, [])
+        self.assertEqual(probabilities[self.main], 0.75)
+        callback.assert_any_call(self.main, 0.75)
+
+    def test_forces_pump_before_deadline(self):
+        for day in [1, 2]:
+            self.record_day(day, 1000)
+        planner = self.planner()
+        forced, probabilities = planner.plan(self.today + 14 * 3600)
+        self.assertEqual(forced, [])
+        self.assertEqual(probabilities[self.main], 0)
+        # 3 hours left before sunset, the main pump has to run until then
+        forced, probabilities = planner.plan(self.today + 15 * 3600)
+        self.assertEqual(forced, [self.main])
+        forced, probabilities = planner.plan(self.today + 17 * 3600)
+        self.assertEqual(forced, [self.main, self.aux])
+
+    def test_goal_met(self):
+        self.main.runtime = 3 * 3600
+        forced, probabilities = self.planner().plan(self.today + 17 * 3600)
+        self.assertNotIn(self.main, forced)
+        self.assertEqual(probabilities[self.main], 1.0)
+
+    def test_no_history(self):
+        forced, probabilities = self.planner().plan(self.today + 12 * 3600)
+        self.assertEqual(forced, [])
+        self.assertEqual(probabilities[self.main], 0)
@@ -0,0 +1,112 @@
+import unittest
+import asyncio
+from unittest.mock import Mock, call
+
+from publisher import StatePublisher
+
+class TestStatePublisher(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock()
+        self.client.publish.return_value = Mock(rc=0)
+
+    def test_publishes_first_value(self):
+        publisher = StatePublisher(self.client, window=0)
+        publisher.publish('a/state', 10, retain=True)
+        self.client.publish.assert_called_once_with('a/state', 10, retain=True)
+        self.assertEqual(publisher.sent, 1)
+        self.assertEqual(publisher.suppressed, 0)
+
+    def test_suppresses_duplicates(self):
+        publisher = StatePublisher(self.client, window=0)
+        publisher.publish('a/state', 10)
+        publisher.publish('a/state', 10)
+        publisher.publish('b/state', 10)
+        publisher.publish('a/state', 11)
+        self.assertEqual(self.client.publish.call_count, 3)
+        self.assertEqual(publisher.sent, 3)
+        self.assertEqual(publisher.suppressed, 1)
+
+    def test_force_bypasses_suppression(self):
+        publisher = StatePublisher(self.client, window=0)
+        publisher.publish('a/state', 10)
+        publisher.publish('a/state', 10, force=True)
+        self.assertEqual(self.client.publish.call_count, 2)
+
+    def test_failed_publish_is_retried(self):
+        publisher = StatePublisher(self.client, window=0)
+        self.client.publish.return_value = Mock(rc=4)
+        publisher.publish('a/state', 10)
+        self.assertEqual(publisher.sent, 0)
+        self.client.publish.return_value = Mock(rc=0)
+        publisher.publish('a/state', 10)
+        self.assertEqual(publisher.sent, 1)
+
+    def test_reset_forgets_values(self):
+        publisher = StatePublisher(self.client, window=0)
+        publisher.publish('a/state', 10)
+        publisher.reset()
+        publisher.publish('a/state', 10)
+        self.assertEqual(self.client.publish.call_count, 2)
+
+    def test_coalesces_bursts(self):
+        publisher = StatePublisher(self.client, window=0.05)
+
+        async def run():
+            publisher.publish('a/state', 'ON')
+            publisher.publish('a/state', 'OFF')
+            publisher.publish('a/state', 'ON')
+            publisher.publish('a/state', 'OFF')
+            self.client.publish.assert_called_once_with('a/state', 'ON', retain=False)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(self.client.publish.call_args_list, [call('a/state', 'ON', retain=False), call('a/state', 'OFF', retain=False)])
+        self.assertEqual(publisher.sent, 2)
+        self.assertEqual(publisher.suppressed, 2)
+
+    def test_coalesced_burst_back_to_last_value(self):
+        publisher = StatePublisher(self.client, window=0.05)
+
+        async def run():
+            publisher.publish('a/state', 'ON')
+            publisher.publish('a/state', 'OFF')
+            publisher.publish('a/state', 'ON')
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.client.publish.assert_called_once()
+        self.assertEqual(publisher.suppressed, 2)
+
+    def test_force_cancels_pending_value(self):
+        publisher = StatePublisher(self.client, window=0.05)
+        loop = asyncio.new_event_loop()
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+
+        async def run():
+            publisher.publish('a/state', 1)
+            publisher.publish('a/state', 2)
+            publisher.publish('a/state', 3, force=True)
+            publisher.publish('a/state', 4)
+            # The timer of 2 was cancelled, 4 waits for a full window after 3
+            await asyncio.sleep(0.03)
+            self.assertEqual(self.client.publish.call_count, 2)
+            await asyncio.sleep(0.05)
+
+        loop.run_until_complete(run())
+        loop.close()
+        self.assertEqual(errors, [])
+        self.assertEqual([c.args[1] for c in self.client.publish.call_args_list], [1, 3, 4])
+
+    def test_reset_sends_pending_values(self):
+        publisher = StatePublisher(self.client, window=0.05)
+
+        async def run():
+            publisher.publish('a/state', 1)
+            publisher.publish('a/state', 2)
+            publisher.reset()
+            self.assertEqual(self.client.publish.call_count, 2)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual([c.args[1] for c in self.client.publish.call_args_list], [1, 2])
@@ -160,6 +160,8 @@ class TestPump(unittest.TestCase):
         self.emulated_time += 200
         pump.turn_off()
         self.assertEqual(pump.goal_progress, 40)
+        # No runtime wanted, nothing left to do
+        self.assertEqual(Pump('idle_pump', 200, 0).goal_progress, 100)
 
 class TestPumpChain(unittest.TestCase):
     def test_chain(self):
@@ -235,3 +237,24 @@ class TestPumpChain(unittest.TestCase):
         start, availability = pump2.can_run(availability)
         self.assertFalse(start)
         self.assertEqual(availability, 100)
+
+class TestPumpState(unittest.TestCase):
+    def test_restore_same_day(self):
+        pump = Pump('main', 200, 3 * 3600)
+        state = pump.get_state()
+        state['runtime'] = 600
+        pump.restore_state(state)
+        self.assertEqual(pump.runtime, 600)
+        self.assertFalse(pump.is_running())
+
+    def test_restore_counts_interrupted_run(self):
+        pump = Pump('main', 200, 3 * 3600)
+        state = dict(pump.get_state(), runtime=600, on_since=1000, seen=1300)
+        pump.restore_state(state)
+        self.assertEqual(pump.runtime, 900)
+        self.assertFalse(pump.is_running())
+
+    def test_restore_ignores_previous_day(self):
+        pump = Pump('main', 200, 3 * 3600)
+        pump.restore_state({'runtime': 600, 'on_since': None, 'date': '2020-01-18'})
+        self.assertEqual(pump.runtime, 0)
@@ -1,4 +1,5 @@
 import unittest
+from unittest.mock import Mock
 
 from pvsystem import PVSystem
 
@@ -49,3 +50,35 @@ class TestPVSystem(unittest.TestCase):
             pvsystem.production = i
         self.assertEqual(pvsystem.consumption, 80)
         self.assertEqual(pvsystem.production, 80)
+
+    def test_configurable_window(self):
+        pvsystem = PVSystem(window=2)
+        for c in [0, 100, 200]:
+            pvsystem.consumption = c
+        self.assertEqual(pvsystem.consumption, 150)
+
+    def test_exponential_averaging(self):
+        pvsystem = PVSystem(averaging='ewma', window=3)
+        for p in [100, 200, 200]:
+            pvsystem.production = p
+        self.assertEqual(pvsystem.production, 175)
+        del pvsystem.production
+        self.assertEqual(pvsystem.production, 0)
+
+    def test_notify_readings(self):
+        pvsystem = PVSystem()
+        callback = Mock()
+        pvsystem.add_reading_callback(callback)
+        pvsystem.notify_readings(200, 100)
+        callback.assert_called_once_with(pvsystem, 200, 100)
+
+    def test_reconfigure_keeps_average(self):
+        pvsystem = PVSystem()
+        for p in [100, 200, 300]:
+            pvsystem.production = p
+        self.assertEqual(pvsystem.reconfigure({'averaging': 'sma', 'window': 5}), [])
+        self.assertEqual(pvsystem.production, 200)
+        pvsystem.reconfigure({'averaging': 'sma', 'window': 2})
+        self.assertEqual(pvsystem.production, 200)
+        pvsystem.production = 400
+        self.assertEqual(pvsystem.production, 300)
@@ -0,0 +1,133 @@
+import unittest
+import io
+import os
+import tempfile
+import time
+from array import array
+
+from pump import Pump
+from pvsystem import PVSystem
+from recorder import Recorder, DayFile
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+        self.day = time.mktime(time.strptime("2020-01-18 00:00:00", "%Y-%m-%d %H:%M:%S"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_query_returns_columns(self):
+        recorder = Recorder(self.directory, keep_days=100000)
+        for i in range(10):
+            recorder.append(self.day + i * 60, 1000 + i, 500, i % 2)
+        columns = recorder.query(self.day + 120, self.day + 300)
+        self.assertIsInstance(columns['timestamp'], array)
+        self.assertEqual(list(columns['timestamp']), [self.day + 120, self.day + 180, self.day + 240])
+        self.assertEqual(list(columns['production']), [1002, 1003, 1004])
+        self.assertEqual(list(columns['consumption']), [500, 500, 500])
+        self.assertEqual(list(columns['pumps']), [0, 1, 0])
+        recorder.close()
+
+    def test_ring_overwrites_oldest(self):
+        recorder = Recorder(self.directory, capacity=5, keep_days=100000)
+        for i in range(8):
+            recorder.append(self.day + i, i, 0)
+        columns = recorder.query(self.day, self.day + 3600)
+        self.assertEqual(list(columns['production']), [3, 4, 5, 6, 7])
+        recorder.close()
+
+    def test_iter_raw_unwraps_ring(self):
+        recorder = Recorder(self.directory, capacity=5, keep_days=100000)
+        for i in range(8):
+            recorder.append(self.day + i, i, 0, i)
+        chunks = list(recorder.iter_raw(self.day + 4, self.day + 7))
+        self.assertEqual([version for version, data in chunks], [2])
+        records = list(DayFile.record.iter_unpack(chunks[0][1]))
+        self.assertEqual(records, [(self.day + i, i, 0, i) for i in (4, 5, 6)])
+        self.assertEqual(list(recorder.iter_raw(self.day + 100, self.day + 200)), [])
+        recorder.close()
+
+    def test_file_per_day_and_reopen(self):
+        recorder = Recorder(self.directory, keep_days=100000)
+        recorder.append(self.day + 100, 1, 0)
+        recorder.append(self.day + 86400 + 100, 2, 0)
+        recorder.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['2020-01-18.rec', '2020-01-19.rec'])
+        recorder = Recorder(self.directory, keep_days=100000)
+        recorder.append(self.day + 86400 + 200, 3, 0)
+        columns = recorder.query(self.day, self.day + 2 * 86400)
+        self.assertEqual(list(columns['production']), [1, 2, 3])
+        recorder.close()
+
+    def test_expires_old_days(self):
+        recorder = Recorder(self.directory, keep_days=1)
+        recorder.append(self.day, 1, 0)
+        recorder.append(self.day + 2 * 86400, 2, 0)
+        recorder.close()
+        self.assertEqual(os.listdir(self.directory), ['2020-01-20.rec'])
+
+    def test_rejects_foreign_files(self):
+        filename = os.path.join(self.directory, 'junk.rec')
+        with open(filename, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            DayFile(filename, 10)
+
+    def test_reads_version_1_files(self):
+        filename = os.path.join(self.directory, '2020-01-18.rec')
+        with open(filename, 'wb') as f:
+            f.write(DayFile.header.pack(DayFile.magic, 1, 20, 10, 1).ljust(DayFile.header_size, b'\0'))
+            f.write(DayFile.records[1].pack(self.day + 60, 1000, 500, 3).ljust(200, b'\0'))
+        recorder = Recorder(self.directory, capacity=10, keep_days=100000)
+        recorder.append(self.day + 120, 1100, 600, 1)
+        columns = recorder.query(self.day, self.day + 3600)
+        self.assertEqual(list(columns['production']), [1000, 1100])
+        self.assertEqual(list(columns['pumps']), [3, 1])
+        recorder.close()
+
+    def test_records_up_to_64_pumps(self):
+        recorder = Recorder(self.directory)
+        device = PVSystem()
+        pumps = [Pump(f'p{i}', 100, 3600) for i in range(64)]
+        recorder.attach(device, pumps)
+        pumps[63].turn_on()
+        columns = recorder.query(time.time() - 10, time.time() + 1)
+        self.assertEqual(list(columns['pumps']), [1 << 63])
+        recorder.close()
+        with self.assertRaises(ValueError):
+            Recorder(self.directory).attach(device, pumps + [Pump('p64', 100, 3600)])
+
+    def test_recording_errors_do_not_reach_pumps(self):
+        # Today's file was created before the upgrade and has a 32 bits mask
+        filename = os.path.join(self.directory, f'{time.strftime("%Y-%m-%d")}.rec')
+        with open(filename, 'wb') as f:
+            f.write(DayFile.header.pack(DayFile.magic, 1, 20, 10, 0).ljust(DayFile.header_size + 200, b'\0'))
+        recorder = Recorder(self.directory, capacity=10)
+        device = PVSystem()
+        pumps = [Pump(f'p{i}', 100, 3600) for i in range(40)]
+        recorder.attach(device, pumps)
+        with self.assertLogs('recorder', level='ERROR'):
+            pumps[35].turn_on()
+        self.assertTrue(pumps[35].is_running())
+        recorder.close()
+
+    def test_attach_records_readings_and_pump_states(self):
+        recorder = Recorder(self.directory)
+        device = PVSystem()
+        pumps = [Pump('main', 1000, 3600), Pump('aux', 200, 3600)]
+        recorder.attach(device, pumps)
+        start = time.time()
+        device.notify_readings(2000, 500)
+        pumps[1].turn_on()
+        device.notify_readings(2100, 700)
+        columns = recorder.query(start - 1, time.time() + 1)
+        self.assertEqual(list(columns['production']), [2000, 0, 2100])
+        self.assertEqual(list(columns['pumps']), [0, 2, 2])
+        out = io.StringIO()
+        self.assertEqual(recorder.export_csv(start - 1, time.time() + 1, out), 3)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'time,production,consumption,main,aux')
+        self.assertTrue(lines[3].endswith(',2100,700,0,1'))
+        recorder.close()
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from config import Config
+from reload import Reloader
+
+CONFIG = {
+    'state': {'enabled': False},
+    'scheduler': {'min_interval': 10},
+    'pumps': [
+        {'name': 'Main', 'power': 1650, 'runtime': 3, 'gpio': 8},
+        {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10, 'chained': 'Main'},
+    ],
+}
+
+class TestReloader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'config.yaml')
+        self.write(CONFIG)
+        self.config = Config(self.filename)
+        self.groups = self.config.load_groups()
+        self.reloader = Reloader(self.config, self.groups)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, config):
+        with open(self.filename, 'w') as f:
+            yaml.dump(config, f)
+
+    def test_applies_changes_in_place(self):
+        group = self.groups[0]
+        main, polaris = group.pumps
+        main.turn_on()
+        main.runtime = 600
+        self.assertIsNone(group.controller.guard)
+        self.write({**CONFIG, 'scheduler': {'min_interval': 5}, 'cycling': {'deadband': 200}, 'pumps': [
+            {'name': 'Main', 'power': 1500, 'runtime': 4, 'gpio': 8},
+            {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10},
+        ]})
+        self.assertTrue(self.reloader.reload())
+        self.assertEqual(group.pumps, [main, polaris])
+        self.assertEqual((main.power, main.desired_runtime), (1500, 4 * 3600))
+        self.assertTrue(main.is_running())
+        self.assertEqual(main.runtime, 600)
+        self.assertEqual(polaris.upstreams, [])
+        self.assertEqual(group.controller.graph.start_order, [main, polaris])
+        self.assertEqual(group.controller.scheduler.min_interval, 5)
+        self.assertEqual(group.controller.guard.deadband, 200)
+        guard = group.controller.guard
+        guard.debt = 50
+        self.write({**CONFIG, 'scheduler': {'min_interval': 5}, 'cycling': {'deadband': 300, 'energy_debt': 100}})
+        self.assertTrue(self.reloader.reload())
+        self.assertIs(group.controller.guard, guard)
+        self.assertEqual((guard.deadband, guard.energy_debt, guard.debt), (300, 100, 50))
+        self.write({**CONFIG, 'scheduler': {'min_interval': 5}})
+        self.assertTrue(self.reloader.reload())
+        self.assertIsNone(group.controller.guard)
+
+    def test_zero_runtime(self):
+        main = self.groups[0].pumps[0]
+        progress = []
+        main.add_update_callback(lambda pump, value: progress.append(value))
+        self.write({**CONFIG, 'pumps': [
+            {'name': 'Main', 'power': 1650, 'runtime': 0, 'gpio': 8},
+            {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10, 'chained': 'Main'},
+        ]})
+        self.assertTrue(self.reloader.reload())
+        self.assertEqual(main.desired_runtime, 0)
+        self.assertEqual(progress, [100])
+
+    def test_invalid_configuration_is_ignored(self):
+        main = self.groups[0].pumps[0]
+        self.write({**CONFIG, 'pumps': [{'name': 'Main', 'power': 'lots', 'runtime': 3, 'gpio': 8}]})
+        with self.assertLogs('reload', level='ERROR') as logs:
+            self.assertFalse(self.reloader.reload())
+        self.assertIn('pumps[0].power', logs.output[0])
+        with open(self.filename, 'w') as f:
+            f.write('pumps: [\n')
+        with self.assertLogs('reload', level='ERROR'):
+            self.assertFalse(self.reloader.reload())
+        self.assertEqual(main.power, 1650)
+
+    def test_rejects_fractional_sample_window(self):
+        main = self.groups[0].pumps[0]
+        pvsystem = {'type': 'mqtt', 'production': {'topic': 'solar'}, 'consumption': {'topic': 'house'}, 'window': 2.5}
+        self.write({**CONFIG, 'pvsystem': pvsystem, 'pumps': [
+            {'name': 'Main', 'power': 1500, 'runtime': 3, 'gpio': 8},
+            {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10, 'chained': 'Main'},
+        ]})
+        with self.assertLogs('reload', level='ERROR') as logs:
+            self.assertFalse(self.reloader.reload())
+        self.assertIn('pvsystem.window', logs.output[0])
+        self.assertEqual(main.power, 1650)
+        # Seconds of the time weighted average need not be whole
+        self.write({**CONFIG, 'pvsystem': {**pvsystem, 'averaging': 'time'}})
+        self.assertTrue(self.reloader.reload())
+
+    def test_rejects_mqtt_meter_without_consumption(self):
+        self.write({**CONFIG, 'pvsystem': {'type': 'mqtt', 'production': {'topic': 'solar'}}})
+        with self.assertLogs('reload', level='ERROR') as logs:
+            self.assertFalse(self.reloader.reload())
+        self.assertIn('consumption or grid', logs.output[0])
+
+    def test_rejects_dependency_cycles(self):
+        self.write({**CONFIG, 'pumps': [
+            {'name': 'Main', 'power': 1650, 'runtime': 3, 'gpio': 8, 'chained': 'Polaris'},
+            {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10, 'chained': 'Main'},
+        ]})
+        with self.assertLogs('reload', level='ERROR'):
+            self.assertFalse(self.reloader.reload())
+        self.assertEqual(self.groups[0].pumps[0].upstreams, [])
+
+    def test_warns_about_changes_needing_restart(self):
+        self.write({**CONFIG, 'state': {'enabled': False, 'directory': 'elsewhere'}, 'pumps': [
+            {'name': 'Main', 'power': 1650, 'runtime': 3, 'gpio': 12},
+            {'name': 'Polaris', 'power': 1100, 'runtime': 0.5, 'gpio': 10, 'chained': 'Main'},
+        ]})
+        with self.assertLogs('reload', level='WARNING') as logs:
+            self.assertTrue(self.reloader.reload())
+        self.assertIn('pumps.Main.gpio', logs.output[-1])
+        self.assertIn('state', logs.output[-1])
+        self.write({**CONFIG, 'pumps': CONFIG['pumps'][:1]})
+        with self.assertLogs('reload', level='WARNING') as logs:
+            self.reloader.reload()
+        self.assertIn('pipump: pumps', logs.output[-1])
+        self.assertEqual(len(self.groups[0].pumps), 2)
+
+    def test_mqtt_meter_inherits_broker(self):
+        meter = {'type': 'mqtt', 'production': {'topic': 'solar'}, 'consumption': {'topic': 'house'}}
+        config = {**CONFIG, 'mqtt': {'uid': 'a', 'host': 'broker'}, 'pvsystem': meter}
+        self.write(config)
+        self.config = Config(self.filename)
+        self.groups = self.config.load_groups()
+        self.reloader = Reloader(self.config, self.groups)
+        with self.assertNoLogs('reload', level='WARNING'):
+            self.assertTrue(self.reloader.reload())
+        self.write({**config, 'mqtt': {'uid': 'a', 'host': 'other'}})
+        with self.assertLogs('reload', level='WARNING') as logs:
+            self.assertTrue(self.reloader.reload())
+        self.assertIn('pvsystem.host', logs.output[-1])
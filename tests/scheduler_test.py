@@ -0,0 +1,82 @@
+import unittest
+import asyncio
+
+from pump import Pump
+from pvsystem import PVSystem
+from scheduler import Scheduler
+
+class TestScheduler(unittest.TestCase):
+    def test_slow_when_nothing_can_change(self):
+        scheduler = Scheduler(min_interval=10, max_interval=120)
+        pump = Pump('test_pump', 1000, 3600)
+        pump.runtime = 3600
+        self.assertEqual(scheduler.next_delay([pump], 500), 120)
+
+    def test_fast_near_start_threshold(self):
+        scheduler = Scheduler(min_interval=10, max_interval=120, margin=1000)
+        pump = Pump('test_pump', 1000, 3600)
+        self.assertEqual(scheduler.next_delay([pump], 1000), 10)
+        self.assertEqual(scheduler.next_delay([pump], 500), 65)
+        self.assertEqual(scheduler.next_delay([pump], -2000), 120)
+
+    def test_fast_near_stop_threshold(self):
+        scheduler = Scheduler(min_interval=10, max_interval=120, margin=1000)
+        pump = Pump('test_pump', 1000, 3600)
+        pump.turn_on()
+        self.assertEqual(scheduler.next_delay([pump], -50), 10)
+        self.assertEqual(scheduler.next_delay([pump], 500), 65)
+
+    def test_wakes_at_runtime_deadline(self):
+        scheduler = Scheduler(min_interval=10, max_interval=120)
+        pump = Pump('test_pump', 1000, 3600)
+        pump.runtime = 3570
+        pump.turn_on()
+        self.assertAlmostEqual(scheduler.next_delay([pump], 5000, now=pump.on_since), 30)
+        self.assertEqual(scheduler.next_delay([pump], 5000, now=pump.on_since + 40), 1)
+
+    def test_chained_pump_threshold_requires_upstream(self):
+        scheduler = Scheduler(min_interval=10, max_interval=120, margin=1000)
+        main = Pump('main_pump', 2000, 3600)
+        main.runtime = 3600
+        aux = Pump('aux_pump', 100, 3600)
+        aux.chain(main)
+        self.assertEqual(scheduler.next_delay([main, aux], 100), 120)
+
+    def test_readings_outside_band_wake_up(self):
+        scheduler = Scheduler()
+        pump = Pump('test_pump', 1000, 3600)
+        scheduler.next_delay([pump], 200)
+        device = PVSystem()
+        device.production = 800
+        scheduler.on_readings(device, device.production, 0)
+        self.assertFalse(scheduler._wakeup.is_set())
+        device.production = 2000
+        scheduler.on_readings(device, device.production, 0)
+        self.assertTrue(scheduler._wakeup.is_set())
+
+    def test_wait_returns_early_on_wakeup(self):
+        scheduler = Scheduler(min_interval=0)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, scheduler._wakeup.set)
+            start = loop.time()
+            await scheduler.wait(5)
+            return loop.time() - start
+
+        self.assertLess(asyncio.run(run()), 1)
+
+    def test_wait_honors_min_interval(self):
+        scheduler = Scheduler(min_interval=0.2)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            await scheduler.wait(0)
+            loop.call_later(0.01, scheduler._wakeup.set)
+            start = loop.time()
+            await scheduler.wait(5)
+            return loop.time() - start
+
+        elapsed = asyncio.run(run())
+        self.assertGreaterEqual(elapsed, 0.15)
+        self.assertLess(elapsed, 1)
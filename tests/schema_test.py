@@ -0,0 +1,52 @@
+import unittest
+
+from schema import validate, merge, ConfigError
+
+PUMP = {'name': 'Main', 'power': 1650, 'runtime': 3, 'gpio': 8}
+
+class TestSchema(unittest.TestCase):
+    def assertInvalid(self, config, *messages):
+        with self.assertRaises(ConfigError) as cm:
+            validate(config)
+        for message in messages:
+            self.assertIn(message, str(cm.exception))
+
+    def test_valid_configuration(self):
+        validate({'mqtt': {'uid': '00000000de242b87', 'host': 'broker'},
+                  'pvsystem': {'type': 'envoy', 'ip': '192.168.10.12', 'user': 'u', 'password': 'p', 'serial': 1234567890},
+                  'scheduler': None,
+                  'pumps': [PUMP, {**PUMP, 'name': 'Polaris', 'chained': 'Main'}, {**PUMP, 'name': 'Heater', 'chained': ['Main', 'Polaris']}],
+                  'logging': {'levels': {'envoy': 'INFO'}},
+                  'reload': False})
+
+    def test_reports_paths_of_all_errors(self):
+        self.assertInvalid({'pumps': [{**PUMP, 'power': '1650W'}, {'name': 'Polaris', 'power': 1100, 'runtime': 1}], 'scheduler': {'min_intreval': 10}},
+                           'pumps[0].power: expected int or float, got str', 'pumps[1].gpio: missing', 'scheduler.min_intreval: unknown option')
+
+    def test_rejects_booleans_as_numbers(self):
+        self.assertInvalid({'pumps': [{**PUMP, 'gpio': True}]}, 'pumps[0].gpio')
+
+    def test_checks_values(self):
+        self.assertInvalid({'pumps': [{**PUMP, 'power': 0}]}, 'pumps[0].power: invalid value 0')
+        self.assertInvalid({'pumps': [PUMP], 'logging': {'levels': {'envoy': 'LOUD'}}}, 'logging.levels')
+
+    def test_pumps_are_required(self):
+        self.assertInvalid({'mqtt': {'uid': 'a'}}, 'pumps: missing')
+
+    def test_groups_are_checked_once_merged(self):
+        validate({'mqtt': {'host': 'broker'}, 'pumps': [PUMP], 'http_workers': 2,
+                  'groups': [{'name': 'pool', 'mqtt': {'uid': 'a'}}, {'name': 'spa', 'mqtt': {'uid': 'b'}}]})
+        self.assertInvalid({'mqtt': {'host': 'broker'}, 'groups': [{'name': 'pool', 'mqtt': {'uid': 'a'}}, {'mqtt': {}, 'pumps': [PUMP], 'logging': {}}]},
+                           'groups[0].pumps: missing', 'groups[1].name: missing', 'groups[1].mqtt.uid: missing', 'groups[1].logging: unknown option')
+
+    def test_merge(self):
+        merged = merge({'mqtt': {'host': 'broker', 'uid': 'a'}, 'pumps': [PUMP], 'metrics': {}, 'groups': []}, {'name': 'pool', 'mqtt': {'uid': 'b'}})
+        self.assertEqual(merged, {'mqtt': {'host': 'broker', 'uid': 'b'}, 'pumps': [PUMP], 'name': 'pool'})
+
+    def test_pvsystem_types(self):
+        validate({'pumps': [PUMP], 'pvsystem': {'type': 'mqtt', 'production': {'topic': 'solar', 'path': '$.ENERGY.Power'}, 'grid': {'topic': 'meter', 'scale': 1000}}})
+        self.assertInvalid({'pumps': [PUMP], 'pvsystem': {'type': 'mqtt', 'ip': '192.168.10.12', 'grid': {'topic': 'meter', 'path': '$.a[b]'}}},
+                           'pvsystem.production: missing', 'pvsystem.ip: unknown option', 'pvsystem.grid.path: invalid value')
+        self.assertInvalid({'pumps': [PUMP], 'pvsystem': {'type': 'fronius'}}, 'pvsystem.type: expected one of envoy, mqtt, got fronius')
+        self.assertInvalid({'pumps': [PUMP], 'pvsystem': {'type': 'mqtt', 'production': {'topic': 'solar'}}},
+                           'pvsystem: a consumption or grid topic is needed')
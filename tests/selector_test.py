@@ -0,0 +1,20 @@
+import unittest
+
+from selector import Selector, compile_path
+
+class TestSelector(unittest.TestCase):
+    def test_compile_path(self):
+        self.assertEqual(compile_path('$'), [])
+        self.assertEqual(compile_path('$.ENERGY.Power'), ['ENERGY', 'Power'])
+        self.assertEqual(compile_path("$['SML'][\"Power curr\"][-1]"), ['SML', 'Power curr', -1])
+        self.assertEqual(compile_path('meters[0].w'), ['meters', 0, 'w'])
+        with self.assertRaises(ValueError):
+            compile_path('$.a[b]')
+
+    def test_value(self):
+        selector = Selector({'topic': 't', 'path': '$.ENERGY.Power[1]'})
+        self.assertEqual(selector.value(b'{"ENERGY": {"Power": [10, 250]}}'), 250)
+        self.assertEqual(Selector({'topic': 't', 'scale': 1000}).value(b'1.5'), 1500)
+        for payload in (b'{"ENERGY": {}}', b'{"ENERGY": {"Power": [1, "x"]}}', b'garbage', b'{"ENERGY": {"Power": [1, true]}}'):
+            with self.assertRaises((ValueError, KeyError, IndexError, TypeError)):
+                selector.value(payload)
@@ -0,0 +1,76 @@
+import unittest
+import time
+from datetime import date
+
+from pump import Pump
+from clock import VirtualClock
+from allocator import Allocator
+from scheduler import Scheduler
+from controller import Controller
+from cycling import CycleGuard
+from simulator import Simulator, TraceSource, synthetic_day, report
+
+def make_pumps(clock):
+    main = Pump('main', 1650, 3 * 3600, clock=clock)
+    aux = Pump('aux', 1100, 1800, clock=clock)
+    aux.chain(main)
+    return [main, aux]
+
+class TestVirtualClock(unittest.TestCase):
+    def test_advance(self):
+        clock = VirtualClock(1000)
+        self.assertEqual(clock.time(), 1000)
+        clock.advance(60)
+        self.assertEqual(clock.time(), 1060)
+        clock.set(86400 * 365)
+        self.assertEqual(clock.today(), date(1971, 1, 1))
+
+    def test_drives_pump(self):
+        clock = VirtualClock(time.mktime(time.strptime("2020-01-18 23:30:00", "%Y-%m-%d %H:%M:%S")))
+        pump = Pump('main', 1000, 3600, clock=clock)
+        pump.turn_on()
+        clock.advance(600)
+        self.assertEqual(pump.goal_progress, 17)
+        clock.advance(3600)
+        pump.update()
+        # New day, counters were reset
+        self.assertEqual(pump.runtime, 0)
+        self.assertFalse(pump.is_running())
+
+class TestTraceSource(unittest.TestCase):
+    def test_replays_trace_with_pump_load(self):
+        import asyncio
+        clock = VirtualClock(0)
+        pumps = make_pumps(clock)
+        source = TraceSource(([0, 60, 120], [1000, 2000, 3000], [100, 200, 300]), pumps, clock, window=1)
+        self.assertEqual(asyncio.run(source.update()), 900)
+        clock.set(90)
+        pumps[0].turn_on()
+        self.assertEqual(asyncio.run(source.update()), 2000 - 200 - 1650)
+
+class TestSimulator(unittest.TestCase):
+    def test_sunny_day(self):
+        start = time.perf_counter()
+        results = Simulator(make_pumps).run([synthetic_day(date(2020, 6, 1), peak=5000, seed=1)])
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(results['days'], 1)
+        self.assertEqual(results['goal_attainment'], {'main': 1.0, 'aux': 1.0})
+        self.assertGreater(results['pumps_energy'], (1650 * 3 + 1100 * 0.5) / 1000 - 0.1)
+        self.assertGreaterEqual(results['actuations'], 4)
+        self.assertIn('goals met main 100%', report('default', results))
+
+    def test_cycle_guard_saves_actuations(self):
+        traces = [synthetic_day(date(2020, 6, d), peak=3000, clouds=0.8, seed=d) for d in range(1, 6)]
+        def guarded(pumps, device, clock):
+            guard = CycleGuard(deadband=200, min_run=600, min_rest=300, energy_debt=100, clock=clock)
+            return Controller(pumps, device, Allocator(), Scheduler(), clock=clock, guard=guard)
+        plain = Simulator(make_pumps).run(traces)
+        results = Simulator(make_pumps, guarded).run(traces)
+        self.assertLess(results['actuations_per_day'], plain['actuations_per_day'])
+
+    def test_dark_day(self):
+        results = Simulator(make_pumps).run([synthetic_day(date(2020, 12, 1), peak=0, seed=1)])
+        self.assertEqual(results['goal_attainment'], {'main': 0.0, 'aux': 0.0})
+        self.assertEqual(results['pumps_energy'], 0)
+        self.assertEqual(results['actuations'], 0)
+        self.assertGreater(results['grid_import'], 0)
@@ -0,0 +1,86 @@
+import unittest
+import os
+import time
+import tempfile
+from unittest.mock import patch
+
+from pump import Pump
+from statestore import StateStore
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def journal(self):
+        with open(os.path.join(self.directory, 'state.journal')) as f:
+            return f.readlines()
+
+    def test_load_empty(self):
+        store = StateStore(self.directory)
+        self.assertEqual(store.load(), {})
+
+    def test_replay_journal(self):
+        store = StateStore(self.directory)
+        store.record('main', {'runtime': 10, 'on_since': None, 'date': '2020-01-18'}, now=1000)
+        store.record('main', {'runtime': 20, 'on_since': None, 'date': '2020-01-18'}, now=1010)
+        store.record('aux', {'runtime': 5, 'on_since': 1005, 'date': '2020-01-18'}, now=1010)
+        store.close()
+        store = StateStore(self.directory)
+        state = store.load()
+        self.assertEqual(state['main']['runtime'], 20)
+        self.assertEqual(state['aux'], {'runtime': 5, 'on_since': 1005, 'date': '2020-01-18', 'seen': 1010})
+
+    def test_ignores_torn_entry(self):
+        store = StateStore(self.directory)
+        store.record('main', {'runtime': 10}, now=1000)
+        store.close()
+        with open(os.path.join(self.directory, 'state.journal'), 'a') as f:
+            f.write('{"pump":"main","runt')
+        self.assertEqual(StateStore(self.directory).load()['main']['runtime'], 10)
+
+    def test_compaction(self):
+        store = StateStore(self.directory, compact_every=3)
+        for i in range(4):
+            store.record('main', {'runtime': i}, now=1000 + i)
+        store.close()
+        self.assertEqual(len(self.journal()), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'state.json')))
+        self.assertEqual(StateStore(self.directory).load()['main']['runtime'], 3)
+
+    def test_batched_fsync(self):
+        store = StateStore(self.directory, sync_interval=60)
+        with patch('statestore.os.fsync') as mock_fsync:
+            store.record('main', {'runtime': 1}, now=1000)
+            store.record('main', {'runtime': 2}, now=1010)
+            store.record('main', {'runtime': 3}, now=1020)
+            self.assertEqual(mock_fsync.call_count, 1)
+            store.record('main', {'runtime': 4}, now=1030, sync=True)
+            self.assertEqual(mock_fsync.call_count, 2)
+            store.record('main', {'runtime': 5}, now=1100)
+            self.assertEqual(mock_fsync.call_count, 3)
+        store.close()
+
+    def test_attach_restores_and_records_pumps(self):
+        store = StateStore(self.directory)
+        pump = Pump('main', 200, 3 * 3600)
+        store.attach([pump])
+        pump.turn_on()
+        pump.runtime = 100
+        pump.update()
+        store.close()
+        state = StateStore(self.directory).load()['main']
+        self.assertEqual(state['runtime'], 100)
+        self.assertIsNotNone(state['on_since'])
+
+    def test_startup_time(self):
+        store = StateStore(self.directory, compact_every=100000)
+        for i in range(10000):
+            store.record(f'pump{i % 10}', {'runtime': i, 'on_since': None, 'date': '2020-01-18'}, now=1000 + i)
+        store.close()
+        start = time.perf_counter()
+        StateStore(self.directory).load()
+        self.assertLess(time.perf_counter() - start, 0.5)
@@ -0,0 +1,86 @@
+import unittest
+import os
+import json
+import base64
+import tempfile
+
+from tokenstore import TokenStore
+
+def make_token(iat, exp):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    return f'{encode({"alg": "ES256"})}.{encode({"iat": iat, "exp": exp})}.signature'
+
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'token')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_initial_values(self):
+        store = TokenStore()
+        self.assertEqual(store.token, '')
+        self.assertFalse(store.is_valid(1000))
+        self.assertTrue(store.needs_refresh(1000))
+
+    def test_decode_claims(self):
+        self.assertEqual(TokenStore.decode_claims(make_token(1000, 5000)), (1000, 5000))
+        self.assertEqual(TokenStore.decode_claims('not a jwt'), (0, 0))
+        self.assertEqual(TokenStore.decode_claims('a.!!!.c'), (0, 0))
+
+    def test_refresh_before_expiry(self):
+        store = TokenStore()
+        store.update(make_token(1000, 5000))
+        self.assertTrue(store.is_valid(2000))
+        self.assertFalse(store.needs_refresh(2000))
+        # Last quarter of the lifetime
+        self.assertTrue(store.needs_refresh(4000))
+        self.assertTrue(store.is_valid(4000))
+        self.assertFalse(store.is_valid(5000))
+
+    def test_undecodable_token_is_trusted(self):
+        store = TokenStore()
+        store.update('opaque')
+        self.assertTrue(store.is_valid(1000))
+        self.assertFalse(store.needs_refresh(1000))
+        store.invalidate()
+        self.assertFalse(store.is_valid(1000))
+
+    def test_invalidate(self):
+        store = TokenStore()
+        store.update(make_token(1000, 5000))
+        store.invalidate()
+        self.assertFalse(store.is_valid(2000))
+        self.assertTrue(store.needs_refresh(2000))
+
+    def test_failure_backs_off(self):
+        store = TokenStore(min_backoff=60, max_backoff=200)
+        store.failed(1000)
+        self.assertFalse(store.needs_refresh(1059))
+        self.assertTrue(store.needs_refresh(1060))
+        store.failed(1060)
+        self.assertFalse(store.needs_refresh(1179))
+        self.assertTrue(store.needs_refresh(1180))
+        store.failed(1180)
+        # Capped at max_backoff
+        self.assertTrue(store.needs_refresh(1380))
+        store.update(make_token(1000, 5000))
+        store.invalidate()
+        self.assertTrue(store.needs_refresh(1381))
+
+    def test_persisted_across_instances(self):
+        token = make_token(1000, 5000)
+        store = TokenStore(self.filename)
+        store.update(token)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o600)
+        store = TokenStore(self.filename)
+        self.assertEqual(store.token, token)
+        self.assertEqual(store.expires, 5000)
+        self.assertTrue(store.is_valid(2000))
+
+    def test_missing_file(self):
+        store = TokenStore(self.filename)
+        self.assertEqual(store.token, '')
+        self.assertFalse(os.path.exists(self.filename))
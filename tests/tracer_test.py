@@ -0,0 +1,81 @@
+import os
+import json
+import asyncio
+import unittest
+import tempfile
+
+from pump import Pump
+from clock import VirtualClock
+from pvsystem import PVSystem
+from allocator import Allocator
+from scheduler import Scheduler
+from controller import Controller
+from tracer import Tracer, null_tracer, null_span
+
+class FixedSource(PVSystem):
+    async def update(self):
+        return 2000
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'trace.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_ticks(self, tracer, ticks=1):
+        clock = VirtualClock(1579309325)
+        pump = Pump('main', 1650, 3 * 3600, clock=clock)
+        def publish(pump, state):
+            # Stands for the MQTT client publishing from within the tick
+            with tracer.span('mqtt.publish'):
+                pass
+        pump.add_state_callback(publish)
+        controller = Controller([pump], FixedSource(), Allocator(), Scheduler(), clock=clock, tracer=tracer)
+        for i in range(ticks):
+            asyncio.run(controller.tick())
+            clock.advance(60)
+        tracer.close()
+
+    def records(self):
+        with open(self.filename) as f:
+            return [json.loads(line) for line in f]
+
+    def test_writes_tick_spans(self):
+        self.run_ticks(Tracer(self.filename, name='pool'), 2)
+        records = self.records()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['group'], 'pool')
+        spans = {s['name']: s for s in records[0]['spans']}
+        self.assertEqual(set(spans), {'pump.update', 'device.update', 'allocate', 'actuate', 'schedule', 'mqtt.publish'})
+        self.assertEqual(spans['device.update']['parent'], 'tick')
+        self.assertEqual(spans['mqtt.publish']['parent'], 'actuate')
+        self.assertLessEqual(sum(s['duration'] for s in records[0]['spans'] if s['parent'] == 'tick'), records[0]['duration'])
+
+    def test_sampling(self):
+        self.run_ticks(Tracer(self.filename, sample=0), 3)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_spans_outside_ticks_are_free(self):
+        tracer = Tracer(self.filename)
+        self.assertIs(tracer.span('mqtt.publish'), null_span)
+        self.assertIs(null_tracer.span('mqtt.publish'), null_span)
+
+    def test_cprofile_report(self):
+        report = os.path.join(self.directory.name, 'profile.txt')
+        self.run_ticks(Tracer(self.filename, sample=0, profile='cprofile', profile_ticks=2, report=report), 3)
+        with open(report) as f:
+            content = f.read()
+        self.assertIn('cProfile of 2 control ticks', content)
+        self.assertIn('allocate', content)
+
+    def test_tracemalloc_report(self):
+        report = os.path.join(self.directory.name, 'profile.txt')
+        self.run_ticks(Tracer(self.filename, sample=0, profile='tracemalloc', profile_ticks=2, report=report), 2)
+        with open(report) as f:
+            self.assertIn('Memory allocated during 2 control ticks', f.read())
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(ValueError):
+            Tracer(self.filename, profile='perf')
@@ -0,0 +1,67 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from watcher import FileWatcher
+
+class TestFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'config.yaml')
+        with open(self.filename, 'w') as f:
+            f.write('a: 1\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content, rename=False):
+        target = self.filename + '.tmp' if rename else self.filename
+        with open(target, 'w') as f:
+            f.write(content)
+        if rename:
+            os.replace(target, self.filename)
+
+    def watch(self, use_inotify, steps):
+        callback = Mock()
+        async def run():
+            watcher = FileWatcher(self.filename, callback, interval=0.02, delay=0.05)
+            task = asyncio.get_running_loop().create_task(watcher.task(use_inotify))
+            await asyncio.sleep(0.05)
+            for step in steps:
+                step()
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(run())
+        return callback
+
+    def test_inotify_debounces_writes(self):
+        callback = self.watch(True, [lambda: self.write('a: 2\n'), lambda: self.write('a: 3\n'), lambda: self.write('a: 4\n', rename=True)])
+        self.assertEqual(callback.call_count, 1)
+
+    def test_inotify_ignores_other_files(self):
+        other = os.path.join(self.directory.name, 'state.json')
+        callback = self.watch(True, [lambda: open(other, 'w').close()])
+        callback.assert_not_called()
+
+    def test_polling_fallback(self):
+        callback = self.watch(False, [lambda: self.write('a: 22\n')])
+        self.assertEqual(callback.call_count, 1)
+        callback = self.watch(False, [])
+        callback.assert_not_called()
+
+    def test_callback_errors_are_logged(self):
+        callback = Mock(side_effect=ValueError('boom'))
+        async def run():
+            watcher = FileWatcher(self.filename, callback, interval=0.02, delay=0.01)
+            task = asyncio.get_running_loop().create_task(watcher.task())
+            await asyncio.sleep(0.05)
+            self.write('a: 2\n')
+            await asyncio.sleep(0.1)
+            task.cancel()
+        with self.assertLogs('watcher', level='ERROR'):
+            asyncio.run(run())
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TokenStore():
+    def __init__(self, filename=None, refresh_ratio=0.25, min_backoff=60, max_backoff=3600):
+        self._filename = filename
+        # Refresh once less than this fraction of the token lifetime remains
+        self._refresh_ratio = refresh_ratio
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._failures = 0
+        self._retry_after = 0
+        self._rejected = False
+        self.token = ''
+        self.issued = 0
+        self.expires = 0
+        self.load()
+
+    @staticmethod
+    def decode_claims(token):
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            return claims.get('iat', 0), claims.get('exp', 0)
+        except (IndexError, ValueError, AttributeError):
+            return 0, 0
+
+    def load(self):
+        if not self._filename:
+            return
+        try:
+            with open(self._filename, 'r') as f:
+                token = f.read().strip()
+        except OSError:
+            return
+        if token:
+            self.token = token
+            self.issued, self.expires = self.decode_claims(token)
+            logger.debug('loaded cached Envoy token expiring at %s', time.ctime(self.expires))
+
+    def save(self):
+        if not self._filename:
+            return
+        tmp = self._filename + '.tmp'
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.token)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._filename)
+        except OSError as e:
+            logger.warning('failed persisting Envoy token to %s: %s', self._filename, e)
+
+    def update(self, token):
+        self.token = token
+        self.issued, self.expires = self.decode_claims(token)
+        self._failures = 0
+        self._retry_after = 0
+        self._rejected = False
+        self.save()
+
+    def invalidate(self):
+        # The Envoy refused the token, whatever its claims say
+        self._rejected = True
+
+    def reset(self):
+        # Credentials changed, renew the token on the next poll without waiting any backoff
+        self._rejected = True
+        self._failures = 0
+        self._retry_after = 0
+
+    def is_valid(self, now=None):
+        if now is None:
+            now = time.time()
+        # Tokens we cannot decode are trusted until the Envoy rejects them
+        if not self.token or self._rejected:
+            return False
+        return not self.expires or now < self.expires
+
+    def needs_refresh(self, now=None):
+        if now is None:
+            now = time.time()
+        if now < self._retry_after:
+            return False
+        if not self.is_valid(now):
+            return True
+        if not self.expires:
+            return False
+        lifetime = self.expires - self.issued if self.issued else 0
+        margin = lifetime * self._refresh_ratio if lifetime > 0 else 24 * 3600
+        return now >= self.expires - margin
+
+    def failed(self, now=None):
+        if now is None:
+            now = time.time()
+        self._failures += 1
+        backoff = min(self._min_backoff * 2 ** (self._failures - 1), self._max_backoff)
+        self._retry_after = now + backoff
+        logger.warning('Envoy token refresh failed %s time(s), next attempt in %s seconds', self._failures, backoff)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Timed spans of the control ticks, written as one JSON line per traced tick. Spans opened
+# outside of a traced tick cost a method call returning a shared no-op context manager.
+
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+null_span = NullSpan()
+
+class NullTracer():
+    def tick(self):
+        return null_span
+
+    def span(self, name):
+        return null_span
+
+null_tracer = NullTracer()
+
+class Span():
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._parent = self._tracer._stack[-1] if self._tracer._stack else None
+        self._tracer._stack.append(self._name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        tracer = self._tracer
+        tracer._stack.pop()
+        if tracer._spans is not None:
+            tracer._spans.append({'name': self._name, 'parent': self._parent,
+                                  'start': round((self._start - tracer._tick_start) * 1000, 3),
+                                  'duration': round((end - self._start) * 1000, 3)})
+        return False
+
+class Tick():
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __enter__(self):
+        self._tracer._begin()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer._end(exc[0])
+        return False
+
+class Tracer():
+    # Traces a share of the control ticks. When profile is 'cprofile' or 'tracemalloc' the
+    # first profile_ticks ticks are profiled too and a report is written once they are done.
+    # Ticks await I/O, so the profile also covers whatever else the loop ran meanwhile.
+    profiling = False
+
+    def __init__(self, filename, sample=1.0, name=None, profile=None, profile_ticks=100, report=None):
+        if profile not in (None, 'cprofile', 'tracemalloc'):
+            raise ValueError(f'unknown profiler {profile}, expected cprofile or tracemalloc')
+        self._filename = filename
+        self._sample = sample
+        self._name = name
+        self._profile = profile
+        self._profile_ticks = profile_ticks
+        self._report = report or os.path.splitext(filename)[0] + '.profile.txt'
+        self._profiler = None
+        self._profiled = 0
+        self._ticks = 0
+        self._file = None
+        self._spans = None
+        self._stack = []
+        self._tick_start = 0
+        self._random = random.Random()
+
+    def tick(self):
+        return Tick(self)
+
+    def span(self, name):
+        if self._spans is None:
+            return null_span
+        return Span(self, name)
+
+    def _begin(self):
+        self._ticks += 1
+        if self._random.random() < self._sample:
+            self._spans = []
+            self._stack = ['tick']
+        self.__start_profiler()
+        self._tick_start = time.perf_counter()
+
+    def _end(self, error):
+        duration = time.perf_counter() - self._tick_start
+        self.__stop_profiler()
+        if self._spans is None:
+            return
+        record = {'ts': round(time.time(), 3), 'tick': self._ticks, 'duration': round(duration * 1000, 3), 'spans': self._spans}
+        if self._name:
+            record['group'] = self._name
+        if error:
+            record['error'] = error.__name__
+        self._spans = None
+        self._stack = []
+        self.__write(record)
+
+    def __write(self, record):
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self._filename) or '.', exist_ok=True)
+                self._file = open(self._filename, 'a')
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        except OSError as e:
+            logger.warning('failed writing tick trace to %s: %s', self._filename, e)
+
+    def __start_profiler(self):
+        if not self._profile or self._profiled >= self._profile_ticks:
+            return
+        if self._profile == 'cprofile':
+            if self._profiler is None:
+                if Tracer.profiling:
+                    # Only one profiler can be active in the process
+                    logger.warning('another group is being profiled, not profiling %s', self._name)
+                    self._profile = None
+                    return
+                import cProfile
+                Tracer.profiling = True
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self._profiled == 0:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+
+    def __stop_profiler(self):
+        if not self._profile or self._profiled >= self._profile_ticks:
+            return
+        if self._profiler:
+            self._profiler.disable()
+        self._profiled += 1
+        if self._profiled == self._profile_ticks:
+            self.__write_report()
+
+    def __write_report(self):
+        try:
+            with open(self._report, 'w') as f:
+                if self._profile == 'cprofile':
+                    import pstats
+                    f.write(f'cProfile of {self._profiled} control ticks\n')
+                    pstats.Stats(self._profiler, stream=f).sort_stats('cumulative').print_stats(40)
+                    self._profiler = None
+                    Tracer.profiling = False
+                else:
+                    import tracemalloc
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                    f.write(f'Memory allocated during {self._profiled} control ticks, by line\n')
+                    for stat in snapshot.statistics('lineno')[:30]:
+                        f.write(f'{stat}\n')
+            logger.info('wrote profile of %s control ticks to %s', self._profiled, self._report)
+        except OSError as e:
+            logger.warning('failed writing profile report to %s: %s', self._report, e)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,112 @@
+import os
+import struct
+import ctypes
+import ctypes.util
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Editors either rewrite the file in place or replace it with a renamed copy
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+EVENT = struct.Struct('iIII')
+
+def inotify_watch(directory, mask):
+    # Returns a non blocking inotify file descriptor watching directory, None when
+    # inotify is not available on this system
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        init = libc.inotify_init1
+        add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        logger.debug('inotify_init1 failed with error %s', ctypes.get_errno())
+        return None
+    if add_watch(fd, os.fsencode(directory), mask) < 0:
+        logger.debug('inotify_add_watch on %s failed with error %s', directory, ctypes.get_errno())
+        os.close(fd)
+        return None
+    return fd
+
+class FileWatcher():
+    # Calls callback once a file has been written. Events are debounced by delay seconds
+    # since editors save in several steps. Uses inotify on Linux and falls back to polling
+    # the modification time every interval seconds elsewhere.
+    def __init__(self, filename, callback, interval=5, delay=0.5):
+        self._filename = os.path.abspath(filename)
+        self._name = os.fsencode(os.path.basename(self._filename))
+        self._callback = callback
+        self._interval = interval
+        self._delay = delay
+        self._loop = None
+        self._handle = None
+        self._fd = None
+
+    def __fire(self):
+        self._handle = None
+        try:
+            self._callback()
+        except Exception:
+            logger.exception('failed handling change of %s', self._filename)
+
+    def __schedule(self):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._loop.call_later(self._delay, self.__fire)
+
+    def __on_events(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        matched = False
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            if data[offset:offset + length].rstrip(b'\0') == self._name:
+                matched = True
+            offset += length
+        if matched:
+            self.__schedule()
+
+    def __stat(self):
+        try:
+            st = os.stat(self._filename)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    async def __poll(self):
+        last = self.__stat()
+        while True:
+            await asyncio.sleep(self._interval)
+            current = self.__stat()
+            if current != last:
+                last = current
+                if current:
+                    self.__schedule()
+
+    async def task(self, use_inotify=True):
+        self._loop = asyncio.get_running_loop()
+        if use_inotify:
+            self._fd = inotify_watch(os.path.dirname(self._filename), IN_CLOSE_WRITE | IN_MOVED_TO)
+        try:
+            if self._fd is None:
+                logger.debug('polling %s for changes every %s seconds', self._filename, self._interval)
+                await self.__poll()
+            else:
+                logger.debug('watching %s for changes with inotify', self._filename)
+                self._loop.add_reader(self._fd, self.__on_events)
+                await self._loop.create_future()
+        finally:
+            if self._fd is not None:
+                self._loop.remove_reader(self._fd)
+                os.close(self._fd)
+                self._fd = None
+            if self._handle:
+                self._handle.cancel()
+                self._handle = None